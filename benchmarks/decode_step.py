@@ -0,0 +1,78 @@
+"""
+Measures the per-token latency of the decoder, with the KV cache of `PyTorchInference` and
+with `TextDecoder.decode_step()`, eager and compiled with `torch.compile`:
+
+    python benchmarks/decode_step.py --model tiny --device cpu
+"""
+
+import argparse
+import time
+
+import torch
+
+import whisper
+from whisper.decoding import Inference, PyTorchInference, StaticInference
+
+
+def benchmark(
+    model: whisper.Whisper,
+    inference: Inference,
+    n_tokens: int,
+    batch_size: int,
+    n_runs: int = 3,
+) -> float:
+    """Returns the median seconds per decoding step after the first, over `n_runs` runs"""
+    tokenizer = whisper.tokenizer.get_tokenizer(model.is_multilingual)
+    dtype = next(model.decoder.parameters()).dtype
+    mel = torch.randn(batch_size, model.dims.n_mels, 3000, device=model.device)
+    audio_features = model.embed_audio(mel.to(dtype))
+    sot_sequence = list(tokenizer.sot_sequence)
+
+    timings = []
+    for _ in range(n_runs + 1):  # the first run warms up, and compiles
+        tokens = torch.tensor([sot_sequence] * batch_size, device=model.device)
+        logits = inference.logits(tokens, audio_features)
+        for i in range(n_tokens):
+            if i == 1:  # the first step may differ, e.g. for the prompt
+                if model.device.type == "cuda":
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+            next_tokens = logits[:, -1].argmax(dim=-1, keepdim=True)
+            tokens = torch.cat([tokens, next_tokens], dim=-1)
+            logits = inference.logits(tokens, audio_features)
+        if model.device.type == "cuda":
+            torch.cuda.synchronize()
+        timings.append((time.perf_counter() - start) / (n_tokens - 1))
+        inference.cleanup_caching()
+
+    return sorted(timings[1:])[n_runs // 2]
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--model", default="tiny", help="name or path of the Whisper model to use")
+    parser.add_argument("--device", default="cpu", help="device to use for PyTorch inference")
+    parser.add_argument("--fp16", action="store_true", help="run in float16 rather than float32")
+    parser.add_argument("--n_tokens", type=int, default=100, help="number of decoding steps to time")
+    parser.add_argument("--batch_size", type=int, default=1, help="number of sequences decoded together")
+    # fmt: on
+    args = parser.parse_args()
+
+    model = whisper.load_model(args.model, device=args.device)
+    model.prepare_for_inference(torch.float16 if args.fp16 else torch.float32)
+
+    n_initial = len(whisper.tokenizer.get_tokenizer(model.is_multilingual).sot_sequence)
+    inferences = {
+        "kv cache": PyTorchInference(model, n_initial),
+        "decode_step, eager": StaticInference(model, n_initial, compile=False),
+        "decode_step, compiled": StaticInference(model, n_initial, compile=True),
+    }
+    with torch.no_grad():
+        for name, inference in inferences.items():
+            seconds = benchmark(model, inference, args.n_tokens, args.batch_size)
+            print(f"{name:>24}: {seconds * 1000:.2f} ms/token")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Measures the cold-start time and the peak resident memory of loading a model, each in a fresh
+process, with `load_model()` against the way it used to load checkpoints: reading the whole
+checkpoint with `torch.load`, initializing a new model, and copying the weights into it:
+
+    python benchmarks/load_model.py --model large-v3
+
+Drop the page cache first, e.g. with `echo 3 | sudo tee /proc/sys/vm/drop_caches`, to include
+reading the checkpoint from disk in the times.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import torch
+
+import whisper
+from whisper.model import ModelDimensions, Whisper
+
+
+def load_legacy(path: str, device: str) -> Whisper:
+    with open(path, "rb") as fp:
+        checkpoint = torch.load(fp, map_location=device, weights_only=True)
+    model = Whisper(ModelDimensions(**checkpoint["dims"]))
+    model.load_state_dict(checkpoint["model_state_dict"])
+    return model.to(device)
+
+
+def measure(method: str, path: str, device: str, dtype: str):
+    start = time.perf_counter()
+    if method == "legacy":
+        load_legacy(path, device)
+    else:
+        whisper.load_model(path, device=device, dtype=dtype or None)
+    elapsed = time.perf_counter() - start
+
+    # kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps({"elapsed": elapsed, "peak_rss": peak_rss}))
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--model", default="large-v3", help="name or path of the Whisper model to load")
+    parser.add_argument("--model_dir", default=None, help="the path to save model files; uses ~/.cache/whisper by default")
+    parser.add_argument("--device", default="cpu", help="device to load the model onto")
+    parser.add_argument("--dtype", default="", choices=["", "fp16", "bf16", "fp32"], help="the dtype to pass to load_model(), if any")
+    parser.add_argument("--repeats", type=int, default=3, help="number of processes per method, of which the fastest is reported")
+    parser.add_argument("--measure", nargs=2, metavar=("METHOD", "PATH"), help=argparse.SUPPRESS)
+    # fmt: on
+    args = parser.parse_args()
+
+    if args.measure:
+        return measure(*args.measure, args.device, args.dtype)
+
+    path = args.model
+    if path in whisper.available_models():
+        root = args.model_dir or os.path.join(
+            os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "whisper"
+        )
+        path = whisper._download(whisper._MODELS[path], root, in_memory=False)
+
+    size = os.path.getsize(path)
+    print(f"checkpoint: {path} ({size / 2**20:.0f} MiB)")
+    for method in ["legacy", "load_model"]:
+        runs = []
+        for _ in range(args.repeats):
+            command = [sys.executable, __file__, "--measure", method, path]
+            command += ["--device", args.device, "--dtype", args.dtype]
+            output = subprocess.run(command, check=True, capture_output=True, text=True)
+            runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+        elapsed = min(run["elapsed"] for run in runs)
+        peak_rss = min(run["peak_rss"] for run in runs)
+        print(
+            f"{method:>10}: {elapsed:.2f} s, peak RSS {peak_rss / 2**20:.0f} MiB "
+            f"({peak_rss / size:.2f}x the checkpoint)"
+        )
+
+
+if __name__ == "__main__":
+    main()
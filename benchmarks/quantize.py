@@ -0,0 +1,86 @@
+"""
+Compares a model in float32 and quantized to int8 with `load_model(..., quantize="int8")` on CPU:
+the real-time factor of transcribing an audio file, the size of the weights, and the word error
+rate against a reference transcript:
+
+    python benchmarks/quantize.py --model medium
+"""
+
+import argparse
+import io
+import os
+import time
+
+import torch
+
+import whisper
+from whisper.audio import SAMPLE_RATE
+from whisper.normalizers import EnglishTextNormalizer
+
+JFK_PATH = os.path.join(os.path.dirname(__file__), "..", "tests", "jfk.flac")
+JFK_TEXT = (
+    "And so my fellow Americans, ask not what your country can do for you, "
+    "ask what you can do for your country."
+)
+
+
+def weights_size(model: whisper.Whisper) -> int:
+    """Returns the number of bytes of the serialized state dict, including packed weights"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    normalizer = EnglishTextNormalizer()
+    reference, hypothesis = (
+        normalizer(reference).split(),
+        normalizer(hypothesis).split(),
+    )
+
+    # the edit distance between the two sequences of words
+    distances = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        previous, distances[0] = distances[0], i
+        for j, hyp_word in enumerate(hypothesis, 1):
+            substitution = previous + (ref_word != hyp_word)
+            previous = distances[j]
+            distances[j] = min(substitution, distances[j] + 1, distances[j - 1] + 1)
+
+    return distances[-1] / max(len(reference), 1)
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--model", default="base", help="name or path of the Whisper model to use")
+    parser.add_argument("--audio", default=JFK_PATH, help="the audio file to transcribe")
+    parser.add_argument("--reference", default=JFK_TEXT, help="the reference transcript of the audio")
+    parser.add_argument("--threads", type=int, default=0, help="number of threads used by torch for CPU inference")
+    # fmt: on
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    audio = whisper.load_audio(args.audio)
+    duration = len(audio) / SAMPLE_RATE
+    for quantize in [None, "int8"]:
+        model = whisper.load_model(args.model, device="cpu", quantize=quantize)
+        model.transcribe(audio[:SAMPLE_RATE], fp16=False)  # warm up
+
+        start = time.perf_counter()
+        result = model.transcribe(audio, fp16=False, language="en")
+        elapsed = time.perf_counter() - start
+
+        print(
+            f"{quantize or 'float32':>8}: "
+            f"RTF {elapsed / duration:.3f}, "
+            f"weights {weights_size(model) / 2**20:.1f} MiB, "
+            f"WER {word_error_rate(args.reference, result['text']):.1%}"
+        )
+        print(f"{'':>10}{result['text'].strip()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Compares transcribing short clips padded to a full 30-second window with encoding them only up to
+their length, with `transcribe(..., truncate_audio=True)`: the real-time factor of each, and the
+word error rate of the truncated transcripts against those of the full windows:
+
+    python benchmarks/truncate_audio.py --model base --durations 2 4 8
+"""
+
+import argparse
+import time
+
+import torch
+from quantize import JFK_PATH, word_error_rate
+
+import whisper
+from whisper.audio import SAMPLE_RATE
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--model", default="base", help="name or path of the Whisper model to use")
+    parser.add_argument("--audio", default=JFK_PATH, help="the audio file to cut the clips from")
+    parser.add_argument("--durations", type=float, nargs="+", default=[2.0, 4.0, 8.0], help="the lengths of the clips in seconds, taken from the start of the audio")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", help="device to use for PyTorch inference")
+    parser.add_argument("--repeats", type=int, default=3, help="number of timed runs per clip, of which the fastest is reported")
+    # fmt: on
+    args = parser.parse_args()
+
+    model = whisper.load_model(args.model, device=args.device)
+    options = dict(language="en", temperature=0.0, fp16=args.device != "cpu")
+    audio = whisper.load_audio(args.audio)
+    model.transcribe(audio[:SAMPLE_RATE], **options)  # warm up
+
+    for duration in args.durations:
+        clip = audio[: int(duration * SAMPLE_RATE)]
+        results = {}
+        for truncate_audio in [False, True]:
+            elapsed = float("inf")
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                result = model.transcribe(
+                    clip, truncate_audio=truncate_audio, **options
+                )
+                elapsed = min(elapsed, time.perf_counter() - start)
+            results[truncate_audio] = (elapsed / duration, result["text"])
+
+        (full_rtf, full_text), (truncated_rtf, truncated_text) = results.values()
+        print(
+            f"{duration:5.1f} s: "
+            f"RTF {full_rtf:.3f} -> {truncated_rtf:.3f} "
+            f"({full_rtf / truncated_rtf:.1f}x), "
+            f"WER against full windows {word_error_rate(full_text, truncated_text):.1%}"
+        )
+        print(f"{'':>9}{full_text.strip()}")
+        print(f"{'':>9}{truncated_text.strip()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,9 @@ import random as rand
 
 import numpy
 import pytest
+import torch
+
+from whisper.model import ModelDimensions, Whisper
 
 
 def pytest_configure(config):
@@ -12,3 +15,14 @@ def pytest_configure(config):
 def random():
     rand.seed(42)
     numpy.random.seed(42)
+
+
+@pytest.fixture
+def model():
+    """A small multilingual model with random weights"""
+    torch.manual_seed(0)
+    dims = ModelDimensions(80, 1500, 64, 4, 2, 51865, 448, 64, 4, 2)
+    model = Whisper(dims).eval()
+    with torch.no_grad():
+        model.decoder.positional_embedding.normal_(0, 0.01)
+    return model
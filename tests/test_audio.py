@@ -1,8 +1,40 @@
 import os.path
+import wave
 
 import numpy as np
+import pytest
+import torch
 
-from whisper.audio import SAMPLE_RATE, load_audio, log_mel_spectrogram
+from whisper.audio import (
+    HOP_LENGTH,
+    N_FFT,
+    N_SAMPLES,
+    SAMPLE_RATE,
+    ArraySource,
+    AudioStream,
+    BytesSource,
+    ChunkedLogMel,
+    ClipSource,
+    FileSource,
+    Int16Source,
+    available_mel_frontends,
+    load_audio,
+    load_audio_channels,
+    load_audio_stream,
+    log_mel_spectrogram,
+    normalize_log_mel,
+    resample,
+    resolve_mel_frontend,
+)
+
+
+def write_wav(path: str, pcm: np.ndarray, rate: int = SAMPLE_RATE):
+    """Writes 16-bit samples of shape (n_samples,) or (n_channels, n_samples) to a WAV file"""
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1 if pcm.ndim == 1 else len(pcm))
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(pcm.T.astype("<i2").tobytes())
 
 
 def test_audio():
@@ -17,3 +49,224 @@ def test_audio():
 
     assert np.allclose(mel_from_audio, mel_from_file)
     assert mel_from_audio.max() - mel_from_audio.min() <= 2.0
+
+
+def test_audio_stream():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path)
+
+    blocks = list(load_audio_stream(audio_path, chunk_length=4))
+    assert all(len(block) == 4 * SAMPLE_RATE for block in blocks[:-1])
+    assert np.array_equal(np.concatenate(blocks), audio)
+
+    # the frames that transcribe() slices from the spectrogram padded with 30 seconds of silence
+    mel = log_mel_spectrogram(audio, padding=N_SAMPLES)[:, : len(audio) // HOP_LENGTH]
+    scan = ChunkedLogMel(padding=N_FFT, mode="raw")
+    for block in load_audio_stream(audio_path):
+        scan.feed(block)
+    scan.flush()
+
+    for log_max in [None, scan.log_max]:
+        stream = AudioStream(
+            load_audio_stream(audio_path, chunk_length=4), log_max=log_max
+        )
+        for start in range(0, mel.shape[-1], 300):
+            window = stream.window(start, 300)
+            assert window.shape[-1] == min(300, mel.shape[-1] - start)
+            assert np.allclose(
+                window, mel[:, start : start + window.shape[-1]], atol=1e-5
+            )
+
+        assert stream.num_frames == mel.shape[-1]
+        assert stream.window(mel.shape[-1], 300).shape[-1] == 0
+
+
+def test_audio_sources(tmp_path):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path)
+    pcm = np.clip(audio * 32768, -32768, 32767).astype(np.int16)
+    wav_path = str(tmp_path / "jfk.wav")
+    write_wav(wav_path, pcm)
+
+    # the frames that transcribe() slices from the spectrogram padded with 30 seconds of silence
+    log_spec = log_mel_spectrogram(pcm.astype(np.float32) / 32768, padding=N_SAMPLES)
+    log_max = (log_spec * 4 - 4).max().item()  # undo the normalization
+    mel = log_spec[:, : len(audio) // HOP_LENGTH]
+
+    with open(audio_path, "rb") as f:
+        data = f.read()
+    sources = [
+        ArraySource(pcm.astype(np.float32) / 32768, log_max=log_max),
+        Int16Source(pcm.tobytes(), log_max=log_max),
+        FileSource(wav_path, log_max=log_max),
+        BytesSource(data, log_max=log_max),
+    ]
+    for source in sources:
+        assert source.num_frames == mel.shape[-1]
+        for start in [0, 1, 2, 250, mel.shape[-1] - 100]:
+            window = source.window(start, 300)
+            assert window.shape[-1] == min(300, mel.shape[-1] - start)
+            assert np.allclose(
+                window, mel[:, start : start + window.shape[-1]], atol=1e-4
+            )
+        assert source.window(mel.shape[-1]).shape[-1] == 0
+
+    # without log_max, each window is normalized against its own maximum
+    window = ArraySource(audio).window(0, 300)
+    assert np.isclose(window.max() - window.min(), 2.0)
+
+
+@pytest.mark.parametrize("backend", ["wav", "ffmpeg"])
+def test_audio_range(tmp_path, backend):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    pcm = (load_audio(audio_path) * 32768).astype(np.int16)
+    wav_path = str(tmp_path / "jfk.wav")
+    write_wav(wav_path, pcm)
+    audio = pcm.astype(np.float32) / 32768
+
+    clip = load_audio(wav_path, start=2.5, duration=3.0, backend=backend)
+    assert np.array_equal(clip, audio[40000:88000])
+    clip = load_audio(wav_path, start=9.0, backend=backend)
+    assert np.array_equal(clip, audio[144000:])
+
+    # the frames within each clip are the same as those of the whole file
+    clips = [(1.0, 3.5), (7.0, None)]
+    mel = log_mel_spectrogram(audio, padding=N_SAMPLES)
+    log_spec = (mel * 4 - 4)[:, : len(audio) // HOP_LENGTH]
+    source = ClipSource(wav_path, clips, log_max=log_spec.max().item())
+    assert source.num_frames == log_spec.shape[-1]
+    for start, n_frames in [(100, 250), (700, 3000)]:
+        window = source.window(start, n_frames)
+        expected = mel[:, start : start + window.shape[-1]]
+        assert np.allclose(window, expected, atol=1e-4)
+
+    # and the audio between the clips is silent
+    assert np.all(source.samples(56000 + N_FFT, 112000 - N_FFT) == 0)
+
+
+def test_audio_channels(tmp_path):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path)
+    pcm = (np.stack([audio, audio[::-1], np.zeros_like(audio)]) * 32767).astype(
+        np.int16
+    )
+    wav_path = str(tmp_path / "channels.wav")
+    write_wav(wav_path, pcm)
+
+    channels = load_audio_channels(wav_path)
+    assert channels.dtype == np.float32
+    assert np.array_equal(channels, pcm / np.float32(32768))
+
+    # resampling happens in the same pass
+    assert load_audio_channels(wav_path, sr=8000).shape == (3, len(audio) // 2)
+
+
+@pytest.mark.parametrize("orig_sr", [8000, 22050, 44100, 48000])
+def test_resample(orig_sr):
+    t = np.arange(2 * orig_sr) / orig_sr
+    tones = np.stack([np.sin(2 * np.pi * f * t) for f in [440, 1000, 2000]])
+    tones = tones.astype(np.float32)
+
+    resampled = resample(tones, orig_sr)
+    assert resampled.shape == (3, 2 * SAMPLE_RATE)
+    t = np.arange(2 * SAMPLE_RATE) / SAMPLE_RATE
+    for f, signal in zip([440, 1000, 2000], resampled):
+        expected = np.sin(2 * np.pi * f * t)
+        assert np.allclose(signal[400:-400], expected[400:-400], atol=1e-3)
+
+    # tensors and single waveforms give the same result
+    assert np.allclose(resample(torch.from_numpy(tones[1]), orig_sr), resampled[1])
+
+
+@pytest.mark.parametrize("padding", [0, N_SAMPLES])
+@pytest.mark.parametrize("block_size", [150, 4000, 123457])
+def test_chunked_log_mel(padding, block_size):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path)
+    mel = log_mel_spectrogram(audio, padding=padding)
+    blocks = [audio[i : i + block_size] for i in range(0, len(audio), block_size)]
+
+    raw = ChunkedLogMel(padding=padding, mode="raw")
+    frames = torch.cat([raw.feed(block) for block in blocks] + [raw.flush()], dim=-1)
+    assert frames.shape == mel.shape
+    assert np.allclose(normalize_log_mel(frames, raw.log_max), mel, atol=1e-6)
+
+    exact = ChunkedLogMel(padding=padding, mode="exact", log_max=raw.log_max)
+    frames = torch.cat([exact.feed(block) for block in blocks] + [exact.flush()], -1)
+    assert np.allclose(frames, mel, atol=1e-6)
+
+    lookahead = ChunkedLogMel(padding=padding, lookahead=100)
+    for block in blocks:
+        assert lookahead.pending.shape[-1] <= 100 + block_size // HOP_LENGTH
+        lookahead.feed(block)
+    assert lookahead.flush().shape[-1] >= lookahead.lookahead
+
+
+def test_chunked_log_mel_device():
+    # the meta device stands in for a GPU: the frames have shapes but no values
+    blocks = [torch.zeros(n) for n in [100, 4000, 20000]]
+    mel = log_mel_spectrogram(torch.cat(blocks), padding=N_SAMPLES)
+
+    chunked = ChunkedLogMel(padding=N_SAMPLES, mode="exact", log_max=0.0, device="meta")
+    frames = [chunked.feed(block) for block in blocks] + [chunked.flush()]
+    assert all(f.is_meta for f in frames)
+    assert sum(f.shape[-1] for f in frames) == mel.shape[-1]
+
+
+@pytest.mark.parametrize("size", [0, 6, 30])
+def test_truncated_wav(tmp_path, size):
+    wav_path = str(tmp_path / "jfk.wav")
+    write_wav(wav_path, np.zeros(1000, dtype=np.int16))
+    with open(wav_path, "r+b") as f:
+        f.truncate(size)
+
+    # the header is not read by the memory-mapped reader, which leaves the file to ffmpeg
+    with pytest.raises(RuntimeError, match="Failed to load audio"):
+        load_audio(wav_path, backend="wav")
+    with pytest.raises(RuntimeError, match="Failed to load audio"):
+        load_audio(wav_path)
+
+
+def test_audio_backends(tmp_path):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio, backend = load_audio(audio_path, backend="ffmpeg", return_backend=True)
+    assert backend == "ffmpeg"
+
+    wav_path = str(tmp_path / "jfk.wav")
+    write_wav(wav_path, (audio * 32768).astype(np.int16))
+
+    wav_audio, backend = load_audio(wav_path, return_backend=True)
+    assert backend == "wav"
+    assert np.array_equal(wav_audio, audio)
+
+    # other sample rates are not handled by the memory-mapped reader
+    assert load_audio(wav_path, sr=8000, return_backend=True)[1] != "wav"
+
+    soundfile = pytest.importorskip("soundfile")
+    flac_path = str(tmp_path / "jfk.flac")
+    soundfile.write(flac_path, audio, SAMPLE_RATE, subtype="PCM_16")
+    flac_audio, backend = load_audio(flac_path, return_backend=True)
+    assert backend == "soundfile"
+    assert np.array_equal(flac_audio, load_audio(flac_path, backend="ffmpeg"))
+
+
+@pytest.mark.parametrize("frontend", available_mel_frontends())
+def test_mel_frontends(frontend):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = torch.from_numpy(load_audio(audio_path))
+
+    expected = log_mel_spectrogram(audio, padding=N_SAMPLES)
+    mel = log_mel_spectrogram(audio, padding=N_SAMPLES, frontend=frontend)
+    assert mel.shape == expected.shape
+    assert np.allclose(mel, expected, atol=1e-4)
+
+    # batched inputs, and clips shorter than a second
+    batch = audio[: 2 * 6000].reshape(2, 6000)
+    mel = log_mel_spectrogram(batch, frontend=frontend)
+    assert np.allclose(mel, log_mel_spectrogram(batch), atol=1e-4)
+
+
+def test_auto_mel_frontend():
+    assert resolve_mel_frontend("auto") in available_mel_frontends()
+    with pytest.raises(ValueError):
+        resolve_mel_frontend("unknown")
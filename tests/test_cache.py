@@ -0,0 +1,87 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+import torch
+
+import whisper.cache
+from whisper.audio import N_FRAMES, N_SAMPLES, log_mel_spectrogram
+from whisper.cache import EncoderCache, MelCache
+from whisper.model import Whisper
+
+
+def test_mel_cache(tmp_path, monkeypatch):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    cache = MelCache(str(tmp_path / "cache"))
+
+    mel = cache.log_mel_spectrogram(audio_path, 80, padding=N_SAMPLES)
+    assert np.allclose(mel, log_mel_spectrogram(audio_path, 80, padding=N_SAMPLES))
+    assert len(os.listdir(cache.root)) == 1
+
+    def fail(*args, **kwargs):
+        pytest.fail("the spectrogram should have been read from the cache")
+
+    monkeypatch.setattr(whisper.cache, "log_mel_spectrogram", fail)
+    assert np.array_equal(cache.log_mel_spectrogram(audio_path, 80, N_SAMPLES), mel)
+
+
+def test_mel_cache_eviction(tmp_path):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    copy_path = str(tmp_path / "copy.flac")
+    shutil.copy(audio_path, copy_path)
+    with open(copy_path, "ab") as f:
+        f.write(b"\0")  # a different content hash for the same audio
+
+    entry_size = 80 * 1100 * 4
+    cache = MelCache(str(tmp_path / "cache"), max_size=int(entry_size * 1.5))
+    first = cache.path(audio_path, 80)
+    cache.log_mel_spectrogram(audio_path, 80)
+    assert os.path.exists(first)
+
+    cache.log_mel_spectrogram(copy_path, 80)
+    assert not os.path.exists(first)
+    assert os.path.exists(cache.path(copy_path, 80))
+
+
+def test_encoder_cache(model, monkeypatch):
+    mel = torch.randn(2, 80, N_FRAMES)
+    features_size = 1500 * 64 * 4
+
+    cache = EncoderCache(max_size=int(features_size * 1.5))
+    features = cache.embed_audio(model, mel[0])
+    with torch.no_grad():
+        assert torch.allclose(features, model.embed_audio(mel[:1])[0], atol=1e-5)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    def fail(*args, **kwargs):
+        pytest.fail("the audio features should have been read from the cache")
+
+    with monkeypatch.context() as m:
+        m.setattr(model, "embed_audio", fail)
+        assert torch.equal(cache.embed_audio(model, mel[0].clone()), features)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # only the window that is not in the cache is encoded, evicting the other one
+    assert torch.equal(cache.embed_audio(model, mel)[0], features)
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert len(cache.entries) == 1 and cache.size == features_size
+
+    # the features of another model or dtype are cached separately
+    cache.embed_audio(Whisper(model.dims).eval(), mel[1])
+    cache.embed_audio(model.prepare_for_inference(torch.bfloat16), mel[1].bfloat16())
+    assert cache.misses == 4
+
+    # each entry holds the features of its window alone, not the batch they were encoded in
+    cache.clear()
+    cache.embed_audio(model, mel)
+    [(_, cached)] = cache.entries.values()
+    assert cached.untyped_storage().nbytes() == features_size
+
+    # as many entries as allowed are kept, whatever their size
+    cache = EncoderCache(max_entries=2)
+    cache.embed_audio(model, mel.bfloat16())
+    cache.embed_audio(model, mel[0])
+    assert len(cache.entries) == 2 and cache.misses == 3
+    cache.embed_audio(model, mel[1].bfloat16())
+    assert cache.hits == 1
@@ -0,0 +1,69 @@
+import base64
+import copy
+import gzip
+
+import pytest
+import torch
+
+import whisper
+from whisper.convert import read_converted, read_header, save_converted
+
+pytestmark = pytest.mark.skipif(
+    torch.__version__ < "2.1",
+    reason="loading converted models needs torch 2.1 or later",
+)
+
+
+@pytest.mark.parametrize("dtype", ["fp32", "bf16"])
+def test_convert(model, tmp_path, dtype):
+    path = str(tmp_path / "model.bin")
+    heads = torch.zeros(2, 4, dtype=torch.bool)
+    heads[1, 2] = True
+    dump = base64.b85encode(gzip.compress(heads.numpy().tobytes()))
+
+    expected = copy.deepcopy(model).prepare_for_inference(whisper.DTYPES[dtype])
+    save_converted(copy.deepcopy(model), path, dtype, dump)
+    assert read_header(path)["dims"] == expected.dims.__dict__
+    assert read_header(__file__) is None
+
+    loaded = whisper.load_model(path, device="cpu")
+    assert loaded.decoder.blocks[0].attn.query.weight.dtype == whisper.DTYPES[dtype]
+    assert loaded.decoder.ln.weight.dtype == torch.float32
+    assert torch.equal(loaded.alignment_heads.to_dense(), heads)
+    assert not any(t.is_meta for t in [*loaded.parameters(), *loaded.buffers()])
+
+    _, tensors = read_converted(path)
+    output_projection = tensors["decoder.output_projection"]
+    assert torch.equal(loaded.decoder.output_projection, output_projection)
+
+    mel = torch.randn(1, 80, 3000).to(whisper.DTYPES[dtype])
+    tokens = torch.tensor([[50258, 50259, 50360, 440]])
+    with torch.no_grad():
+        assert torch.equal(loaded(mel, tokens), expected(mel, tokens))
+
+
+def test_convert_int8(model, tmp_path):
+    path = str(tmp_path / "model.bin")
+    expected = copy.deepcopy(model).quantize("int8")
+    save_converted(copy.deepcopy(model), path, "int8")
+
+    loaded = whisper.load_model(path)
+    assert loaded.device == torch.device("cpu")
+
+    mel = torch.randn(1, 80, 3000)
+    tokens = torch.tensor([[50258, 50259, 50360, 440]])
+    with torch.no_grad():
+        assert torch.equal(loaded(mel, tokens), expected(mel, tokens))
+
+    with pytest.raises(ValueError):
+        whisper.load_model(path, dtype="fp16")
+
+
+def test_load_bf16_fallback(model, tmp_path, monkeypatch):
+    path = str(tmp_path / "model.bin")
+    save_converted(copy.deepcopy(model), path, "fp32")
+    monkeypatch.setattr(whisper, "bf16_supported", lambda device: False)
+
+    with pytest.warns(UserWarning, match="BF16"):
+        loaded = whisper.load_model(path, device="cpu", dtype="bf16")
+    assert loaded.decoder.blocks[0].attn.query.weight.dtype == torch.float32
@@ -0,0 +1,324 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+import pytest
+import torch
+
+import whisper
+from whisper.decoding import DecodingOptions, DecodingTask, is_audio_features
+from whisper.model import KVCache, Linear, MultiHeadAttention, Whisper
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16])
+def test_prepare_for_inference(model, dtype):
+    mel = torch.randn(2, 80, 3000)
+    tokens = torch.tensor([[50258, 50259, 50360, 440]] * 2)
+    with torch.no_grad():
+        expected = model.logits(tokens, model.embed_audio(mel.to(dtype)))
+
+    prepared = copy.deepcopy(model).prepare_for_inference(dtype)
+    assert prepared.decoder.blocks[0].attn.query.weight.dtype == dtype
+    assert prepared.decoder.ln.weight.dtype == torch.float32
+    assert prepared.decoder.output_projection.dtype == dtype
+    assert "output_projection" not in prepared.state_dict()
+
+    with torch.no_grad():
+        logits = prepared.logits(tokens, prepared.embed_audio(mel.to(dtype)))
+    assert torch.equal(logits, expected)
+
+
+def test_fuse_qkv(model):
+    mel = torch.randn(2, 80, 3000)
+    tokens = torch.tensor([[50258, 50259, 50360, 440]] * 2)
+    with torch.no_grad():
+        expected = model.logits(tokens, model.embed_audio(mel))
+
+    fused = copy.deepcopy(model).prepare_for_inference(torch.float32, fuse_qkv=True)
+    assert fused.state_dict().keys() == model.state_dict().keys()
+    with torch.no_grad():
+        audio_features = fused.embed_audio(mel)
+        assert torch.allclose(fused.logits(tokens, audio_features), expected, atol=1e-4)
+
+        # with the KV cache, one token at a time
+        kv_cache = KVCache(fused.dims.n_text_ctx)
+        logits = [fused.decoder(tokens[:, :2], audio_features, kv_cache=kv_cache)]
+        for i in range(2, tokens.shape[1]):
+            logits.append(fused.decoder(tokens[:, i : i + 1], audio_features, kv_cache))
+        assert torch.allclose(torch.cat(logits, dim=1), expected, atol=1e-4)
+
+    # loading a checkpoint updates the packed weights
+    state_dict = copy.deepcopy(model.state_dict())
+    state_dict["decoder.blocks.0.attn.key.weight"].normal_()
+    fused.load_state_dict(state_dict)
+    key_weight = fused.decoder.blocks[0].attn.qkv_weight.chunk(3)[1]
+    assert torch.equal(key_weight, state_dict["decoder.blocks.0.attn.key.weight"])
+
+    # as well as after converting the model, which rebinds the weights
+    for convert in [
+        lambda m: m.double(),
+        lambda m: m.prepare_for_inference(torch.bfloat16),
+    ]:
+        convert(fused)
+        state_dict["decoder.blocks.0.attn.key.weight"].normal_()
+        fused.load_state_dict(state_dict)
+        attn = fused.decoder.blocks[0].attn
+        key_weight = attn.qkv_weight.chunk(3)[1]
+        assert attn.key.weight.data_ptr() == key_weight.data_ptr()
+        expected = state_dict["decoder.blocks.0.attn.key.weight"]
+        assert torch.equal(key_weight, expected.to(key_weight.dtype))
+
+
+@pytest.mark.parametrize("use_sdpa", [True, False])
+def test_kv_cache(model, use_sdpa, monkeypatch):
+    monkeypatch.setattr(MultiHeadAttention, "use_sdpa", use_sdpa)
+    audio_features = model.embed_audio(torch.randn(2, 80, 3000))
+    tokens = torch.tensor([[50258, 50259, 50360]] * 2)
+
+    kv_cache = KVCache(model.dims.n_text_ctx)
+    with torch.no_grad():
+        for _ in range(5):
+            step_tokens = tokens if kv_cache.offset == 0 else tokens[:, -1:]
+            logits = model.decoder(step_tokens, audio_features, kv_cache=kv_cache)
+            assert kv_cache.offset == tokens.shape[-1]
+
+            # the same as running the decoder over all tokens without a cache
+            expected = model.decoder(tokens, audio_features)[:, -logits.shape[1] :]
+            assert torch.allclose(logits, expected, atol=1e-4)
+            tokens = torch.cat([tokens, logits[:, -1:].argmax(-1)], dim=-1)
+
+    # sequences continue from the rows given by the source indices
+    kv_cache.rearrange([1, 1])
+    key, value = next(iter(kv_cache.self_attn.values()))
+    assert torch.equal(key[0, :, : kv_cache.offset], key[1, :, : kv_cache.offset])
+
+
+def test_decode_step(model):
+    audio_features = model.embed_audio(torch.randn(2, 80, 3000))
+    tokens = torch.tensor([[50258, 50259, 50360, 440, 50257]] * 2)
+    with torch.no_grad():
+        expected = model.logits(tokens, audio_features)
+
+        decoder = model.decoder
+        cache = decoder.empty_cache(2, audio_features.dtype, audio_features.device)
+        audio_kv = decoder.audio_kv(audio_features, 2)
+        # the prompt at once, then one token at a time
+        logits = [decoder.decode_step(tokens[:, :3], cache, audio_kv, torch.tensor(0))]
+        for i in range(3, tokens.shape[1]):
+            step_tokens = tokens[:, i : i + 1]
+            step = decoder.decode_step(step_tokens, cache, audio_kv, torch.tensor(i))
+            logits.append(step)
+    assert torch.allclose(torch.cat(logits, dim=1), expected, atol=1e-4)
+
+
+@pytest.mark.parametrize("beam_size", [None, 3])
+def test_decode(model, beam_size):
+    mel = torch.randn(2, 80, 3000)
+    options = DecodingOptions(
+        language="en", beam_size=beam_size, fp16=False, sample_len=20
+    )
+    results = model.decode(mel, options)
+    assert len(results) == 2
+    for result in results:
+        assert 0 < len(result.tokens) <= 20
+
+
+def test_quantize(model):
+    mel = torch.randn(2, 80, 3000)
+    tokens = torch.tensor([[50258, 50259, 50360, 440]] * 2)
+    with torch.no_grad():
+        expected = model.logits(tokens, model.embed_audio(mel))
+
+    quantized = copy.deepcopy(model).quantize("int8")
+    assert not any(isinstance(m, Linear) for m in quantized.modules())
+    with torch.no_grad():
+        logits = quantized.logits(tokens, quantized.embed_audio(mel))
+    assert (
+        torch.corrcoef(torch.stack([logits.flatten(), expected.flatten()]))[0, 1] > 0.99
+    )
+
+    results = quantized.decode(
+        mel, DecodingOptions(language="en", fp16=False, sample_len=5)
+    )
+    assert len(results) == 2
+
+    with pytest.raises(ValueError):
+        copy.deepcopy(model).quantize("int4")
+
+
+def test_decode_bf16(model):
+    mel = torch.randn(2, 80, 3000)
+    options = DecodingOptions(language="en", dtype="bf16", sample_len=5)
+    model.prepare_for_inference(torch.bfloat16)
+    results = model.decode(mel, options)
+    assert results[0].audio_features.dtype == torch.bfloat16
+
+    with pytest.raises(ValueError):
+        model.decode(mel, DecodingOptions(language="en", dtype="fp8"))
+
+
+def test_truncated_audio(model):
+    mel = torch.randn(2, 80, 400)
+    with torch.no_grad():
+        audio_features = model.embed_audio(mel, truncate=True)
+        audio_kv = model.decoder.audio_kv(audio_features)
+    assert audio_features.shape == (2, 200, 64)
+
+    # shorter audio is encoded only when asked for, as a full window is expected otherwise
+    options = DecodingOptions(language="en", fp16=False, sample_len=5)
+    with pytest.raises(AssertionError):
+        model.embed_audio(mel)
+    with pytest.raises(AssertionError):
+        model.decode(mel, options)
+    assert not is_audio_features(model, audio_features)
+    assert is_audio_features(model, audio_features, truncate=True)
+
+    _, expected = model.detect_language(mel, truncate=True)
+    assert model.detect_language(audio_features, truncate=True)[1] == expected
+    from_features = model.decode(
+        audio_features, replace(options, language=None, task="lang_id"), audio_kv
+    )
+    assert [r.language_probs for r in from_features] == expected
+
+    # a spectrogram as wide as the audio features, and features with as many positions as
+    # there are mel bins, which are only taken for features when given with their keys and values
+    with torch.no_grad():
+        audio_features = model.embed_audio(torch.randn(2, 80, 160), truncate=True)
+        audio_kv = model.decoder.audio_kv(audio_features)
+    assert not is_audio_features(model, torch.randn(2, 80, 64), truncate=True)
+    assert not is_audio_features(model, audio_features, truncate=True)
+    assert len(model.decode(audio_features, options, audio_kv)) == 2
+
+    with pytest.raises(AssertionError):
+        model.embed_audio(torch.randn(2, 80, 3200), truncate=True)
+
+
+@pytest.mark.skipif(torch.__version__ < "2.1", reason="needs torch 2.1 or later")
+def test_from_state_dict(model, tmp_path):
+    # checkpoints store the weights in float16
+    path = str(tmp_path / "model.pt")
+    torch.save({k: v.half() for k, v in model.state_dict().items()}, path)
+    state_dict = torch.load(path, mmap=True, weights_only=True)
+
+    expected = Whisper(model.dims).eval()
+    expected.load_state_dict(state_dict)
+    loaded = Whisper.from_state_dict(model.dims, state_dict).eval()
+    assert loaded.decoder.ln.weight.dtype == torch.float32
+    assert not any(t.is_meta for t in [*loaded.parameters(), *loaded.buffers()])
+
+    mel = torch.randn(2, 80, 3000)
+    tokens = torch.tensor([[50258, 50259, 50360, 440]] * 2)
+    with torch.no_grad():
+        assert torch.equal(loaded(mel, tokens), expected(mel, tokens))
+
+    # the weights already in the requested dtype are the mapped tensors themselves
+    loaded = Whisper.from_state_dict(model.dims, state_dict, torch.float16)
+    weight = loaded.decoder.blocks[0].attn.query.weight
+    key = "decoder.blocks.0.attn.query.weight"
+    assert weight.data_ptr() == state_dict[key].data_ptr()
+
+
+@pytest.mark.skipif(torch.__version__ < "2.1", reason="needs torch 2.1 or later")
+@pytest.mark.parametrize("dtype", [None, "fp32", "fp16"])
+def test_load_model_mmap(model, tmp_path, monkeypatch, dtype):
+    path = str(tmp_path / "model.pt")
+    state_dict = {k: v.half() for k, v in model.state_dict().items()}
+    torch.save({"dims": model.dims.__dict__, "model_state_dict": state_dict}, path)
+
+    # the checkpoint is mapped only when its weights are kept in their float16
+    built = []
+    from_state_dict = Whisper.from_state_dict
+    monkeypatch.setattr(
+        Whisper, "from_state_dict", lambda *a: built.append(a) or from_state_dict(*a)
+    )
+    loaded = whisper.load_model(path, device="cpu", dtype=dtype)
+    assert len(built) == (dtype == "fp16")
+
+    weight = loaded.decoder.blocks[0].attn.query.weight
+    assert weight.dtype == (torch.float16 if dtype == "fp16" else torch.float32)
+    assert torch.equal(
+        weight, state_dict["decoder.blocks.0.attn.query.weight"].to(weight)
+    )
+
+
+def test_concurrent_decode(model):
+    mels = torch.randn(8, 1, 80, 3000)
+    tokens = torch.tensor([[50258, 50259, 50359, 440, 1029]])
+    options = DecodingOptions(language="en", beam_size=2, fp16=False, sample_len=10)
+
+    def run(mel):
+        cross_qk = []
+        with torch.no_grad():
+            model.decoder(tokens, model.embed_audio(mel), cross_qk=cross_qk)
+        return model.decode(mel, options)[0].tokens, torch.stack(cross_qk)
+
+    expected = [run(mel) for mel in mels]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(run, [*mels, *mels]))
+
+    for (result_tokens, result_qk), (expected_tokens, expected_qk) in zip(
+        results, expected * 2
+    ):
+        assert result_tokens == expected_tokens
+        assert torch.allclose(result_qk, expected_qk)
+
+
+def test_logit_positions(model):
+    audio_features = model.embed_audio(torch.randn(2, 80, 3000))
+    tokens = torch.tensor([[50361, 440, 1029, 50258, 50259, 50359]] * 2)
+    decoder = model.decoder
+    with torch.no_grad():
+        expected = decoder(tokens, audio_features)[:, [3, -1]]
+        logits = decoder(tokens, audio_features, logit_positions=[3, -1])
+        assert torch.allclose(logits, expected, atol=1e-5)
+
+        cache = decoder.empty_cache(2, audio_features.dtype, audio_features.device)
+        audio_kv = decoder.audio_kv(audio_features, 2)
+        offset = torch.tensor(0)
+        logits = decoder.decode_step(tokens, cache, audio_kv, offset, [3, -1])
+        assert torch.allclose(logits, expected, atol=1e-4)
+
+
+def test_vocabulary(model):
+    audio_features = model.embed_audio(torch.randn(2, 80, 3000))
+    tokens = torch.tensor([[50258, 50259, 50359, 440]] * 2)
+    language_tokens = [50259, 50260, 50261]
+    with torch.no_grad():
+        expected = model.logits(tokens, audio_features)
+        logits = model.decoder(tokens, audio_features, vocabulary=language_tokens)
+        assert torch.allclose(logits, expected[..., language_tokens], atol=1e-5)
+        logits = model.decoder(tokens, audio_features, vocabulary=slice(50364, None))
+        assert torch.allclose(logits, expected[..., 50364:], atol=1e-5)
+
+    # restricting the timestamp-only steps does not change the results
+    mel = torch.randn(2, 80, 3000)
+    options = DecodingOptions(language="en", fp16=False, sample_len=20)
+    results = model.decode(mel, options)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(DecodingTask, "_allowed_tokens", lambda *_: None)
+        expected = model.decode(mel, options)
+    assert [r.tokens for r in results] == [r.tokens for r in expected]
+    assert [r.avg_logprob for r in results] == pytest.approx(
+        [r.avg_logprob for r in expected]
+    )
+
+
+@pytest.mark.parametrize("n_audio", [1, 2])
+def test_shared_audio_kv(model, n_audio, monkeypatch):
+    audio_features = model.embed_audio(torch.randn(n_audio, 80, 3000))
+    options = DecodingOptions(language="en", beam_size=3, fp16=False, sample_len=20)
+    expected = model.decode(audio_features, options)
+    with torch.no_grad():
+        audio_kv = model.decoder.audio_kv(audio_features)
+
+    def fail(*args, **kwargs):
+        pytest.fail("the cross-attention keys and values should have been reused")
+
+    for block in model.decoder.blocks:
+        monkeypatch.setattr(block.cross_attn.key, "forward", fail)
+        monkeypatch.setattr(block.cross_attn.value, "forward", fail)
+    results = model.decode(audio_features, options, audio_kv)
+    assert [r.tokens for r in results] == [r.tokens for r in expected]
+    assert [r.avg_logprob for r in results] == pytest.approx(
+        [r.avg_logprob for r in expected]
+    )
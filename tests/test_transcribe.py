@@ -1,10 +1,20 @@
 import os
 
+import numpy as np
 import pytest
 import torch
 
 import whisper
+from whisper.audio import (
+    FRAMES_PER_SECOND,
+    N_FRAMES,
+    N_SAMPLES,
+    SAMPLE_RATE,
+    ArraySource,
+    FileSource,
+)
 from whisper.tokenizer import get_tokenizer
+from whisper.vad import VadOptions, detect_speech
 
 
 @pytest.mark.parametrize("model_name", whisper.available_models())
@@ -40,3 +50,129 @@ def test_transcribe(model_name: str):
                 timing_checked = True
 
     assert timing_checked
+
+
+@pytest.mark.parametrize("source", ["path", "array", "file"])
+def test_detect_language_window(model, source, monkeypatch):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = whisper.load_audio(audio_path)
+
+    # the first 30 seconds of the padded spectrogram, as language detection always used
+    mel = whisper.log_mel_spectrogram(audio, padding=N_SAMPLES)
+    _, expected = model.detect_language(whisper.pad_or_trim(mel, N_FRAMES))
+
+    detected = []
+    detect_language = model.detect_language
+
+    def record(*args, **kwargs):
+        result = detect_language(*args, **kwargs)
+        detected.append(result[1])
+        return result
+
+    monkeypatch.setattr(model, "detect_language", record)
+    inputs = dict(path=audio_path, array=audio, file=FileSource(audio_path))
+    model.transcribe(inputs[source], temperature=0.0, fp16=False, sample_len=4)
+    assert detected[0] == pytest.approx(expected, abs=1e-5)
+
+
+def test_transcribe_vad(model):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    speech = whisper.load_audio(audio_path)
+    rng = np.random.default_rng(0)
+    silence = rng.normal(0, 1e-3, 40 * SAMPLE_RATE).astype(np.float32)
+    source = ArraySource(np.concatenate([silence, speech, silence]))
+    [(speech_start, speech_end)] = detect_speech(source)
+
+    requests = []
+    window, padded_window = source.window, source.padded_window
+
+    def record(method, name):
+        def wrapper(start, n_frames):
+            requests.append((name, start))
+            return method(start, n_frames)
+
+        return wrapper
+
+    source.window = record(window, "window")
+    source.padded_window = record(padded_window, "padded_window")
+    result = model.transcribe(
+        source, vad_options=VadOptions(), temperature=0.0, fp16=False, sample_len=4
+    )
+
+    # the language is detected on the speech, and no window before it is decoded
+    detection = requests.index(("padded_window", speech_start))
+    assert all(start >= speech_start for _, start in requests[detection:])
+    assert result["skipped_duration"] == pytest.approx(
+        (source.num_frames - (speech_end - speech_start)) / FRAMES_PER_SECOND
+    )
+
+
+def test_transcribe_multichannel(model):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    speech = whisper.load_audio(audio_path)
+    channels = np.stack([speech, 0.5 * np.roll(speech, 3 * SAMPLE_RATE)])
+    # every window falls back once, decoding it again from the reused keys and values
+    options = dict(
+        temperature=(0.0, 0.0), logprob_threshold=0.0, fp16=False, sample_len=8
+    )
+
+    result = model.transcribe(channels, multichannel=True, **options)
+    for channel, audio in enumerate(channels):
+        expected = model.transcribe(audio, **options)
+        assert result["channels"][channel]["text"] == expected["text"]
+        assert [s["tokens"] for s in result["channels"][channel]["segments"]] == [
+            s["tokens"] for s in expected["segments"]
+        ]
+    assert len(result["segments"]) == sum(
+        len(r["segments"]) for r in result["channels"]
+    )
+
+    with pytest.raises(ValueError):
+        model.transcribe(speech, multichannel=True, **options)
+
+
+def test_transcribe_encoder_calls(model, monkeypatch):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = np.resize(whisper.load_audio(audio_path), N_SAMPLES)
+
+    windows = []
+    embed_audio = model.embed_audio
+
+    def record(mel, truncate=False):
+        windows.extend(mel)
+        return embed_audio(mel, truncate)
+
+    monkeypatch.setattr(model, "embed_audio", record)
+    # the language is detected, and each window falls back once and has its words aligned
+    result = model.transcribe(
+        audio,
+        temperature=(0.0, 0.0),
+        logprob_threshold=0.0,
+        word_timestamps=True,
+        fp16=False,
+        sample_len=8,
+    )
+    seeks = {segment["seek"] for segment in result["segments"]}
+    assert 0 in seeks and any(segment["words"] for segment in result["segments"])
+    assert len(windows) == len(seeks)
+
+
+def test_transcribe_truncate_audio(model, monkeypatch):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = whisper.load_audio(audio_path)[: 5 * SAMPLE_RATE]
+
+    widths = []
+    embed_audio = model.embed_audio
+
+    def record(mel, truncate=False):
+        widths.extend([mel.shape[-1]] * len(mel))
+        return embed_audio(mel, truncate)
+
+    monkeypatch.setattr(model, "embed_audio", record)
+    options = dict(word_timestamps=True, temperature=0.0, fp16=False, sample_len=8)
+    model.transcribe(audio, truncate_audio=True, **options)
+    assert widths and all(width <= 5 * FRAMES_PER_SECOND for width in widths)
+
+    widths.clear()
+    model.transcribe(audio, **options)
+    assert widths and all(width == N_FRAMES for width in widths)
@@ -0,0 +1,59 @@
+import os.path
+
+import numpy as np
+
+from whisper.audio import SAMPLE_RATE, ArraySource, load_audio, log_mel_spectrogram
+from whisper.vad import VadOptions, detect_speech, restrict_clips
+
+
+def test_detect_speech():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    speech = load_audio(audio_path)
+    rng = np.random.default_rng(0)
+    silence = rng.normal(0, 1e-3, 10 * SAMPLE_RATE).astype(np.float32)
+    noise = rng.normal(0, 0.05, 10 * SAMPLE_RATE).astype(np.float32)
+    audio = np.concatenate([silence, speech, silence, noise, silence])
+
+    speech_start, speech_end = 1000, 1000 + len(speech) // 160
+    for regions in [
+        detect_speech(log_mel_spectrogram(audio)),
+        detect_speech(ArraySource(audio)),
+    ]:
+        assert len(regions) == 1
+        start, end = regions[0]
+        assert speech_start - 100 <= start <= speech_start + 50
+        assert speech_end - 50 <= end <= speech_end + 100
+
+    # nothing passes an impossible threshold
+    assert detect_speech(log_mel_spectrogram(audio), VadOptions(threshold=10)) == []
+
+
+def test_detect_speech_clips():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    speech = load_audio(audio_path)
+    silence = np.zeros(40 * SAMPLE_RATE, dtype=np.float32)
+    source = ArraySource(np.concatenate([silence, speech, silence]))
+
+    windows = []
+    window = source.window
+
+    def record(start, n_frames):
+        windows.append((start, start + n_frames))
+        return window(start, n_frames)
+
+    source.window = record
+    clips = [(500, 1500), (3500, 6000)]
+    regions = detect_speech(source, clips=clips)
+
+    # only the frames of the clips are read, and the speech is found in the second one
+    assert all(any(s <= a and b <= e for s, e in clips) for a, b in windows)
+    assert len(regions) == 1
+    start, end = regions[0]
+    assert 3900 <= start <= 4050 and end <= 6000
+
+
+def test_restrict_clips():
+    clips = [(0, 1000), (2000, 3000)]
+    regions = [(500, 2500), (2800, 4000)]
+    assert restrict_clips(clips, regions) == [(500, 1000), (2000, 2500), (2800, 3000)]
+    assert restrict_clips(clips, []) == []
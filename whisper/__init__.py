@@ -1,4 +1,3 @@
-import hashlib
 import io
 import os
 import urllib
@@ -8,12 +7,24 @@ from typing import List, Optional, Union
 import torch
 from tqdm import tqdm
 
-from .audio import load_audio, log_mel_spectrogram, pad_or_trim
-from .decoding import DecodingOptions, DecodingResult, decode, detect_language
+from .audio import load_audio, load_audio_stream, log_mel_spectrogram, pad_or_trim
+from .cache import file_digest
+from .convert import load_converted, read_header
+from .decoding import (
+    DTYPES,
+    DecodingOptions,
+    DecodingResult,
+    bf16_supported,
+    decode,
+    detect_language,
+)
 from .model import ModelDimensions, Whisper
 from .transcribe import transcribe
 from .version import __version__
 
+# loading a checkpoint memory-mapped and assigning its tensors to a model need torch 2.1
+_MMAP_SUPPORTED = torch.__version__ >= "2.1"
+
 _MODELS = {
     "tiny.en": "https://openaipublic.azureedge.net/main/whisper/models/d3dd57d32accea0b295c96e26691aa14d8822fac7d9d27d5dc00b4ca2826dd03/tiny.en.pt",
     "tiny": "https://openaipublic.azureedge.net/main/whisper/models/65147644a518d12f04e32d6f3b26facc3f8dd46e5390956a9424a650c0ce22b9/tiny.pt",
@@ -61,10 +72,8 @@ def _download(url: str, root: str, in_memory: bool) -> Union[bytes, str]:
         raise RuntimeError(f"{download_target} exists and is not a regular file")
 
     if os.path.isfile(download_target):
-        with open(download_target, "rb") as f:
-            model_bytes = f.read()
-        if hashlib.sha256(model_bytes).hexdigest() == expected_sha256:
-            return model_bytes if in_memory else download_target
+        if file_digest(download_target) == expected_sha256:
+            return open(download_target, "rb").read() if in_memory else download_target
         else:
             warnings.warn(
                 f"{download_target} exists, but the SHA256 checksum does not match; re-downloading the file"
@@ -86,13 +95,12 @@ def _download(url: str, root: str, in_memory: bool) -> Union[bytes, str]:
                 output.write(buffer)
                 loop.update(len(buffer))
 
-    model_bytes = open(download_target, "rb").read()
-    if hashlib.sha256(model_bytes).hexdigest() != expected_sha256:
+    if file_digest(download_target) != expected_sha256:
         raise RuntimeError(
             "Model has been downloaded but the SHA256 checksum does not not match. Please retry loading the model."
         )
 
-    return model_bytes if in_memory else download_target
+    return open(download_target, "rb").read() if in_memory else download_target
 
 
 def available_models() -> List[str]:
@@ -105,6 +113,8 @@ def load_model(
     device: Optional[Union[str, torch.device]] = None,
     download_root: str = None,
     in_memory: bool = False,
+    quantize: Optional[str] = None,
+    dtype: Optional[str] = None,
 ) -> Whisper:
     """
     Load a Whisper ASR model
@@ -113,13 +123,23 @@ def load_model(
     ----------
     name : str
         one of the official model names listed by `whisper.available_models()`, or
-        path to a model checkpoint containing the model dimensions and the model state_dict.
+        path to a model checkpoint containing the model dimensions and the model state_dict,
+        or to a model converted by `whisper convert`, which is mapped without copying weights
+        already in the dtype to run in; an int8 one is quantized as with `quantize="int8"`.
     device : Union[str, torch.device]
         the PyTorch device to put the model into
     download_root: str
         path to download the model files; by default, it uses "~/.cache/whisper"
     in_memory: bool
-        whether to preload the model weights into host memory
+        whether to preload the model weights into host memory; otherwise, the checkpoint is
+        memory-mapped where supported, and its tensors become the weights without a copy
+    quantize: Optional[str]
+        "int8" to quantize the linear layers dynamically for inference on CPU, which then runs
+        in float32; see `Whisper.quantize()`
+    dtype: Optional[str]
+        "fp16", "bf16" or "fp32" to convert the weights to that dtype once, for inference in it;
+        see `Whisper.prepare_for_inference()`. "bf16" falls back to "fp32", with a warning as
+        in `transcribe()`, when the device does not support it natively.
 
     Returns
     -------
@@ -127,8 +147,24 @@ def load_model(
         The Whisper ASR model instance
     """
 
+    converted = read_header(name) if os.path.isfile(name) else None
+    if converted is not None and converted["dtype"] == "int8" and quantize is None:
+        quantize = "int8"
+
     if device is None:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
+        device = "cpu" if quantize else "cuda" if torch.cuda.is_available() else "cpu"
+    if quantize is not None and torch.device(device).type != "cpu":
+        raise ValueError(f"Quantized models run on CPU only, not on {device}")
+    if dtype is not None and dtype not in DTYPES:
+        raise ValueError(f"dtype should be one of {list(DTYPES)}")
+    if quantize is not None and dtype not in (None, "fp32"):
+        raise ValueError("Quantized models run in fp32")
+    if dtype == "bf16" and not bf16_supported(device):
+        warnings.warn(f"BF16 is not supported natively by {device}; using FP32 instead")
+        dtype = "fp32"
+    if converted is not None:
+        return load_converted(name, device, dtype, quantize)
+
     if download_root is None:
         default = os.path.join(os.path.expanduser("~"), ".cache")
         download_root = os.path.join(os.getenv("XDG_CACHE_HOME", default), "whisper")
@@ -144,18 +180,50 @@ def load_model(
             f"Model {name} not found; available models = {available_models()}"
         )
 
-    with (
-        io.BytesIO(checkpoint_file) if in_memory else open(checkpoint_file, "rb")
-    ) as fp:
-        kwargs = {"weights_only": True} if torch.__version__ >= "1.13" else {}
-        checkpoint = torch.load(fp, map_location=device, **kwargs)
+    kwargs = {"weights_only": True} if torch.__version__ >= "1.13" else {}
+    checkpoint = None
+    if _MMAP_SUPPORTED and not in_memory:
+        try:
+            checkpoint = torch.load(
+                checkpoint_file, map_location=device, mmap=True, **kwargs
+            )
+        except RuntimeError:  # a checkpoint in the legacy, non-zip format
+            pass
+        else:
+            # the mapped pages of weights that are converted would stay resident next to their
+            # copies, so that the tensors are mapped only when they keep the checkpoint's dtype
+            weight = checkpoint["model_state_dict"]["encoder.conv1.weight"]
+            if weight.dtype != (DTYPES[dtype] if dtype is not None else torch.float32):
+                checkpoint = None
+    mapped = checkpoint is not None
+    if checkpoint is None:
+        with (
+            io.BytesIO(checkpoint_file) if in_memory else open(checkpoint_file, "rb")
+        ) as fp:
+            checkpoint = torch.load(fp, map_location=device, **kwargs)
     del checkpoint_file
 
     dims = ModelDimensions(**checkpoint["dims"])
-    model = Whisper(dims)
-    model.load_state_dict(checkpoint["model_state_dict"])
+    if mapped:
+        # build the model around the mapped tensors, without initializing weights to replace
+        model = Whisper.from_state_dict(
+            dims,
+            checkpoint["model_state_dict"],
+            DTYPES[dtype] if dtype is not None else None,
+        )
+    else:
+        # creating the modules on the meta device, for `from_state_dict()`, costs more than
+        # it saves when every weight is copied anyway, see `benchmarks/load_model.py`
+        model = Whisper(dims)
+        model.load_state_dict(checkpoint["model_state_dict"])
+    del checkpoint
 
     if alignment_heads is not None:
         model.set_alignment_heads(alignment_heads)
 
+    if quantize is not None:
+        return model.quantize(quantize)
+    if dtype is not None:
+        return model.prepare_for_inference(DTYPES[dtype], device)
+
     return model.to(device)
@@ -1,7 +1,22 @@
+import io
+import math
 import os
+import struct
+import tempfile
+import time
 from functools import lru_cache
-from subprocess import CalledProcessError, run
-from typing import Optional, Union
+from subprocess import PIPE, CalledProcessError, Popen, run
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import numpy as np
 import torch
@@ -21,8 +36,182 @@ N_SAMPLES_PER_TOKEN = HOP_LENGTH * 2  # the initial convolutions has stride 2
 FRAMES_PER_SECOND = exact_div(SAMPLE_RATE, HOP_LENGTH)  # 10ms per audio frame
 TOKENS_PER_SECOND = exact_div(SAMPLE_RATE, N_SAMPLES_PER_TOKEN)  # 20ms per audio token
 
+# identifies the log-Mel computation in cache keys; bump when its numerical output changes
+MEL_FRONTEND_VERSION = 1
 
-def load_audio(file: str, sr: int = SAMPLE_RATE):
+
+def _ffmpeg_pcm16(
+    file: str,
+    sr: int,
+    data: Optional[bytes] = None,
+    start: float = 0.0,
+    duration: Optional[float] = None,
+) -> np.ndarray:
+    # This launches a subprocess to decode audio while down-mixing
+    # and resampling as necessary.  Requires the ffmpeg CLI in PATH.
+    # The input is read from stdin if `data` is given. Seeking before `-i` lets ffmpeg skip
+    # to `start` in the container instead of decoding everything up to it.
+    seek = ["-ss", f"{start:.6f}"] if start > 0 else []
+    limit = ["-t", f"{duration:.6f}"] if duration is not None else []
+    # fmt: off
+    cmd = [
+        "ffmpeg",
+        "-nostdin",
+        "-threads", "0",
+        *seek,
+        "-i", file if data is None else "pipe:0",
+        *limit,
+        "-vn",
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(sr),
+        "-"
+    ]
+    # fmt: on
+    try:
+        out = run(cmd, input=data, capture_output=True, check=True).stdout
+    except CalledProcessError as e:
+        raise RuntimeError(f"Failed to load audio: {e.stderr.decode()}") from e
+
+    return np.frombuffer(out, np.int16).flatten()
+
+
+def _decode_ffmpeg(
+    file: str, sr: int, start: float = 0.0, duration: Optional[float] = None
+) -> np.ndarray:
+    return _ffmpeg_pcm16(file, sr, None, start, duration).astype(np.float32) / 32768.0
+
+
+def _sample_range(
+    sr: int, start: float, duration: Optional[float]
+) -> Tuple[int, Optional[int]]:
+    begin = round(start * sr)
+    return begin, None if duration is None else begin + round(duration * sr)
+
+
+def _read_wav_header(f: BinaryIO) -> Optional[Tuple[tuple, int, int]]:
+    # Reads the RIFF header of a WAV file up to the start of its samples, and returns the
+    # fields of the fmt chunk, the offset of the samples and the size of the data chunk.
+    if len(header := f.read(12)) < 12:
+        return None
+    riff, _, wave = struct.unpack("<4sI4s", header)
+    if riff != b"RIFF" or wave != b"WAVE":
+        return None
+
+    fmt = None
+    while header := f.read(8):
+        if len(header) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack("<4sI", header)
+        if chunk_id == b"fmt ":
+            if chunk_size < 16 or len(fields := f.read(16)) < 16:
+                return None
+            fmt = struct.unpack("<HHIIHH", fields)
+            f.seek(chunk_size - 16 + chunk_size % 2, os.SEEK_CUR)
+        elif chunk_id == b"data":
+            break
+        else:
+            f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+    else:
+        return None
+
+    return (fmt, f.tell(), chunk_size) if fmt is not None else None
+
+
+def _map_wav(file: str, sr: int) -> Optional[np.ndarray]:
+    # Maps the samples of a mono 16-bit PCM WAV file at the requested sample rate directly,
+    # without spawning a process or copying the file contents through a pipe.
+    if not file.lower().endswith((".wav", ".wave")) or not os.path.isfile(file):
+        return None
+
+    with open(file, "rb") as f:
+        header = _read_wav_header(f)
+
+    if header is None:
+        return None
+    fmt, data_offset, chunk_size = header
+    # WAVE_FORMAT_EXTENSIBLE (0xFFFE) is only accepted for mono, where no channel mask applies
+    audio_format, channels, sample_rate, _, _, bits_per_sample = fmt
+    if audio_format not in (1, 0xFFFE) or (channels, bits_per_sample) != (1, 16):
+        return None
+    if sample_rate != sr:
+        return None
+
+    # the chunk size is unreliable in files that were written as a stream, so trust the file size
+    n_samples = min(chunk_size, os.path.getsize(file) - data_offset) // 2
+    if n_samples == 0:
+        return np.zeros(0, dtype=np.int16)
+    return np.memmap(file, "<i2", mode="r", offset=data_offset, shape=(n_samples,))
+
+
+def _decode_wav(
+    file: str, sr: int, start: float = 0.0, duration: Optional[float] = None
+) -> Optional[np.ndarray]:
+    if (samples := _map_wav(file, sr)) is None:
+        return None
+    begin, end = _sample_range(sr, start, duration)
+    return samples[begin:end].astype(np.float32) / 32768.0
+
+
+def _decode_soundfile(
+    file: str, sr: int, start: float = 0.0, duration: Optional[float] = None
+) -> Optional[np.ndarray]:
+    # Decodes the formats supported by libsndfile (FLAC, Ogg/Vorbis, most WAV variants, ...)
+    # in-process when the optional `soundfile` package is installed.
+    try:
+        import soundfile
+    except ImportError:
+        return None
+
+    try:
+        if soundfile.info(file).samplerate != sr:
+            return None
+        begin, end = _sample_range(sr, start, duration)
+        audio, _ = soundfile.read(
+            file, start=begin, stop=end, dtype="float32", always_2d=True
+        )
+    except (RuntimeError, TypeError, ValueError):  # unsupported or unreadable formats
+        return None
+
+    return audio.mean(axis=1) if audio.shape[1] > 1 else audio[:, 0]
+
+
+# audio decoders tried in order by `load_audio()`; each returns None for inputs it cannot handle
+AudioDecoder = Callable[[str, int, float, Optional[float]], Optional[np.ndarray]]
+_AUDIO_BACKENDS: Dict[str, AudioDecoder] = {
+    "wav": _decode_wav,
+    "soundfile": _decode_soundfile,
+    "ffmpeg": _decode_ffmpeg,
+}
+
+
+def register_audio_backend(name: str, decoder: AudioDecoder):
+    """
+    Register an in-process audio decoder for `load_audio()`, to be tried before falling back to
+    ffmpeg. `decoder(file, sr, start, duration)` should return the mono float32 waveform at the
+    sample rate `sr`, from `start` seconds into the file and `duration` seconds long or until the
+    end of the file if it is None, or return None if it cannot handle the file.
+    """
+    fallback = _AUDIO_BACKENDS.pop("ffmpeg")
+    _AUDIO_BACKENDS[name] = decoder
+    _AUDIO_BACKENDS["ffmpeg"] = fallback
+
+
+def available_audio_backends() -> List[str]:
+    """Returns the names of the audio decoders, in the order `load_audio()` tries them"""
+    return list(_AUDIO_BACKENDS.keys())
+
+
+def load_audio(
+    file: str,
+    sr: int = SAMPLE_RATE,
+    *,
+    start: float = 0.0,
+    duration: Optional[float] = None,
+    backend: Optional[str] = None,
+    return_backend: bool = False,
+):
     """
     Open an audio file and read as mono waveform, resampling as necessary
 
@@ -34,21 +223,68 @@ def load_audio(file: str, sr: int = SAMPLE_RATE):
     sr: int
         The sample rate to resample the audio if necessary
 
+    start: float
+        The offset in seconds to start reading the audio from; ffmpeg seeks to it in the
+        container, so that the audio before it is not decoded
+
+    duration: Optional[float]
+        The number of seconds of audio to read, or None to read until the end of the file
+
+    backend: Optional[str]
+        The audio decoder to use, one of `available_audio_backends()`. By default, each of them
+        is tried in order: mono 16-bit PCM WAV files at the sample rate `sr` are memory-mapped,
+        other formats are decoded in-process by `soundfile` if it is installed, and ffmpeg is
+        used for everything else.
+
+    return_backend: bool
+        Whether to also return the name of the backend that decoded the file
+
     Returns
     -------
-    A NumPy array containing the audio waveform, in float32 dtype.
+    A NumPy array containing the audio waveform, in float32 dtype, and the name of the backend
+    if `return_backend` is True.
     """
+    if backend is not None and backend not in _AUDIO_BACKENDS:
+        raise ValueError(
+            f"Unknown audio backend {backend}; available backends = {available_audio_backends()}"
+        )
 
-    # This launches a subprocess to decode audio while down-mixing
-    # and resampling as necessary.  Requires the ffmpeg CLI in PATH.
+    for name, decoder in _AUDIO_BACKENDS.items():
+        if backend is not None and name != backend:
+            continue
+        audio = decoder(file, sr, start, duration)
+        if audio is not None:
+            return (audio, name) if return_backend else audio
+
+    raise RuntimeError(f"Failed to load audio: {backend} cannot decode {file}")
+
+
+def load_audio_channels(file: str, sr: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Open an audio file and read each of its channels as a separate waveform, resampling as
+    necessary, with a single ffmpeg process
+
+    Parameters
+    ----------
+    file: str
+        The audio file to open
+
+    sr: int
+        The sample rate to resample the audio if necessary
+
+    Returns
+    -------
+    A NumPy array of shape (n_channels, n_samples) containing the waveforms, in float32 dtype.
+    """
+    # ffmpeg writes a WAV stream rather than raw samples, whose header gives the channel count
     # fmt: off
     cmd = [
         "ffmpeg",
         "-nostdin",
         "-threads", "0",
         "-i", file,
-        "-f", "s16le",
-        "-ac", "1",
+        "-vn",
+        "-f", "wav",
         "-acodec", "pcm_s16le",
         "-ar", str(sr),
         "-"
@@ -59,7 +295,70 @@ def load_audio(file: str, sr: int = SAMPLE_RATE):
     except CalledProcessError as e:
         raise RuntimeError(f"Failed to load audio: {e.stderr.decode()}") from e
 
-    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+    header = _read_wav_header(io.BytesIO(out))
+    if header is None:
+        raise RuntimeError("Failed to load audio: ffmpeg wrote an invalid WAV header")
+    (_, channels, _, _, _, _), data_offset, _ = header
+
+    # the data chunk size is not filled in when writing to a pipe
+    pcm = np.frombuffer(out, "<i2", offset=data_offset)
+    pcm = pcm[: len(pcm) // channels * channels].reshape(-1, channels)
+    return pcm.T.astype(np.float32) / 32768.0
+
+
+def load_audio_stream(
+    file: str, sr: int = SAMPLE_RATE, chunk_length: float = CHUNK_LENGTH
+) -> Iterator[np.ndarray]:
+    """
+    Open an audio file and yield the mono waveform in fixed-size blocks, so that the memory
+    used does not depend on the length of the file
+
+    Parameters
+    ----------
+    file: str
+        The audio file to open
+
+    sr: int
+        The sample rate to resample the audio if necessary
+
+    chunk_length: float
+        The length of each block in seconds; the last block may be shorter
+
+    Returns
+    -------
+    An iterator over NumPy arrays containing the audio waveform, in float32 dtype.
+    """
+
+    # fmt: off
+    cmd = [
+        "ffmpeg",
+        "-nostdin",
+        "-threads", "0",
+        "-i", file,
+        "-vn",
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(sr),
+        "-"
+    ]
+    # fmt: on
+    block_bytes = 2 * max(1, round(chunk_length * sr))
+
+    # stderr goes to a file rather than a pipe, which nobody drains while stdout is being read
+    with tempfile.TemporaryFile() as stderr:
+        process = Popen(cmd, stdout=PIPE, stderr=stderr)
+        try:
+            while block := process.stdout.read(block_bytes):
+                yield np.frombuffer(block, np.int16).astype(np.float32) / 32768.0
+            if process.wait() != 0:
+                stderr.seek(0)
+                raise RuntimeError(f"Failed to load audio: {stderr.read().decode()}")
+        finally:
+            if process.poll() is None:  # the consumer stopped early
+                process.kill()
+                process.wait()
+            process.stdout.close()
 
 
 def pad_or_trim(array, length: int = N_SAMPLES, *, axis: int = -1):
@@ -88,6 +387,75 @@ def pad_or_trim(array, length: int = N_SAMPLES, *, axis: int = -1):
     return array
 
 
+@lru_cache(maxsize=None)
+def resample_kernel(
+    orig_sr: int, target_sr: int, device=None, zeros: int = 16, rolloff: float = 0.945
+) -> torch.Tensor:
+    """
+    The polyphase filter bank of a Hann-windowed sinc low-pass filter for `resample()`, with one
+    filter per output phase and a cutoff `rolloff` times the lower Nyquist frequency
+
+    Returns
+    -------
+    torch.Tensor, shape = (target_sr, 1, 2 * width + orig_sr), with the sample rates divided by
+    their greatest common divisor and `width` the number of input samples on each side
+    """
+    base_freq = min(orig_sr, target_sr) * rolloff
+    width = math.ceil(zeros * orig_sr / base_freq)
+    # the offset of each input sample from each output sample, in input samples
+    offsets = torch.arange(-width, width + orig_sr, dtype=torch.float64) / orig_sr
+    t = (offsets[None, :] - torch.arange(target_sr)[:, None] / target_sr) * base_freq
+    t = t.clamp(-zeros, zeros)
+    window = torch.cos(t * math.pi / zeros / 2) ** 2
+    kernel = torch.special.sinc(t) * window * (base_freq / orig_sr)
+    return kernel[:, None, :].to(device=device, dtype=torch.float32)
+
+
+def resample(
+    audio: Union[np.ndarray, torch.Tensor], orig_sr: int, target_sr: int = SAMPLE_RATE
+):
+    """
+    Resample a waveform or a batch of them in-process with a polyphase windowed-sinc filter,
+    e.g. 8 kHz telephony or 48 kHz audio to the 16 kHz that `log_mel_spectrogram()` expects
+
+    Parameters
+    ----------
+    audio: Union[np.ndarray, torch.Tensor], shape = (*, n_samples)
+        The audio waveforms, resampled along the last axis
+
+    orig_sr: int
+        The sample rate of `audio`
+
+    target_sr: int
+        The sample rate to resample to
+
+    Returns
+    -------
+    The resampled waveforms of the same type, in float32, with ceil(n_samples * target_sr /
+    orig_sr) samples each
+    """
+    if orig_sr == target_sr:
+        return audio
+
+    is_tensor = torch.is_tensor(audio)
+    x = audio if is_tensor else torch.from_numpy(np.asarray(audio))
+    batch_shape, n_samples = x.shape[:-1], x.shape[-1]
+
+    gcd = math.gcd(orig_sr, target_sr)
+    orig, target = orig_sr // gcd, target_sr // gcd
+    kernel = resample_kernel(orig, target, x.device)
+    width = (kernel.shape[-1] - orig) // 2
+
+    # each of the `target` output phases is a strided convolution with its own filter, so that
+    # only the output samples are computed, and the phases are then interleaved
+    x = x.reshape(-1, 1, n_samples).float()
+    x = F.pad(x, (width, width + orig))
+    y = F.conv1d(x, kernel, stride=orig).transpose(1, 2).reshape(x.shape[0], -1)
+    y = y[:, : math.ceil(n_samples * target / orig)].reshape(*batch_shape, -1)
+
+    return y if is_tensor else y.numpy()
+
+
 @lru_cache(maxsize=None)
 def mel_filters(device, n_mels: int) -> torch.Tensor:
     """
@@ -107,11 +475,124 @@ def mel_filters(device, n_mels: int) -> torch.Tensor:
         return torch.from_numpy(f[f"mel_{n_mels}"]).to(device)
 
 
+@lru_cache(maxsize=None)
+def hann_window(device, dtype: torch.dtype = torch.float32) -> torch.Tensor:
+    """the periodic Hann window of length N_FFT, created once per device and dtype"""
+    return torch.hann_window(N_FFT, dtype=dtype).to(device)
+
+
+@lru_cache(maxsize=None)
+def dft_matrix(device, dtype: torch.dtype = torch.float32) -> torch.Tensor:
+    """
+    the windowed real DFT matrix of shape (2 * (N_FFT // 2 + 1), N_FFT), whose rows compute the
+    real parts and then the imaginary parts of the one-sided spectrum of a frame
+    """
+    n_freqs = N_FFT // 2 + 1
+    phase = torch.outer(torch.arange(n_freqs), torch.arange(N_FFT)) % N_FFT
+    phase = phase.to(torch.float64) * (2 * np.pi / N_FFT)
+    window = torch.hann_window(N_FFT, dtype=torch.float64)
+    matrix = torch.cat([torch.cos(phase), -torch.sin(phase)]) * window
+    return matrix.to(dtype).to(device)
+
+
+def _power_spectrum_torch(audio: torch.Tensor) -> torch.Tensor:
+    window = hann_window(audio.device)
+    stft = torch.stft(audio, N_FFT, HOP_LENGTH, window=window, return_complex=True)
+    return stft[..., :-1].abs() ** 2
+
+
+def _power_spectrum_dft(audio: torch.Tensor) -> torch.Tensor:
+    # a single matrix multiplication over all frames, which avoids the FFT planning and
+    # dispatch overhead of torch.stft() that dominates for short inputs
+    padded = F.pad(audio[None], (N_FFT // 2, N_FFT // 2), mode="reflect")[0]
+    frames = padded.unfold(-1, N_FFT, HOP_LENGTH)[..., :-1, :]
+    spectrum = frames @ dft_matrix(audio.device).T
+    real, imag = spectrum.chunk(2, dim=-1)
+    return (real**2 + imag**2).transpose(-1, -2)
+
+
+def _power_spectrum_numpy(audio: torch.Tensor) -> torch.Tensor:
+    samples = audio.cpu().numpy()
+    pad_widths = [(0, 0)] * (samples.ndim - 1) + [(N_FFT // 2, N_FFT // 2)]
+    padded = np.pad(samples, pad_widths, mode="reflect")
+    frames = np.lib.stride_tricks.sliding_window_view(padded, N_FFT, axis=-1)
+    n_frames = samples.shape[-1] // HOP_LENGTH  # dropping the last frame, like above
+    frames = (
+        frames[..., ::HOP_LENGTH, :][..., :n_frames, :] * hann_window("cpu").numpy()
+    )
+    spectrum = np.fft.rfft(frames, axis=-1)
+    power = (spectrum.real**2 + spectrum.imag**2).astype(np.float32)
+    return torch.from_numpy(np.swapaxes(power, -1, -2)).to(audio.device)
+
+
+# implementations of the power spectrum of the centered STFT, shape = (*, N_FFT // 2 + 1, n_frames)
+_MEL_FRONTENDS = {
+    "torch": _power_spectrum_torch,
+    "dft": _power_spectrum_dft,
+    "numpy": _power_spectrum_numpy,
+}
+
+
+def available_mel_frontends() -> List[str]:
+    """Returns the names of the STFT implementations that `log_mel_spectrogram()` can use"""
+    return list(_MEL_FRONTENDS.keys())
+
+
+def benchmark_mel_frontends(
+    duration: float = 5.0,
+    repeats: int = 5,
+    device: Optional[Union[str, torch.device]] = None,
+) -> Dict[str, float]:
+    """
+    Measure each mel frontend on `duration` seconds of noise, and return the best time of
+    `repeats` calls in seconds, keyed by the frontend name
+    """
+    audio = torch.randn(round(duration * SAMPLE_RATE), device=device)
+    results = {}
+    for name in available_mel_frontends():
+        log_mel_spectrogram(audio, frontend=name)  # warm up, filling the caches
+        timings = []
+        for _ in range(repeats):
+            if audio.is_cuda:
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            log_mel_spectrogram(audio, frontend=name)
+            if audio.is_cuda:
+                torch.cuda.synchronize()
+            timings.append(time.perf_counter() - start)
+        results[name] = min(timings)
+    return results
+
+
+@lru_cache(maxsize=None)
+def _fastest_mel_frontend(device: torch.device, num_threads: int) -> str:
+    timings = benchmark_mel_frontends(device=device)
+    return min(timings, key=timings.get)
+
+
+def resolve_mel_frontend(
+    frontend: str, device: Optional[Union[str, torch.device]] = None
+) -> str:
+    """
+    Returns the name of the frontend to use; "auto" selects the fastest one on this host for the
+    given device and the current number of threads, benchmarking them on first use
+    """
+    if frontend == "auto":
+        device = torch.device(device if device is not None else "cpu")
+        return _fastest_mel_frontend(device, torch.get_num_threads())
+    if frontend not in _MEL_FRONTENDS:
+        raise ValueError(
+            f"Unknown mel frontend {frontend}; available frontends = {available_mel_frontends()}"
+        )
+    return frontend
+
+
 def log_mel_spectrogram(
     audio: Union[str, np.ndarray, torch.Tensor],
     n_mels: int = 80,
     padding: int = 0,
     device: Optional[Union[str, torch.device]] = None,
+    frontend: str = "torch",
 ):
     """
     Compute the log-Mel spectrogram of
@@ -130,6 +611,10 @@ def log_mel_spectrogram(
     device: Optional[Union[str, torch.device]]
         If given, the audio tensor is moved to this device before STFT
 
+    frontend: str
+        The STFT implementation, one of `available_mel_frontends()`, or "auto" to use the one that
+        is the fastest on this host according to `benchmark_mel_frontends()`
+
     Returns
     -------
     torch.Tensor, shape = (n_mels, n_frames)
@@ -144,14 +629,512 @@ def log_mel_spectrogram(
         audio = audio.to(device)
     if padding > 0:
         audio = F.pad(audio, (0, padding))
-    window = torch.hann_window(N_FFT).to(audio.device)
-    stft = torch.stft(audio, N_FFT, HOP_LENGTH, window=window, return_complex=True)
-    magnitudes = stft[..., :-1].abs() ** 2
+    frontend = resolve_mel_frontend(frontend, audio.device)
+    magnitudes = _MEL_FRONTENDS[frontend](audio)
 
     filters = mel_filters(audio.device, n_mels)
     mel_spec = filters @ magnitudes
 
     log_spec = torch.clamp(mel_spec, min=1e-10).log10()
-    log_spec = torch.maximum(log_spec, log_spec.max() - 8.0)
-    log_spec = (log_spec + 4.0) / 4.0
-    return log_spec
+    return normalize_log_mel(log_spec)
+
+
+def pad_with_silence(mel: torch.Tensor, n_frames: int) -> torch.Tensor:
+    """
+    Pad or trim a normalized log-Mel spectrogram to `n_frames`, padding it with the value that
+    `normalize_log_mel()` gives to silence, i.e. 8 orders of magnitude below the maximum of `mel`
+    """
+    if mel.shape[-1] >= n_frames:
+        return mel[..., :n_frames]
+    # the floor of 1e-10 in log_mel_spectrogram(), unless the clamp to the maximum is higher
+    silence = (-10.0 + 4.0) / 4.0
+    if mel.shape[-1] > 0:
+        silence = max(silence, mel.max().item() - 2.0)
+    return F.pad(mel, (0, n_frames - mel.shape[-1]), value=silence)
+
+
+def normalize_log_mel(
+    log_spec: torch.Tensor, log_max: Optional[Union[float, torch.Tensor]] = None
+) -> torch.Tensor:
+    """
+    Clamp the log10-Mel spectrogram to 8 orders of magnitude below `log_max`, which defaults to
+    the maximum of `log_spec`, and scale it to the range expected by the encoder.
+    """
+    if log_max is None:
+        log_max = log_spec.max()
+    log_spec = torch.maximum(log_spec, torch.as_tensor(log_max) - 8.0)
+    return (log_spec + 4.0) / 4.0
+
+
+def _log_mel_frames(samples: torch.Tensor, n_mels: int) -> torch.Tensor:
+    """Compute the unnormalized log10-Mel frames of all complete STFT windows in `samples`"""
+    window = hann_window(samples.device)
+    stft = torch.stft(
+        samples, N_FFT, HOP_LENGTH, window=window, center=False, return_complex=True
+    )
+    mel_spec = mel_filters(samples.device, n_mels) @ (stft.abs() ** 2)
+    return torch.clamp(mel_spec, min=1e-10).log10()
+
+
+class ChunkedLogMel:
+    """
+    Computes the log-Mel spectrogram of a waveform that is fed in blocks of any size. The STFT
+    windows overlapping the block boundaries are computed once enough samples have arrived, so
+    the frames are the same as those of `log_mel_spectrogram()` over the whole waveform.
+
+    Since `log_mel_spectrogram()` normalizes against the maximum over all frames, the frames can
+    be emitted in one of three modes:
+
+    - "exact" normalizes against a known `log_max`, e.g. taken from a first pass in "raw" mode;
+    - "raw" emits unnormalized log10 frames, to be passed to `normalize_log_mel()` together with
+      the final `log_max` once the whole waveform has been seen;
+    - "lookahead" holds back `lookahead` frames and normalizes every frame against the maximum
+      over all frames computed so far, which approximates the exact result for live input.
+    """
+
+    def __init__(
+        self,
+        n_mels: int = 80,
+        padding: int = 0,
+        device: Optional[Union[str, torch.device]] = None,
+        *,
+        mode: str = "lookahead",
+        log_max: Optional[float] = None,
+        lookahead: int = N_FRAMES,
+    ):
+        if mode not in {"exact", "raw", "lookahead"}:
+            raise ValueError(f"Unsupported normalization mode: {mode}")
+        if mode == "exact" and log_max is None:
+            raise ValueError(
+                "The exact normalization mode requires log_max to be given"
+            )
+
+        self.n_mels = n_mels
+        self.padding = padding
+        self.device = device
+        self.mode = mode
+        self.lookahead = lookahead
+        self.log_max = log_max if mode == "exact" else -np.inf
+
+        # samples received before the left edge can be padded
+        self.head = torch.zeros(0, device=device)
+        # reflect-padded samples, starting at the next frame to compute
+        self.buffer = None
+        self.pending = torch.zeros(n_mels, 0)  # frames held back for "lookahead" mode
+        self.flushed = False
+
+    def _frames(self, samples: torch.Tensor) -> torch.Tensor:
+        return _log_mel_frames(samples, self.n_mels)
+
+    def _append(self, samples: torch.Tensor) -> torch.Tensor:
+        if self.buffer is None:
+            # like torch.stft(center=True), reflect the beginning across the first sample
+            if self.head is not None:
+                samples = torch.cat([self.head, samples])
+            if len(samples) <= N_FFT // 2:
+                self.head = samples
+                return torch.zeros(self.n_mels, 0, device=samples.device)
+            samples = F.pad(samples[None], (N_FFT // 2, 0), mode="reflect")[0]
+            self.buffer, self.head = samples[:0], None
+
+        self.buffer = torch.cat([self.buffer, samples])
+        if len(self.buffer) < N_FFT:
+            return torch.zeros(self.n_mels, 0, device=self.buffer.device)
+
+        n_frames = (len(self.buffer) - N_FFT) // HOP_LENGTH + 1
+        frames = self._frames(self.buffer[: (n_frames - 1) * HOP_LENGTH + N_FFT])
+        self.buffer = self.buffer[n_frames * HOP_LENGTH :]
+        return frames
+
+    def _emit(self, frames: torch.Tensor, final: bool = False) -> torch.Tensor:
+        if self.mode != "exact" and frames.shape[-1] > 0:
+            self.log_max = max(self.log_max, frames.max().item())
+        if self.mode == "raw":
+            return frames
+        if self.mode == "lookahead":
+            frames = torch.cat([self.pending.to(frames.device), frames], dim=-1)
+            n_ready = frames.shape[-1] if final else frames.shape[-1] - self.lookahead
+            n_ready = max(n_ready, 0)
+            frames, self.pending = frames[:, :n_ready], frames[:, n_ready:]
+        return normalize_log_mel(frames, self.log_max)
+
+    def feed(self, audio: Union[np.ndarray, torch.Tensor]) -> torch.Tensor:
+        """
+        Add the next block of the waveform, and return the frames that became available
+
+        Returns
+        -------
+        torch.Tensor, shape = (n_mels, n_new_frames)
+        """
+        if self.flushed:
+            raise RuntimeError("Cannot feed more audio after flush()")
+        if not torch.is_tensor(audio):
+            audio = torch.from_numpy(audio)
+        if self.device is not None:
+            audio = audio.to(self.device)
+        return self._emit(self._append(audio))
+
+    def flush(self) -> torch.Tensor:
+        """
+        Mark the end of the waveform, padding it with `padding` zero samples, and return the
+        remaining frames. The total number of frames is the same as `log_mel_spectrogram()`
+        gives for the whole waveform.
+        """
+        self.flushed = True
+        device = self.device if self.device is not None else "cpu"
+        frames = self._append(torch.zeros(self.padding, device=device))
+        if self.buffer is None:
+            raise ValueError(f"At least {N_FFT // 2 + 1} samples are required")
+
+        # reflect the end across the last sample, and drop the frame centered after it
+        n_samples = len(self.buffer) - N_FFT // 2
+        tail = F.pad(self.buffer[None], (0, N_FFT // 2), mode="reflect")[0]
+        n_tail = n_samples // HOP_LENGTH
+        if n_tail > 0:
+            tail = tail[: (n_tail - 1) * HOP_LENGTH + N_FFT]
+            frames = torch.cat([frames, self._frames(tail)], dim=-1)
+        self.buffer = self.buffer[:0]
+        return self._emit(frames, final=True)
+
+
+class AudioSource:
+    """
+    Hands out windows of the log-Mel spectrogram of an audio input on demand, so that only the
+    frames that are actually decoded have to be computed. `transcribe()` accepts any subclass in
+    place of a path or a waveform.
+    """
+
+    n_mels: int
+    device: Optional[Union[str, torch.device]]
+
+    # the number of frames in the audio, or None if it is not known yet
+    num_frames: Optional[int] = None
+
+    def window(self, start: int, n_frames: int = N_FRAMES) -> torch.Tensor:
+        """
+        Return the log-Mel spectrogram frames [start, start + n_frames), or fewer of them if the
+        audio ends earlier
+
+        Returns
+        -------
+        torch.Tensor, shape = (n_mels, <= n_frames)
+        """
+        raise NotImplementedError
+
+    def available(self, end: int) -> int:
+        """Return the number of frames up to `end` in the audio"""
+        return min(end, self.num_frames)
+
+    def padded_window(self, start: int, n_frames: int = N_FRAMES) -> torch.Tensor:
+        """
+        Return the log-Mel spectrogram frames [start, start + n_frames), continuing past the end
+        of the audio with the frames of the silence that `log_mel_spectrogram()` gives for the
+        30-second padding, which is the input that language detection was always given
+
+        Returns
+        -------
+        torch.Tensor, shape = (n_mels, n_frames)
+        """
+        return pad_with_silence(self.window(start, n_frames), n_frames)
+
+
+class MelSource(AudioSource):
+    """Windows of a log-Mel spectrogram that has already been computed"""
+
+    def __init__(self, mel: torch.Tensor, num_frames: Optional[int] = None):
+        self.mel = mel
+        self.n_mels = mel.shape[-2]
+        self.device = mel.device
+        self.num_frames = mel.shape[-1] if num_frames is None else num_frames
+
+    def window(self, start: int, n_frames: int = N_FRAMES) -> torch.Tensor:
+        end = min(start + n_frames, self.num_frames)
+        return self.mel[:, start:end]
+
+    def padded_window(self, start: int, n_frames: int = N_FRAMES) -> torch.Tensor:
+        # the spectrogram that transcribe() makes includes the frames of its padding
+        return pad_with_silence(self.mel[:, start : start + n_frames], n_frames)
+
+
+class WaveformSource(AudioSource):
+    """
+    Random access to the log-Mel spectrogram of a 16 kHz waveform, computing the frames of each
+    window from the samples it overlaps with. Subclasses provide the samples, converting them to
+    float32 only when they are needed.
+
+    The frames are the same as those of `log_mel_spectrogram()` with the 30-second padding that
+    `transcribe()` uses, up to the normalization, which is done against `log_max` if it is given
+    or otherwise against the maximum of each window.
+    """
+
+    def __init__(
+        self,
+        n_mels: int = 80,
+        device: Optional[Union[str, torch.device]] = None,
+        log_max: Optional[float] = None,
+    ):
+        self.n_mels = n_mels
+        self.device = device
+        self.log_max = log_max
+        # windows are often requested twice, e.g. for language id
+        self.last_window = None
+
+    @property
+    def num_samples(self) -> int:
+        raise NotImplementedError
+
+    def samples(self, start: int, end: int) -> np.ndarray:
+        """Return the samples [start, end) as a float32 array"""
+        raise NotImplementedError
+
+    @property
+    def num_frames(self) -> int:
+        return self.num_samples // HOP_LENGTH
+
+    def window(self, start: int, n_frames: int = N_FRAMES) -> torch.Tensor:
+        return self._window(start, max(min(n_frames, self.num_frames - start), 0))
+
+    def padded_window(self, start: int, n_frames: int = N_FRAMES) -> torch.Tensor:
+        # the frames past the end are computed over zeros, as with the padding of transcribe()
+        return self._window(start, n_frames)
+
+    def _window(self, start: int, n_frames: int) -> torch.Tensor:
+        if self.last_window is not None and self.last_window[:2] == (start, n_frames):
+            return self.last_window[2]
+        if n_frames == 0:
+            return torch.zeros(self.n_mels, 0, device=self.device)
+
+        # the STFT windows are centered on the frames, reflecting the waveform at its beginning
+        # and overlapping with the zero padding at its end
+        begin = start * HOP_LENGTH - N_FFT // 2
+        end = (start + n_frames - 1) * HOP_LENGTH + N_FFT // 2
+        # read past `end` at the beginning, as reflection needs more than N_FFT // 2 samples
+        read_end = max(end, N_FFT // 2 + 1)
+        samples = self.samples(max(begin, 0), min(read_end, self.num_samples))
+        samples = torch.from_numpy(samples)
+        if self.device is not None:
+            samples = samples.to(self.device)
+        samples = F.pad(samples, (0, read_end - max(begin, 0) - len(samples)))
+        if begin < 0:
+            samples = F.pad(samples[None], (N_FFT // 2, 0), mode="reflect")[0]
+            samples = samples[start * HOP_LENGTH : start * HOP_LENGTH + end - begin]
+
+        log_spec = _log_mel_frames(samples, self.n_mels)
+        mel = normalize_log_mel(log_spec, self.log_max)
+        self.last_window = (start, n_frames, mel)
+        return mel
+
+
+class ArraySource(WaveformSource):
+    """A waveform held in memory as a NumPy array or a Tensor of floating-point samples"""
+
+    def __init__(self, audio: Union[np.ndarray, torch.Tensor], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.audio = audio.cpu().numpy() if torch.is_tensor(audio) else audio
+
+    @property
+    def num_samples(self) -> int:
+        return len(self.audio)
+
+    def samples(self, start: int, end: int) -> np.ndarray:
+        return np.asarray(self.audio[start:end], dtype=np.float32)
+
+
+class Int16Source(WaveformSource):
+    """
+    A waveform of 16-bit little-endian PCM samples in any object supporting the buffer protocol,
+    such as bytes, a memoryview, an int16 array or an mmap, which is never copied as a whole
+    """
+
+    def __init__(self, buffer, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pcm = np.frombuffer(buffer, dtype="<i2") if buffer is not None else None
+
+    @property
+    def num_samples(self) -> int:
+        return len(self.pcm)
+
+    def samples(self, start: int, end: int) -> np.ndarray:
+        return self.pcm[start:end].astype(np.float32) / 32768.0
+
+
+class BytesSource(Int16Source):
+    """
+    An audio file in any format that ffmpeg supports, given as its contents in memory; it is
+    decoded into 16-bit samples when the first window is requested
+    """
+
+    def __init__(self, data: bytes, *args, **kwargs):
+        super().__init__(None, *args, **kwargs)
+        self.data = data
+
+    @property
+    def num_samples(self) -> int:
+        if self.pcm is None:
+            self.pcm = _ffmpeg_pcm16("-", SAMPLE_RATE, data=self.data)
+            self.data = None
+        return len(self.pcm)
+
+
+class FileSource(Int16Source):
+    """
+    An audio file, whose samples are memory-mapped if it is a mono 16 kHz 16-bit PCM WAV file,
+    or otherwise decoded into 16-bit samples by ffmpeg when the first window is requested
+    """
+
+    def __init__(self, file: str, *args, **kwargs):
+        super().__init__(None, *args, **kwargs)
+        self.file = file
+
+    @property
+    def num_samples(self) -> int:
+        if self.pcm is None:
+            self.pcm = _map_wav(self.file, SAMPLE_RATE)
+        if self.pcm is None:
+            self.pcm = _ffmpeg_pcm16(self.file, SAMPLE_RATE)
+        return len(self.pcm)
+
+
+class ClipSource(WaveformSource):
+    """
+    The given clips of an audio file, each decoded by seeking to it, so that the cost depends on
+    the length of the clips rather than that of the file. Frames keep their position in the file
+    and the audio between the clips reads as silence, so timestamps need no adjustment.
+
+    `clips` are (start, end) pairs in seconds, where the end of the last clip may be None to read
+    until the end of the file. Unless `log_max` is given, the frames are normalized against the
+    maximum over all clips, as `log_mel_spectrogram()` does over the whole file.
+    """
+
+    def __init__(
+        self,
+        file: str,
+        clips: List[Tuple[float, Optional[float]]],
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.file = file
+        self.clips = clips
+        self.ranges: Optional[List[Tuple[int, np.ndarray]]] = None
+
+    def _load(self):
+        # decode each clip with enough context for the STFT windows on its edges
+        wav = _map_wav(self.file, SAMPLE_RATE)
+        self.ranges = []
+        for start, end in self.clips:
+            begin = max(round(start * SAMPLE_RATE) - N_FFT // 2, 0)
+            end = None if end is None else round(end * SAMPLE_RATE) + N_FFT // 2
+            if wav is not None:
+                pcm = wav[begin:end]
+            else:
+                duration = None if end is None else (end - begin) / SAMPLE_RATE
+                pcm = _ffmpeg_pcm16(
+                    self.file, SAMPLE_RATE, None, begin / SAMPLE_RATE, duration
+                )
+            self.ranges.append((begin, pcm))
+
+        if self.log_max is None:
+            log_specs = [
+                _log_mel_frames(torch.from_numpy(pcm / np.float32(32768)), self.n_mels)
+                for _, pcm in self.ranges
+                if len(pcm) >= N_FFT
+            ]
+            if log_specs:
+                self.log_max = max(log_spec.max().item() for log_spec in log_specs)
+
+    @property
+    def num_samples(self) -> int:
+        if self.ranges is None:
+            self._load()
+        return max((begin + len(pcm) for begin, pcm in self.ranges), default=0)
+
+    def samples(self, start: int, end: int) -> np.ndarray:
+        if self.ranges is None:
+            self._load()
+        out = np.zeros(end - start, dtype=np.float32)
+        for begin, pcm in self.ranges:
+            lo, hi = max(start, begin), min(end, begin + len(pcm))
+            if lo < hi:
+                out[lo - start : hi - start] = pcm[lo - begin : hi - begin] / 32768.0
+        return out
+
+
+class AudioStream(AudioSource):
+    """
+    Sequential access to the log-Mel spectrogram of a waveform that arrives in blocks, such as
+    the ones yielded by `load_audio_stream()`. Windows have to be requested at non-decreasing
+    offsets, and only the frames of the current window are kept in memory.
+
+    The frames are normalized in the "lookahead" mode of `ChunkedLogMel`, unless `log_max` is
+    given, e.g. from a first pass over the stream in "raw" mode; the frames are then the same as
+    slicing the output of `log_mel_spectrogram()` computed over the whole waveform.
+    """
+
+    def __init__(
+        self,
+        blocks: Iterable[np.ndarray],
+        n_mels: int = 80,
+        device: Optional[Union[str, torch.device]] = None,
+        *,
+        log_max: Optional[float] = None,
+        lookahead: int = N_FRAMES,
+    ):
+        self.blocks = iter(blocks)
+        self.n_mels = n_mels
+        self.device = device
+        # pad enough silence that the frames near the end only overlap with zeros on their
+        # right, like the 30-second padding in transcribe() does
+        self.engine = ChunkedLogMel(
+            n_mels,
+            padding=N_FFT,
+            device=device,
+            mode="lookahead" if log_max is None else "exact",
+            log_max=log_max,
+            lookahead=lookahead,
+        )
+        self.frames = torch.zeros(n_mels, 0)
+        self.frames_start = 0  # the index of the first frame in self.frames
+        self.n_samples = 0
+        self.num_frames: Optional[int] = None  # known once the stream is exhausted
+
+    def _fill(self, start: int, end: int):
+        """Compute the frames [start, end), reading blocks and dropping earlier frames"""
+        if start < self.frames_start:
+            raise ValueError("Cannot seek backwards in an audio stream")
+
+        while (
+            self.num_frames is None and self.frames_start + self.frames.shape[-1] < end
+        ):
+            block = next(self.blocks, None)
+            if block is None:
+                self.num_frames = self.n_samples // HOP_LENGTH
+                new_frames = self.engine.flush()
+            else:
+                self.n_samples += len(block)
+                new_frames = self.engine.feed(block)
+            self.frames = torch.cat([self.frames.to(new_frames.device), new_frames], -1)
+            if (skip := start - self.frames_start) > 0:
+                self.frames = self.frames[:, skip:]
+                self.frames_start = start
+
+        if self.num_frames is not None:  # drop the frames of the padding
+            self.frames = self.frames[:, : max(self.num_frames - self.frames_start, 0)]
+        skip = min(start - self.frames_start, self.frames.shape[-1])
+        self.frames = self.frames[:, skip:]
+        self.frames_start += skip
+
+    def available(self, end: int) -> int:
+        """Return the number of frames up to `end` in the stream, reading ahead as necessary"""
+        self._fill(self.frames_start, end)
+        if self.num_frames is not None:
+            return min(end, self.num_frames)
+        return end
+
+    def window(self, start: int, n_frames: int = N_FRAMES) -> torch.Tensor:
+        """
+        Return the log-Mel spectrogram frames [start, start + n_frames), or fewer of them if the
+        stream ends earlier. Frames before `start` are no longer available after this call.
+        """
+        self._fill(start, start + n_frames)
+        return self.frames[:, :n_frames]
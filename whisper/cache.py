@@ -0,0 +1,201 @@
+import hashlib
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional, Union
+
+import numpy as np
+import torch
+
+from .audio import MEL_FRONTEND_VERSION, log_mel_spectrogram, resolve_mel_frontend
+
+if TYPE_CHECKING:
+    from .model import Whisper
+
+
+def file_digest(file: str, block_size: int = 1 << 20) -> str:
+    """Returns the SHA256 hex digest of the contents of a file, read in blocks"""
+    sha256 = hashlib.sha256()
+    with open(file, "rb") as f:
+        while block := f.read(block_size):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class MelCache:
+    """
+    An on-disk cache of log-Mel spectrograms, so that repeated runs over the same audio files skip
+    decoding and the STFT. Each spectrogram is stored as an `.npy` file and reopened memory-mapped.
+
+    Entries are keyed by the SHA256 of the file contents, the number of Mel bins, the padding, the
+    mel frontend and `MEL_FRONTEND_VERSION`. When `max_size` is given, the least recently used entries are evicted
+    once the cache grows beyond that many bytes.
+    """
+
+    def __init__(self, root: str, max_size: Optional[int] = None):
+        self.root = root
+        self.max_size = max_size
+        os.makedirs(root, exist_ok=True)
+
+    def path(
+        self, file: str, n_mels: int, padding: int = 0, frontend: str = "torch"
+    ) -> str:
+        frontend = f"{frontend}-v{MEL_FRONTEND_VERSION}"
+        key = f"{file_digest(file)}-{n_mels}-{padding}-{frontend}"
+        return os.path.join(self.root, f"{key}.npy")
+
+    def load(self, path: str) -> Optional[np.ndarray]:
+        try:
+            # copy-on-write, so that torch.from_numpy() gets a writable array
+            mel = np.load(path, mmap_mode="c", allow_pickle=False)
+        except (OSError, ValueError):
+            # missing, or partially written by a crashed process
+            return None
+
+        os.utime(path)  # the modification time tracks the last use, for LRU eviction
+        return mel
+
+    def store(self, path: str, mel: np.ndarray):
+        # write to a temporary file first, so that concurrent readers never see partial entries
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, mel, allow_pickle=False)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        self.evict(keep=path)
+
+    def evict(self, keep: Optional[str] = None):
+        """Remove the least recently used entries until the cache fits in `max_size` bytes"""
+        if self.max_size is None:
+            return
+
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".npy") and entry.path != keep:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        if keep is not None and os.path.exists(keep):
+            total_size += os.path.getsize(keep)
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # already evicted by another process
+                pass
+            total_size -= size
+
+    def log_mel_spectrogram(
+        self,
+        file: str,
+        n_mels: int = 80,
+        padding: int = 0,
+        device: Optional[Union[str, torch.device]] = None,
+        frontend: str = "torch",
+    ) -> torch.Tensor:
+        """
+        Same as `whisper.audio.log_mel_spectrogram()` for an audio file, reading the result from
+        the cache if it is there and storing it otherwise
+        """
+        frontend = resolve_mel_frontend(frontend)
+        path = self.path(file, n_mels, padding, frontend)
+        if (mel := self.load(path)) is None:
+            mel = log_mel_spectrogram(file, n_mels, padding, frontend=frontend).numpy()
+            self.store(path, mel)
+
+        mel = torch.from_numpy(mel)
+        return mel if device is None else mel.to(device)
+
+
+class EncoderCache:
+    """
+    An in-memory cache of the audio features that the encoder computes for each mel window, so
+    that a window is encoded once when its language is detected, when it is decoded at each
+    temperature, and when its words are aligned.
+
+    Entries are keyed by the model, the dtype and shape of the window, and the SHA256 of its
+    contents. The least recently used entries are evicted once the features take more than
+    `max_size` bytes, or once there are more than `max_entries` of them. `hits` and `misses` count
+    the windows found in the cache and those encoded.
+    """
+
+    def __init__(
+        self, max_size: int = 256 * 1024**2, max_entries: Optional[int] = None
+    ):
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, model: "Whisper", mel: torch.Tensor) -> tuple:
+        data = mel.detach().contiguous().flatten().view(torch.uint8).cpu().numpy()
+        digest = hashlib.sha256(data).hexdigest()
+        return id(model), str(mel.dtype), tuple(mel.shape), digest
+
+    def get(self, model: "Whisper", key: tuple) -> Optional[torch.Tensor]:
+        with self.lock:
+            entry = self.entries.get(key)
+            # the id of a model that was garbage-collected can be reused by another one
+            if entry is None or entry[0]() is not model:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, model: "Whisper", key: tuple, features: torch.Tensor):
+        size = features.numel() * features.element_size()
+        if size > self.max_size:
+            return
+
+        with self.lock:
+            if (entry := self.entries.pop(key, None)) is not None:
+                self.size -= entry[1].numel() * entry[1].element_size()
+            self.entries[key] = (weakref.ref(model), features)
+            self.size += size
+            while self.size > self.max_size or (
+                self.max_entries is not None and len(self.entries) > self.max_entries
+            ):
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted.numel() * evicted.element_size()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    @torch.no_grad()
+    def embed_audio(
+        self, model: "Whisper", mel: torch.Tensor, truncate: bool = False
+    ) -> torch.Tensor:
+        """
+        Same as `model.embed_audio()` for a mel window or a batch of them, encoding only the
+        windows that are not in the cache
+        """
+        single = mel.ndim == 2
+        if single:
+            mel = mel.unsqueeze(0)
+
+        keys = [self.key(model, window) for window in mel]
+        features = [self.get(model, key) for key in keys]
+        if missing := [k for k, f in enumerate(features) if f is None]:
+            encoded = model.embed_audio(mel[missing], truncate)
+            for k, window_features in zip(missing, encoded):
+                features[k] = window_features
+                # a copy, as a view of its row would keep the whole batch alive in the cache
+                self.put(model, keys[k], window_features.clone())
+
+        features = torch.stack(features)
+        return features[0] if single else features
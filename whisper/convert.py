@@ -0,0 +1,250 @@
+import argparse
+import json
+import mmap
+import os
+import tempfile
+from dataclasses import asdict
+from typing import TYPE_CHECKING, Dict, Optional, Tuple, Union
+
+import torch
+from torch import Tensor
+
+from .decoding import DTYPES
+
+if TYPE_CHECKING:
+    from .model import Whisper
+
+# the first bytes of a converted model file, followed by the length of its JSON header
+MAGIC = b"WHISPER1"
+
+# the tensors start at multiples of this many bytes, so that each can be mapped as it is
+ALIGNMENT = 64
+
+# the dtypes that a model can be converted to
+CONVERTED_DTYPES = [*DTYPES, "int8"]
+
+TENSOR_DTYPES = {
+    "float64": torch.float64,
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+    "int64": torch.int64,
+    "int8": torch.int8,
+}
+
+
+def _aligned(n: int) -> int:
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _read_header(f) -> Tuple[Optional[dict], int]:
+    """Returns the header of a converted model file and where its tensors start, if it is one"""
+    if f.read(len(MAGIC)) != MAGIC:
+        return None, 0
+    header_size = int.from_bytes(f.read(8), "little")
+    return json.loads(f.read(header_size)), len(MAGIC) + 8 + header_size
+
+
+def read_header(path: str) -> Optional[dict]:
+    """
+    Returns the JSON header of a model file converted by `save_converted()`, or None if the file
+    at `path` is not one
+    """
+    with open(path, "rb") as f:
+        return _read_header(f)[0]
+
+
+def converted_tensors(model: "Whisper", dtype: str) -> Dict[str, Tensor]:
+    """
+    Returns the tensors to store for a model converted to `dtype`. For "fp16", "bf16" and "fp32",
+    these are the weights as `Whisper.prepare_for_inference()` leaves them, and the transposed
+    token embedding that it makes for the logits projection. For "int8", these are the weights
+    that `Whisper.quantize()` leaves in float32, and the int8 weights of the `Linear` layers,
+    each with its scales and zero points per output channel. The model is converted in place.
+    """
+    if dtype == "int8":
+        from torch.ao.nn.quantized.dynamic import Linear as DynamicLinear
+
+        model.quantize(dtype)
+        linears = {
+            name: module
+            for name, module in model.named_modules()
+            if isinstance(module, DynamicLinear)
+        }
+        prefixes = tuple(f"{name}." for name in linears)
+        tensors = {
+            name: tensor
+            for name, tensor in model.state_dict().items()
+            if not name.startswith(prefixes)
+        }
+        for name, module in linears.items():
+            weight = module.weight()
+            tensors[f"{name}.weight"] = weight.int_repr()
+            tensors[f"{name}.weight_scale"] = weight.q_per_channel_scales()
+            tensors[f"{name}.weight_zero_point"] = weight.q_per_channel_zero_points()
+            if module.bias() is not None:
+                tensors[f"{name}.bias"] = module.bias()
+        return tensors
+
+    model.prepare_for_inference(DTYPES[dtype], "cpu")
+    tensors = dict(model.state_dict())
+    tensors["decoder.output_projection"] = model.decoder.output_projection
+    return tensors
+
+
+def save_converted(
+    model: "Whisper",
+    path: str,
+    dtype: str = "fp16",
+    alignment_heads: Optional[bytes] = None,
+):
+    """
+    Write a model to a flat file that `load_converted()` maps without a copy: `MAGIC`, the
+    length of a JSON header as 8 little-endian bytes, the header, and the tensors, each starting
+    at a multiple of `ALIGNMENT` bytes. The header holds the `ModelDimensions`, the alignment heads
+    in the form of `Whisper.set_alignment_heads()`, the dtype converted to, and the dtype, shape
+    and offset of each tensor from the end of the header. The model is converted in place.
+    """
+    if dtype not in CONVERTED_DTYPES:
+        raise ValueError(f"dtype should be one of {CONVERTED_DTYPES}")
+
+    tensors = converted_tensors(model, dtype)
+    header = {
+        "dims": asdict(model.dims),
+        "alignment_heads": alignment_heads.decode() if alignment_heads else None,
+        "dtype": dtype,
+        "tensors": {},
+    }
+    offset = 0
+    for name, tensor in tensors.items():
+        header["tensors"][name] = {
+            "dtype": str(tensor.dtype).split(".")[-1],
+            "shape": list(tensor.shape),
+            "offset": offset,
+        }
+        offset = _aligned(offset + tensor.numel() * tensor.element_size())
+
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b" " * (_aligned(len(header_bytes) + 16) - len(header_bytes) - 16)
+
+    # write to a temporary file first, so that a model being loaded is never partially written
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(header_bytes).to_bytes(8, "little"))
+            f.write(header_bytes)
+            start = f.tell()
+            for name, tensor in tensors.items():
+                f.write(b"\0" * (start + header["tensors"][name]["offset"] - f.tell()))
+                data = tensor.detach().cpu().contiguous().flatten().view(torch.uint8)
+                f.write(data.numpy().tobytes())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def read_converted(path: str) -> Tuple[dict, Dict[str, Tensor]]:
+    """
+    Returns the header of a converted model file and its tensors, which are views into the file
+    mapped copy-on-write: processes that load the same file share its pages in memory
+    """
+    with open(path, "rb") as f:
+        header, start = _read_header(f)
+        if header is None:
+            raise ValueError(f"{path} is not a converted Whisper model")
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    tensors = {}
+    for name, info in header["tensors"].items():
+        shape = info["shape"]
+        tensors[name] = torch.frombuffer(
+            buffer,
+            dtype=TENSOR_DTYPES[info["dtype"]],
+            count=torch.Size(shape).numel(),
+            offset=start + info["offset"],
+        ).view(shape)
+    return header, tensors
+
+
+def load_converted(
+    path: str,
+    device: Optional[Union[str, torch.device]] = None,
+    dtype: Optional[str] = None,
+    quantize: Optional[str] = None,
+) -> "Whisper":
+    """
+    Load a model converted by `save_converted()`. On CPU, the weights of a model converted to a
+    floating-point dtype are the mapped tensors themselves, unless `dtype` or `quantize` asks
+    for another one; int8 weights are copied once, as the quantized layers pack them.
+    """
+    from . import _MMAP_SUPPORTED
+    from .model import ModelDimensions, Whisper
+
+    if not _MMAP_SUPPORTED:
+        # the model is built around the mapped tensors with `Whisper.from_state_dict()`
+        raise RuntimeError("Loading a converted model needs torch 2.1 or later")
+
+    header, tensors = read_converted(path)
+    dims = ModelDimensions(**header["dims"])
+
+    if header["dtype"] == "int8":
+        from torch.ao.nn.quantized.dynamic import Linear as DynamicLinear
+
+        suffix = ".weight_scale"
+        names = [n[: -len(suffix)] for n in tensors if n.endswith(suffix)]
+        linears = {
+            name: [
+                tensors.pop(f"{name}.{key}", None)
+                for key in ["weight", "weight_scale", "weight_zero_point", "bias"]
+            ]
+            for name in names
+        }
+        model = Whisper.from_state_dict(dims, tensors, strict=False)
+        for name, (weight, scale, zero_point, bias) in linears.items():
+            parent_name, _, child_name = name.rpartition(".")
+            parent = model.get_submodule(parent_name)
+            child = getattr(parent, child_name)
+            weight = torch._make_per_channel_quantized_tensor(
+                weight, scale, zero_point, axis=0
+            )
+            quantized = DynamicLinear(
+                child.in_features, child.out_features, dtype=torch.qint8
+            )
+            quantized.set_weight_bias(weight, bias)
+            setattr(parent, child_name, quantized)
+    else:
+        output_projection = tensors.pop("decoder.output_projection")
+        model = Whisper.from_state_dict(dims, tensors, DTYPES[header["dtype"]])
+        model.decoder.output_projection = output_projection
+
+    model.eval().requires_grad_(False)
+    if header["alignment_heads"] is not None:
+        model.set_alignment_heads(header["alignment_heads"].encode())
+
+    if header["dtype"] == "int8" or (
+        quantize is None and dtype in (None, header["dtype"])
+    ):
+        return model.to(device)
+    if quantize is not None:
+        return model.quantize(quantize)
+    return model.prepare_for_inference(DTYPES[dtype], device)
+
+
+def cli(argv=None):
+    from . import _ALIGNMENT_HEADS, available_models, load_model
+
+    # fmt: off
+    parser = argparse.ArgumentParser(prog="whisper convert", description="convert a model to a file that loads without copying its weights", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("model", type=str, help=f"name of the Whisper model to convert, one of {available_models()}, or path to a model checkpoint")
+    parser.add_argument("--output", "-o", type=str, required=True, help="path to write the converted model to")
+    parser.add_argument("--dtype", type=str, default="fp16", choices=CONVERTED_DTYPES, help="the dtype to store the weights in, which the model then runs in")
+    parser.add_argument("--model_dir", type=str, default=None, help="the path to save model files; uses ~/.cache/whisper by default")
+    # fmt: on
+
+    args = parser.parse_args(argv)
+    model = load_model(args.model, device="cpu", download_root=args.model_dir)
+    save_converted(
+        model, args.output, args.dtype, _ALIGNMENT_HEADS.get(args.model, None)
+    )
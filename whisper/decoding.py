@@ -1,5 +1,15 @@
 from dataclasses import dataclass, field, replace
-from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import numpy as np
 import torch
@@ -12,17 +22,18 @@ from .tokenizer import Tokenizer, get_tokenizer
 from .utils import compression_ratio
 
 if TYPE_CHECKING:
-    from .model import Whisper
+    from .model import KVCache, Whisper
 
 
 @torch.no_grad()
 def detect_language(
-    model: "Whisper", mel: Tensor, tokenizer: Tokenizer = None
+    model: "Whisper", mel: Tensor, tokenizer: Tokenizer = None, truncate: bool = False
 ) -> Tuple[Tensor, List[dict]]:
     """
     Detect the spoken language in the audio, and return them as list of strings, along with the ids
     of the most probable language tokens and the probability distribution over all language tokens.
     This is performed outside the main decode loop in order to not interfere with kv-caching.
+    With `truncate`, the audio may be shorter than a full window; see `AudioEncoder.forward()`.
 
     Returns
     -------
@@ -48,24 +59,22 @@ def detect_language(
         mel = mel.unsqueeze(0)
 
     # skip encoder forward pass if already-encoded audio features were given
-    if mel.shape[-2:] != (model.dims.n_audio_ctx, model.dims.n_audio_state):
-        mel = model.encoder(mel)
+    if not is_audio_features(model, mel, truncate):
+        mel = model.encoder(mel, truncate)
 
-    # forward pass using a single token, startoftranscript
+    # forward pass using a single token, startoftranscript, over the language tokens only
     n_audio = mel.shape[0]
     x = torch.tensor([[tokenizer.sot]] * n_audio).to(mel.device)  # [n_audio, 1]
-    logits = model.logits(x, mel)[:, 0]
+    language_token_ids = torch.tensor(tokenizer.all_language_tokens, device=mel.device)
+    logits = model.decoder(x, mel, vocabulary=language_token_ids)[:, 0]
 
-    # collect detected languages; suppress all non-language tokens
-    mask = torch.ones(logits.shape[-1], dtype=torch.bool)
-    mask[list(tokenizer.all_language_tokens)] = False
-    logits[:, mask] = -np.inf
-    language_tokens = logits.argmax(dim=-1)
+    # collect detected languages, among the language tokens
+    language_tokens = language_token_ids[logits.argmax(dim=-1)]
     language_token_probs = logits.softmax(dim=-1).cpu()
     language_probs = [
         {
             c: language_token_probs[i, j].item()
-            for j, c in zip(tokenizer.all_language_tokens, tokenizer.all_language_codes)
+            for j, c in enumerate(tokenizer.all_language_codes)
         }
         for i in range(n_audio)
     ]
@@ -77,6 +86,42 @@ def detect_language(
     return language_tokens, language_probs
 
 
+def is_audio_features(model: "Whisper", x: Tensor, truncate: bool = False) -> bool:
+    """
+    Whether `x` holds audio features from the encoder rather than a log-Mel spectrogram, i.e. has
+    the shape (..., n_audio_ctx, n_audio_state) of an encoded window.
+
+    With `truncate`, for audio encoded only up to its length as with
+    `transcribe(..., truncate_audio=True)`, the features may have fewer positions. A spectrogram
+    of `n_audio_state` frames then has their shape too, when its `n_mels` rows are taken for
+    positions, so that features of exactly `n_mels` positions count as a spectrogram; those are
+    recognized by `decode()` only when given along with their `audio_kv`.
+    """
+    n_ctx, n_state = x.shape[-2:]
+    if not truncate:
+        return (n_ctx, n_state) == (model.dims.n_audio_ctx, model.dims.n_audio_state)
+    if n_state != model.dims.n_audio_state or n_ctx > model.dims.n_audio_ctx:
+        return False
+    return n_ctx != model.dims.n_mels
+
+
+# the dtypes that inference can run in, by the names that `DecodingOptions.dtype` accepts
+DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}
+
+
+def bf16_supported(device: Union[str, torch.device]) -> bool:
+    """Whether the device has native bfloat16 matrix multiplications, e.g. AVX512-BF16 or AMX"""
+    device = torch.device(device)
+    if device.type == "cuda":
+        return torch.cuda.is_bf16_supported()
+    if device.type == "cpu":
+        try:
+            return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+        except (AttributeError, RuntimeError):  # a build without oneDNN
+            return False
+    return False
+
+
 @dataclass(frozen=True)
 class DecodingOptions:
     # whether to perform X->X "transcribe" or X->English "translate"
@@ -112,6 +157,9 @@ class DecodingOptions:
 
     # implementation details
     fp16: bool = True  # use fp16 for most of the calculation
+    dtype: Optional[str] = None  # "fp16", "bf16" or "fp32" to use instead of `fp16`
+    # compile the decoding steps with torch.compile; see StaticInference
+    compile: bool = False
 
 
 @dataclass(frozen=True)
@@ -128,8 +176,18 @@ class DecodingResult:
 
 
 class Inference:
-    def logits(self, tokens: Tensor, audio_features: Tensor) -> Tensor:
-        """Perform a forward pass on the decoder and return per-token logits"""
+    def logits(
+        self,
+        tokens: Tensor,
+        audio_features: Tensor,
+        positions: Optional[List[int]] = None,
+        vocabulary: Optional[slice] = None,
+    ) -> Tensor:
+        """
+        Perform a forward pass on the decoder and return per-token logits, at the given indices
+        into the new tokens of this step only, e.g. `[-1]`, or at all of them by default, and
+        over the given range of token ids only, or the whole vocabulary by default
+        """
         raise NotImplementedError
 
     def rearrange_kv_cache(self, source_indices) -> None:
@@ -142,38 +200,135 @@ class Inference:
 
 
 class PyTorchInference(Inference):
-    def __init__(self, model: "Whisper", initial_token_length: int):
+    def __init__(
+        self,
+        model: "Whisper",
+        initial_token_length: int,
+        audio_kv: Optional[List[Tuple[Tensor, Tensor]]] = None,
+    ):
         self.model: "Whisper" = model
         self.initial_token_length = initial_token_length
-        self.kv_cache = {}
-        self.hooks = []
-
-        key_modules = [block.attn.key for block in self.model.decoder.blocks]
-        value_modules = [block.attn.value for block in self.model.decoder.blocks]
-        self.kv_modules = key_modules + value_modules
+        self.shared_audio_kv = audio_kv
+        self.kv_cache: Optional["KVCache"] = None
 
-    def logits(self, tokens: Tensor, audio_features: Tensor) -> Tensor:
-        if not self.kv_cache:
-            self.kv_cache, self.hooks = self.model.install_kv_cache_hooks()
+    def logits(
+        self,
+        tokens: Tensor,
+        audio_features: Tensor,
+        positions: Optional[List[int]] = None,
+        vocabulary: Optional[slice] = None,
+    ) -> Tensor:
+        if self.kv_cache is None:
+            from .model import KVCache
+
+            self.kv_cache = KVCache(self.model.dims.n_text_ctx)
+            if self.shared_audio_kv is not None:
+                decoder = self.model.decoder
+                audio_kv = decoder.repeat_audio_kv(
+                    self.shared_audio_kv, tokens.shape[0]
+                )
+                for block, kv in zip(decoder.blocks, audio_kv):
+                    self.kv_cache.cross_attn[block.cross_attn] = kv
 
         if tokens.shape[-1] > self.initial_token_length:
             # only need to use the last token except in the first forward pass
             tokens = tokens[:, -1:]
 
-        return self.model.decoder(tokens, audio_features, kv_cache=self.kv_cache)
+        return self.model.decoder(
+            tokens,
+            audio_features,
+            kv_cache=self.kv_cache,
+            logit_positions=positions,
+            vocabulary=vocabulary,
+        )
 
     def cleanup_caching(self):
-        for hook in self.hooks:
-            hook.remove()
+        self.kv_cache = None
 
-        self.kv_cache = {}
-        self.hooks = []
+    def rearrange_kv_cache(self, source_indices):
+        if source_indices != list(range(len(source_indices))):
+            # update the key/value cache to contain the selected sequences
+            self.kv_cache.rearrange(source_indices)
+
+
+class StaticInference(Inference):
+    """
+    Runs the decoder through `TextDecoder.decode_step()`, whose tensors keep the same shapes
+    from step to step, so that the steps after the first can run as one graph compiled with
+    `torch.compile`. The compiled function is kept on the decoder and reused across calls;
+    compiling it takes a while on the first call, and again for each new batch size,
+    dtype or length of truncated audio; see `transcribe(..., truncate_audio=True)`.
+    """
+
+    def __init__(
+        self,
+        model: "Whisper",
+        initial_token_length: int,
+        compile: bool,
+        audio_kv: Optional[List[Tuple[Tensor, Tensor]]] = None,
+    ):
+        self.model: "Whisper" = model
+        self.initial_token_length = initial_token_length
+        self.compile = compile
+        self.shared_audio_kv = audio_kv
+        self.cache: Optional[List[Tuple[Tensor, Tensor]]] = None
+        self.audio_kv: Optional[List[Tuple[Tensor, Tensor]]] = None
+        self.offset: Optional[Tensor] = None
+
+    def logits(
+        self,
+        tokens: Tensor,
+        audio_features: Tensor,
+        positions: Optional[List[int]] = None,
+        vocabulary: Optional[slice] = None,
+    ) -> Tensor:
+        decoder = self.model.decoder
+        if self.cache is None:
+            n_batch = tokens.shape[0]
+            if self.shared_audio_kv is not None:
+                self.audio_kv = decoder.repeat_audio_kv(self.shared_audio_kv, n_batch)
+            else:
+                self.audio_kv = decoder.audio_kv(audio_features, n_batch)
+            self.cache = decoder.empty_cache(
+                n_batch, audio_features.dtype, audio_features.device
+            )
+            self.offset = torch.tensor(0, device=tokens.device)
+
+        if tokens.shape[-1] > self.initial_token_length:
+            # only need to use the last token except in the first forward pass; copied, so
+            # that its strides do not change between steps and cause recompilations
+            tokens = tokens[:, -1:].clone(memory_format=torch.contiguous_format)
+            logits = self.decode_step()(tokens, self.cache, self.audio_kv, self.offset)
+            if vocabulary is not None:
+                # sliced after the projection, which keeps the compiled graph the same
+                logits = logits[..., vocabulary]
+        else:
+            # the prompt has a varying length, and runs eagerly
+            logits = decoder.decode_step(
+                tokens, self.cache, self.audio_kv, self.offset, positions, vocabulary
+            )
+
+        self.offset = self.offset + tokens.shape[-1]
+        return logits
+
+    def decode_step(self) -> Callable:
+        decoder = self.model.decoder
+        if not self.compile:
+            return decoder.decode_step
+        if decoder.compiled_decode_step is None:
+            decoder.compiled_decode_step = torch.compile(
+                decoder.decode_step, dynamic=False
+            )
+        return decoder.compiled_decode_step
+
+    def cleanup_caching(self):
+        self.cache = self.audio_kv = self.offset = None
 
     def rearrange_kv_cache(self, source_indices):
         if source_indices != list(range(len(source_indices))):
-            for module in self.kv_modules:
-                # update the key/value cache to contain the selected sequences
-                self.kv_cache[module] = self.kv_cache[module][source_indices].detach()
+            for key, value in self.cache:
+                key.copy_(key[source_indices])
+                value.copy_(value[source_indices])
 
 
 class SequenceRanker:
@@ -214,9 +369,29 @@ class MaximumLikelihoodRanker(SequenceRanker):
 
 
 class TokenDecoder:
+    # preallocated tokens of all decoding steps, set by `DecodingTask`; `extend()` writes the
+    # selected tokens into it instead of concatenating a new tensor at every step
+    buffer: Optional[Tensor] = None
+
     def reset(self):
         """Initialize any stateful variables for decoding a new sequence"""
 
+    def extend(self, tokens: Tensor, next_tokens: Tensor) -> Tensor:
+        """Append `next_tokens` to `tokens`, in place in `buffer` if there is room left"""
+        length = tokens.shape[-1]
+        buffer = self.buffer
+        if (
+            buffer is None
+            or buffer.shape[0] != tokens.shape[0]
+            or buffer.shape[-1] <= length
+        ):
+            return torch.cat([tokens, next_tokens[:, None]], dim=-1)
+
+        if tokens.data_ptr() != buffer.data_ptr():
+            buffer[:, :length] = tokens
+        buffer[:, length] = next_tokens
+        return buffer[:, : length + 1]
+
     def update(
         self, tokens: Tensor, logits: Tensor, sum_logprobs: Tensor
     ) -> Tuple[Tensor, bool]:
@@ -287,7 +462,7 @@ class GreedyDecoder(TokenDecoder):
         sum_logprobs += current_logprobs * (tokens[:, -1] != self.eot)
 
         next_tokens[tokens[:, -1] == self.eot] = self.eot
-        tokens = torch.cat([tokens, next_tokens[:, None]], dim=-1)
+        tokens = self.extend(tokens, next_tokens)
 
         completed = (tokens[:, -1] == self.eot).all()
         return tokens, completed
@@ -361,7 +536,10 @@ class BeamSearchDecoder(TokenDecoder):
 
             finished_sequences.append(finished)
 
-        tokens = torch.tensor(next_tokens, device=tokens.device)
+        last_tokens = torch.tensor(
+            [seq[-1] for seq in next_tokens], device=tokens.device
+        )
+        tokens = self.extend(tokens[source_indices], last_tokens)
         self.inference.rearrange_kv_cache(source_indices)
 
         # add newly finished sequences to self.finished_sequences
@@ -419,6 +597,14 @@ class LogitFilter:
         """
         raise NotImplementedError
 
+    def allowed_tokens(self, tokens: Tensor) -> Optional[slice]:
+        """
+        The range of token ids outside of which `apply()` will suppress the logits of every
+        sequence at the current step, if it is known before the forward pass, so that the logits
+        of only those tokens need to be computed; None if any token may be sampled
+        """
+        return None
+
 
 class SuppressBlank(LogitFilter):
     def __init__(self, tokenizer: Tokenizer, sample_begin: int):
@@ -449,6 +635,25 @@ class ApplyTimestampRules(LogitFilter):
         self.sample_begin = sample_begin
         self.max_initial_timestamp_index = max_initial_timestamp_index
 
+    def allowed_tokens(self, tokens: Tensor) -> Optional[slice]:
+        timestamp_begin = self.tokenizer.timestamp_begin
+        if tokens.shape[1] == self.sample_begin:
+            # only the initial timestamps, up to `max_initial_timestamp`
+            if self.max_initial_timestamp_index is None:
+                return slice(timestamp_begin, None)
+            last_allowed = timestamp_begin + self.max_initial_timestamp_index
+            return slice(timestamp_begin, last_allowed + 1)
+
+        sampled_tokens = tokens[:, self.sample_begin :]
+        if (
+            sampled_tokens.shape[1] >= 2
+            and sampled_tokens[:, -1].ge(timestamp_begin).all()
+            and sampled_tokens[:, -2].lt(timestamp_begin).all()
+        ):
+            # every segment has just ended: only timestamps or EOT can follow
+            return slice(self.tokenizer.eot, None)
+        return None
+
     def apply(self, logits: Tensor, tokens: Tensor):
         # suppress <|notimestamps|> which is handled by without_timestamps
         if self.tokenizer.no_timestamps is not None:
@@ -511,8 +716,15 @@ class DecodingTask:
     decoder: TokenDecoder
     logit_filters: List[LogitFilter]
 
-    def __init__(self, model: "Whisper", options: DecodingOptions):
+    def __init__(
+        self,
+        model: "Whisper",
+        options: DecodingOptions,
+        audio_kv: Optional[List[Tuple[Tensor, Tensor]]] = None,
+    ):
         self.model = model
+        # keys and values of the audio can only be given along with its encoded features
+        self.features_given = audio_kv is not None
 
         language = options.language or "en"
         tokenizer = get_tokenizer(
@@ -525,7 +737,11 @@ class DecodingTask:
         self.options: DecodingOptions = self._verify_options(options)
 
         self.n_group: int = options.beam_size or options.best_of or 1
+        self.dtype: torch.dtype = DTYPES[
+            options.dtype or ("fp16" if options.fp16 else "fp32")
+        ]
         self.n_ctx: int = model.dims.n_text_ctx
+        self.n_vocab: int = model.dims.n_vocab
         self.sample_len: int = options.sample_len or model.dims.n_text_ctx // 2
 
         self.sot_sequence: Tuple[int] = tokenizer.sot_sequence
@@ -537,7 +753,13 @@ class DecodingTask:
         self.sot_index: int = self.initial_tokens.index(tokenizer.sot)
 
         # inference: implements the forward pass through the decoder, including kv caching
-        self.inference = PyTorchInference(model, len(self.initial_tokens))
+        # using the cross-attention keys and values of the audio, if they were computed before
+        if options.compile:
+            self.inference = StaticInference(
+                model, len(self.initial_tokens), True, audio_kv
+            )
+        else:
+            self.inference = PyTorchInference(model, len(self.initial_tokens), audio_kv)
 
         # sequence ranker: implements how to rank a group of sampled sequences
         self.sequence_ranker = MaximumLikelihoodRanker(options.length_penalty)
@@ -581,6 +803,8 @@ class DecodingTask:
             0 <= options.length_penalty <= 1
         ):
             raise ValueError("length_penalty (alpha) should be a value between 0 and 1")
+        if options.dtype is not None and options.dtype not in DTYPES:
+            raise ValueError(f"dtype should be one of {list(DTYPES)}")
 
         return options
 
@@ -642,21 +866,16 @@ class DecodingTask:
         return tuple(sorted(set(suppress_tokens)))
 
     def _get_audio_features(self, mel: Tensor):
-        if self.options.fp16:
-            mel = mel.half()
+        if self.dtype != torch.float32:
+            mel = mel.to(self.dtype)
 
-        if mel.shape[-2:] == (
-            self.model.dims.n_audio_ctx,
-            self.model.dims.n_audio_state,
-        ):
+        if self.features_given or is_audio_features(self.model, mel):
             # encoded audio features are given; skip audio encoding
             audio_features = mel
         else:
             audio_features = self.model.encoder(mel)
 
-        if audio_features.dtype != (
-            torch.float16 if self.options.fp16 else torch.float32
-        ):
+        if audio_features.dtype != self.dtype:
             return TypeError(
                 f"audio_features has an incorrect dtype: {audio_features.dtype}"
             )
@@ -668,8 +887,9 @@ class DecodingTask:
         lang_probs = None
 
         if self.options.language is None or self.options.task == "lang_id":
+            # features given with their keys and values may be of truncated audio
             lang_tokens, lang_probs = self.model.detect_language(
-                audio_features, self.tokenizer
+                audio_features, self.tokenizer, self.features_given
             )
             languages = [max(probs, key=probs.get) for probs in lang_probs]
             if self.options.language is None:
@@ -677,23 +897,55 @@ class DecodingTask:
 
         return languages, lang_probs
 
+    def _allowed_tokens(self, tokens: Tensor) -> Optional[slice]:
+        """The range of token ids that all the logit filters allow at this step, if limited"""
+        start, stop = 0, self.n_vocab
+        for logit_filter in self.logit_filters:
+            allowed = logit_filter.allowed_tokens(tokens)
+            if allowed is not None:
+                start = max(start, allowed.start or 0)
+                stop = min(stop, self.n_vocab if allowed.stop is None else allowed.stop)
+        if (start, stop) == (0, self.n_vocab) or start >= stop:
+            return None
+        return slice(start, stop)
+
     def _main_loop(self, audio_features: Tensor, tokens: Tensor):
         n_batch = tokens.shape[0]
         sum_logprobs: Tensor = torch.zeros(n_batch, device=audio_features.device)
         no_speech_probs = [np.nan] * n_batch
 
+        # preallocate the tokens for all steps, which the decoder fills in place
+        buffer = tokens.new_full(
+            (n_batch, tokens.shape[-1] + self.sample_len), self.tokenizer.eot
+        )
+        buffer[:, : tokens.shape[-1]] = tokens
+        tokens = buffer[:, : tokens.shape[-1]]
+        self.decoder.buffer = buffer
+
         try:
             for i in range(self.sample_len):
-                logits = self.inference.logits(tokens, audio_features)
+                # project only the positions whose logits are used, not the whole prompt
+                save_no_speech = i == 0 and self.tokenizer.no_speech is not None
+                positions = [self.sot_index, -1] if save_no_speech else [-1]
+
+                # and, when the logit filters allow only some tokens at this step, only those;
+                # not on the first step, whose no-speech probability needs the whole vocabulary
+                vocabulary = None if save_no_speech else self._allowed_tokens(tokens)
+                logits = self.inference.logits(
+                    tokens, audio_features, positions, vocabulary
+                )
 
-                if (
-                    i == 0 and self.tokenizer.no_speech is not None
-                ):  # save no_speech_probs
-                    probs_at_sot = logits[:, self.sot_index].float().softmax(dim=-1)
+                if save_no_speech:
+                    probs_at_sot = logits[:, 0].float().softmax(dim=-1)
                     no_speech_probs = probs_at_sot[:, self.tokenizer.no_speech].tolist()
 
                 # now we need to consider the logits at the last token only
                 logits = logits[:, -1]
+                if vocabulary is not None:
+                    # the other tokens are suppressed by the logit filters anyway
+                    allowed_logits = logits
+                    logits = logits.new_full((n_batch, self.n_vocab), -np.inf)
+                    logits[:, vocabulary] = allowed_logits
 
                 # apply the logit filters, e.g. for suppressing or applying penalty to
                 for logit_filter in self.logit_filters:
@@ -737,7 +989,6 @@ class DecodingTask:
         tokens, sum_logprobs, no_speech_probs = self._main_loop(audio_features, tokens)
 
         # reshape the tensors to have (n_audio, n_group) as the first two dimensions
-        audio_features = audio_features[:: self.n_group]
         no_speech_probs = no_speech_probs[:: self.n_group]
         assert audio_features.shape[0] == len(no_speech_probs) == n_audio
 
@@ -794,6 +1045,7 @@ def decode(
     model: "Whisper",
     mel: Tensor,
     options: DecodingOptions = DecodingOptions(),
+    audio_kv: Optional[List[Tuple[Tensor, Tensor]]] = None,
     **kwargs,
 ) -> Union[DecodingResult, List[DecodingResult]]:
     """
@@ -810,6 +1062,12 @@ def decode(
     options: DecodingOptions
         A dataclass that contains all necessary options for decoding 30-second segments
 
+    audio_kv: Optional[List[Tuple[torch.Tensor, torch.Tensor]]]
+        The cross-attention keys and values of each decoder layer over the audio features given
+        as `mel`, from `model.decoder.audio_kv(audio_features)`, to reuse instead of projecting
+        them again, e.g. when decoding the same audio with other options. `mel` is then always
+        taken for audio features, whatever its shape
+
     Returns
     -------
     result: Union[DecodingResult, List[DecodingResult]]
@@ -821,6 +1079,6 @@ def decode(
     if kwargs:
         options = replace(options, **kwargs)
 
-    result = DecodingTask(model, options).run(mel)
+    result = DecodingTask(model, options, audio_kv).run(mel)
 
     return result[0] if single else result
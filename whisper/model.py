@@ -1,8 +1,9 @@
 import base64
 import gzip
+import warnings
 from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Dict, Iterable, Optional, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -70,6 +71,10 @@ def sinusoids(length, channels, max_timescale=10000):
 
 @contextmanager
 def disable_sdpa():
+    """
+    Compute the attention without SDPA by default, process-wide; not safe while other threads use
+    the model, which should pass `use_sdpa=False` to the forward passes that need it instead
+    """
     prev_state = MultiHeadAttention.use_sdpa
     try:
         MultiHeadAttention.use_sdpa = False
@@ -78,6 +83,46 @@ def disable_sdpa():
         MultiHeadAttention.use_sdpa = prev_state
 
 
+class KVCache:
+    """
+    Key and value tensors of the decoder attention layers, reused across decoding steps.
+
+    The self-attention keys and values of each layer are written in place into buffers of
+    `n_ctx` positions, allocated on the first step, so that a step costs no copy of the
+    previous positions. The cross-attention keys and values are computed once, on the first
+    step, since the audio features do not change. Both are stored head-major, with the shape
+    (batch_size, n_head, n_ctx, n_state // n_head) that the attention consumes, so that only
+    the new positions are reshaped at each step.
+    """
+
+    def __init__(self, n_ctx: int):
+        self.n_ctx = n_ctx
+        self.offset = 0  # the number of positions in the self-attention buffers
+        self.self_attn: Dict[nn.Module, Tuple[Tensor, Tensor]] = {}
+        self.cross_attn: Dict[nn.Module, Tuple[Tensor, Tensor]] = {}
+
+    def append(self, module: nn.Module, k: Tensor, v: Tensor) -> Tuple[Tensor, Tensor]:
+        """
+        Write the head-major keys and values of the new positions of a self-attention layer at
+        the current offset, and return those of all positions so far
+        """
+        if module not in self.self_attn:
+            shape = (*k.shape[:2], self.n_ctx, k.shape[-1])
+            self.self_attn[module] = (k.new_empty(shape), v.new_empty(shape))
+
+        key, value = self.self_attn[module]
+        end = self.offset + k.shape[2]
+        key[:, :, self.offset : end] = k
+        value[:, :, self.offset : end] = v
+        return key[:, :, :end], value[:, :, :end]
+
+    def rearrange(self, source_indices: List[int]):
+        """Select the sequences that the batch continues with, e.g. for beam search"""
+        for key, value in self.self_attn.values():
+            key[:, :, : self.offset] = key[source_indices, :, : self.offset]
+            value[:, :, : self.offset] = value[source_indices, :, : self.offset]
+
+
 class MultiHeadAttention(nn.Module):
     use_sdpa = True
 
@@ -89,16 +134,78 @@ class MultiHeadAttention(nn.Module):
         self.value = Linear(n_state, n_state)
         self.out = Linear(n_state, n_state)
 
+        # the packed query, key and value weights; see `fuse_qkv()`
+        self.register_buffer("qkv_weight", None, persistent=False)
+        self.register_buffer("qkv_bias", None, persistent=False)
+
+    def fuse_qkv(self):
+        """
+        Pack the query, key and value projections into one weight, so that self-attention runs
+        a single matrix multiplication instead of three. The `query`, `key` and `value` weights
+        become views into the packed one, so that the state dict keeps its keys and loading a
+        checkpoint into them updates the packed weight as well.
+        """
+        if not isinstance(self.query, Linear):
+            raise RuntimeError("Cannot fuse the projections of a quantized model")
+
+        weight = torch.cat([self.query.weight, self.key.weight, self.value.weight])
+        bias = torch.cat(
+            [self.query.bias, torch.zeros_like(self.query.bias), self.value.bias]
+        )
+        self.qkv_weight, self.qkv_bias = weight.detach(), bias.detach()
+        self.query.weight.data, self.key.weight.data, self.value.weight.data = (
+            self.qkv_weight.chunk(3)
+        )
+        self.query.bias.data, _, self.value.bias.data = self.qkv_bias.chunk(3)
+
+    def _apply(self, fn, recurse=True):
+        super()._apply(fn, recurse)
+        if self.qkv_weight is not None:
+            # converting the model, e.g. with `.to()` or `.half()`, rebinds the weights to new
+            # tensors that are no longer views into the packed one, which is rebuilt from them
+            self.fuse_qkv()
+        return self
+
     def forward(
         self,
         x: Tensor,
         xa: Optional[Tensor] = None,
         mask: Optional[Tensor] = None,
-        kv_cache: Optional[dict] = None,
+        kv_cache: Optional[Union[dict, KVCache]] = None,
+        use_sdpa: Optional[bool] = None,
     ):
-        q = self.query(x)
+        # the hooks of `Whisper.install_kv_cache_hooks()` need the separate key and value
+        fused = (
+            xa is None
+            and self.qkv_weight is not None
+            and not isinstance(kv_cache, dict)
+        )
+        if fused:
+            q, k, v = self.project_qkv(x)
+        else:
+            q = self.query(x)
+
+        if isinstance(kv_cache, KVCache):
+            if xa is None:
+                if not fused:
+                    k, v = self.key(x), self.value(x)
+                k, v = kv_cache.append(self, self.split_heads(k), self.split_heads(v))
+            elif self not in kv_cache.cross_attn:
+                k = self.split_heads(self.key(xa)).contiguous()
+                v = self.split_heads(self.value(xa)).contiguous()
+                # the audio is shared by the beams or samples of each group; repeated once
+                # rather than broadcast, which would keep SDPA off its fused kernels
+                [(k, v)] = TextDecoder.repeat_audio_kv([(k, v)], q.shape[0])
+                kv_cache.cross_attn[self] = (k, v)
+            else:
+                k, v = kv_cache.cross_attn[self]
 
-        if kv_cache is None or xa is None or self.key not in kv_cache:
+            wv, qk = self.attention(self.split_heads(q), k, v, mask, use_sdpa)
+            return self.out(wv), qk
+
+        if fused:
+            pass  # the keys and values are projected along with the queries
+        elif kv_cache is None or xa is None or self.key not in kv_cache:
             # hooks, if installed (i.e. kv_cache is not None), will prepend the cached kv tensors;
             # otherwise, perform key/value projections for self- or cross-attention as usual.
             k = self.key(x if xa is None else xa)
@@ -108,35 +215,124 @@ class MultiHeadAttention(nn.Module):
             k = kv_cache[self.key]
             v = kv_cache[self.value]
 
-        wv, qk = self.qkv_attention(q, k, v, mask)
+        wv, qk = self.qkv_attention(q, k, v, mask, use_sdpa)
         return self.out(wv), qk
 
+    def project_qkv(self, x: Tensor) -> Tuple[Tensor, Tensor, Tensor]:
+        """Returns the self-attention queries, keys and values of `x`"""
+        if self.qkv_weight is None:
+            return self.query(x), self.key(x), self.value(x)
+        qkv = F.linear(x, self.qkv_weight.to(x.dtype), self.qkv_bias.to(x.dtype))
+        return qkv.chunk(3, dim=-1)
+
+    def step(
+        self,
+        x: Tensor,
+        key: Tensor,
+        value: Tensor,
+        positions: Optional[Tensor] = None,
+        mask: Optional[Tensor] = None,
+    ) -> Tensor:
+        """
+        The attention of a decoding step, with all state passed explicitly; see
+        `TextDecoder.decode_step()`
+
+        Parameters
+        ----------
+        x: Tensor, shape = (batch_size, n_tokens, n_state)
+            The input of the new positions
+
+        key, value: Tensor, shape = (batch_size, n_head, n_kv, n_state // n_head)
+            The head-major keys and values to attend to. For self-attention, i.e. when
+            `positions` is given, these are buffers of the whole context that the keys and
+            values of `x` are written into.
+
+        positions: Optional[Tensor], shape = (n_tokens,)
+            The positions of the new tokens, for self-attention
+
+        mask: Optional[Tensor], shape = (n_tokens, n_kv)
+            Whether each new position may attend to each key
+        """
+        if positions is None:
+            q = self.query(x)
+        else:
+            q, k, v = self.project_qkv(x)
+            key.index_copy_(2, positions, self.split_heads(k))
+            value.index_copy_(2, positions, self.split_heads(v))
+        q = self.split_heads(q)
+
+        if SDPA_AVAILABLE:
+            a = scaled_dot_product_attention(q, key, value, attn_mask=mask)
+        else:
+            scale = q.shape[-1] ** -0.25
+            qk = (q * scale) @ (key * scale).transpose(-1, -2)
+            if mask is not None:
+                qk = qk.masked_fill(~mask, -np.inf)
+            a = F.softmax(qk.float(), dim=-1).to(q.dtype) @ value
+
+        return self.out(a.transpose(1, 2).flatten(start_dim=2))
+
+    def split_heads(self, x: Tensor) -> Tensor:
+        """(batch_size, n_ctx, n_state) -> (batch_size, n_head, n_ctx, n_state // n_head)"""
+        if x.shape[1] == 1:
+            # a single position is already laid out head-major
+            return x.view(x.shape[0], self.n_head, 1, -1)
+        return x.view(*x.shape[:2], self.n_head, -1).permute(0, 2, 1, 3)
+
     def qkv_attention(
-        self, q: Tensor, k: Tensor, v: Tensor, mask: Optional[Tensor] = None
+        self,
+        q: Tensor,
+        k: Tensor,
+        v: Tensor,
+        mask: Optional[Tensor] = None,
+        use_sdpa: Optional[bool] = None,
     ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
-        n_batch, n_ctx, n_state = q.shape
-        scale = (n_state // self.n_head) ** -0.25
-        q = q.view(*q.shape[:2], self.n_head, -1).permute(0, 2, 1, 3)
-        k = k.view(*k.shape[:2], self.n_head, -1).permute(0, 2, 1, 3)
-        v = v.view(*v.shape[:2], self.n_head, -1).permute(0, 2, 1, 3)
+        return self.attention(
+            self.split_heads(q),
+            self.split_heads(k),
+            self.split_heads(v),
+            mask,
+            use_sdpa,
+        )
 
-        if SDPA_AVAILABLE and MultiHeadAttention.use_sdpa:
+    def attention(
+        self,
+        q: Tensor,
+        k: Tensor,
+        v: Tensor,
+        mask: Optional[Tensor] = None,
+        use_sdpa: Optional[bool] = None,
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """
+        The attention of head-major queries, keys and values, each of the shape
+        (batch_size, n_head, n_ctx, n_state // n_head); returns the output of the shape
+        (batch_size, n_ctx, n_state) and the attention logits, unless computed with SDPA, which
+        is used if available and `use_sdpa` is True, or None and `MultiHeadAttention.use_sdpa` is
+        """
+        n_batch, n_head, n_ctx, head_dim = q.shape
+        scale = head_dim**-0.25
+
+        if use_sdpa is None:
+            use_sdpa = MultiHeadAttention.use_sdpa
+        if SDPA_AVAILABLE and use_sdpa:
             a = scaled_dot_product_attention(
                 q, k, v, is_causal=mask is not None and n_ctx > 1
             )
-            out = a.permute(0, 2, 1, 3).flatten(start_dim=2)
             qk = None
         else:
             qk = (q * scale) @ (k * scale).transpose(-1, -2)
-            if mask is not None:
+            if mask is not None and n_ctx > 1:
                 qk = qk + mask[:n_ctx, :n_ctx]
             qk = qk.float()
 
             w = F.softmax(qk, dim=-1).to(q.dtype)
-            out = (w @ v).permute(0, 2, 1, 3).flatten(start_dim=2)
+            a = w @ v
             qk = qk.detach()
 
-        return out, qk
+        if n_ctx == 1:
+            # the single query of a decoding step needs no permute back
+            return a.view(n_batch, 1, n_head * head_dim), qk
+        return a.permute(0, 2, 1, 3).flatten(start_dim=2), qk
 
 
 class ResidualAttentionBlock(nn.Module):
@@ -162,11 +358,24 @@ class ResidualAttentionBlock(nn.Module):
         x: Tensor,
         xa: Optional[Tensor] = None,
         mask: Optional[Tensor] = None,
-        kv_cache: Optional[dict] = None,
+        kv_cache: Optional[Union[dict, KVCache]] = None,
+        use_sdpa: Optional[bool] = None,
+        cross_qk: Optional[List[Tensor]] = None,
     ):
-        x = x + self.attn(self.attn_ln(x), mask=mask, kv_cache=kv_cache)[0]
+        out, _ = self.attn(
+            self.attn_ln(x), mask=mask, kv_cache=kv_cache, use_sdpa=use_sdpa
+        )
+        x = x + out
         if self.cross_attn:
-            x = x + self.cross_attn(self.cross_attn_ln(x), xa, kv_cache=kv_cache)[0]
+            out, qk = self.cross_attn(
+                self.cross_attn_ln(x),
+                xa,
+                kv_cache=kv_cache,
+                use_sdpa=False if cross_qk is not None else use_sdpa,
+            )
+            x = x + out
+            if cross_qk is not None:
+                cross_qk.append(qk)
         x = x + self.mlp(self.mlp_ln(x))
         return x
 
@@ -185,17 +394,24 @@ class AudioEncoder(nn.Module):
         )
         self.ln_post = LayerNorm(n_state)
 
-    def forward(self, x: Tensor):
+    def forward(self, x: Tensor, truncate: bool = False):
         """
-        x : torch.Tensor, shape = (batch_size, n_mels, n_ctx)
-            the mel spectrogram of the audio
+        x : torch.Tensor, shape = (batch_size, n_mels, n_frames)
+            the mel spectrogram of the audio, of `2 * n_ctx` frames
+        truncate : bool
+            whether to accept fewer frames, which are encoded at as many positions only, i.e.
+            without the padding of a full window; faster, but may be less accurate, as the model
+            was trained on full windows
         """
         x = F.gelu(self.conv1(x))
         x = F.gelu(self.conv2(x))
         x = x.permute(0, 2, 1)
 
-        assert x.shape[1:] == self.positional_embedding.shape, "incorrect audio shape"
-        x = (x + self.positional_embedding).to(x.dtype)
+        n_ctx, n_state = self.positional_embedding.shape
+        if not truncate:
+            assert x.shape[1:] == (n_ctx, n_state), "incorrect audio shape"
+        assert x.shape[1] <= n_ctx and x.shape[2] == n_state, "incorrect audio shape"
+        x = (x + self.positional_embedding[: x.shape[1]]).to(x.dtype)
 
         for block in self.blocks:
             x = block(x)
@@ -224,14 +440,50 @@ class TextDecoder(nn.Module):
         mask = torch.empty(n_ctx, n_ctx).fill_(-np.inf).triu_(1)
         self.register_buffer("mask", mask, persistent=False)
 
-    def forward(self, x: Tensor, xa: Tensor, kv_cache: Optional[dict] = None):
+        # the transposed token embedding in the inference dtype; see `prepare_for_inference()`
+        self.register_buffer("output_projection", None, persistent=False)
+
+        # `decode_step()` compiled with `torch.compile`, made on first use by the decoding
+        self.compiled_decode_step: Optional[Callable] = None
+
+    def forward(
+        self,
+        x: Tensor,
+        xa: Tensor,
+        kv_cache: Optional[Union[dict, KVCache]] = None,
+        use_sdpa: Optional[bool] = None,
+        cross_qk: Optional[List[Tensor]] = None,
+        logit_positions: Optional[Union[List[int], Tensor]] = None,
+        vocabulary: Optional[Union[List[int], Tensor, slice]] = None,
+    ):
         """
         x : torch.LongTensor, shape = (batch_size, <= n_ctx)
             the text tokens
         xa : torch.Tensor, shape = (batch_size, n_audio_ctx, n_audio_state)
             the encoded audio features to be attended on
+        kv_cache : Optional[Union[dict, KVCache]]
+            the keys and values of the previous positions, either a `KVCache` or the dictionary
+            filled by the hooks of `Whisper.install_kv_cache_hooks()`
+        use_sdpa : Optional[bool]
+            whether to compute the attention with SDPA, for this call only; by default, as
+            `MultiHeadAttention.use_sdpa` says
+        cross_qk : Optional[List[torch.Tensor]]
+            a list to append the cross-attention logits of each layer to, of the shape
+            (batch_size, n_head, n_ctx, n_audio_ctx), which are computed without SDPA for it
+        logit_positions : Optional[Union[List[int], torch.Tensor]]
+            the indices into the tokens of `x` to return the logits at, e.g. `[-1]` for the next
+            token only; all by default. The other positions still go through every layer, for
+            the keys and values they leave in `kv_cache`, but skip the logits projection.
+        vocabulary : Optional[Union[List[int], torch.Tensor, slice]]
+            the token ids to compute the logits of, in that order, e.g. the language tokens; all
+            by default. The logits then have the shape (batch_size, n_positions, len(vocabulary))
+
+        As all state is passed in, concurrent calls from several threads can share the model.
         """
-        offset = next(iter(kv_cache.values())).shape[1] if kv_cache else 0
+        if isinstance(kv_cache, KVCache):
+            offset = kv_cache.offset
+        else:
+            offset = next(iter(kv_cache.values())).shape[1] if kv_cache else 0
         x = (
             self.token_embedding(x)
             + self.positional_embedding[offset : offset + x.shape[-1]]
@@ -239,14 +491,137 @@ class TextDecoder(nn.Module):
         x = x.to(xa.dtype)
 
         for block in self.blocks:
-            x = block(x, xa, mask=self.mask, kv_cache=kv_cache)
+            x = block(
+                x,
+                xa,
+                mask=self.mask,
+                kv_cache=kv_cache,
+                use_sdpa=use_sdpa,
+                cross_qk=cross_qk,
+            )
+
+        if isinstance(kv_cache, KVCache):
+            kv_cache.offset += x.shape[1]
+
+        if logit_positions is not None:
+            x = x[:, logit_positions]
+        return self.project_logits(self.ln(x), vocabulary)
+
+    def project_logits(
+        self, x: Tensor, vocabulary: Optional[Union[List[int], Tensor, slice]] = None
+    ) -> Tensor:
+        """
+        Returns the logits of `x` over the whole vocabulary, or over the given token ids only,
+        which multiplies `x` by those rows of the token embedding alone
+        """
+        if (
+            self.output_projection is not None
+            and self.output_projection.dtype == x.dtype
+        ):
+            projection = self.output_projection
+            if vocabulary is not None:
+                projection = projection[:, vocabulary]
+        else:
+            weight = self.token_embedding.weight
+            if vocabulary is not None:
+                weight = weight[vocabulary]
+            projection = torch.transpose(weight.to(x.dtype), 0, 1)
+        return (x @ projection).float()
+
+    def audio_kv(
+        self, xa: Tensor, n_batch: Optional[int] = None
+    ) -> List[Tuple[Tensor, Tensor]]:
+        """
+        Returns the head-major cross-attention keys and values of each layer for
+        `decode_step()`, repeated so that each audio is shared by `n_batch // len(xa)`
+        consecutive sequences, or once per audio if `n_batch` is not given
+        """
+        audio_kv = []
+        for block in self.blocks:
+            attn = block.cross_attn
+            k = attn.split_heads(attn.key(xa)).contiguous()
+            v = attn.split_heads(attn.value(xa)).contiguous()
+            audio_kv.append((k, v))
+        return audio_kv if n_batch is None else self.repeat_audio_kv(audio_kv, n_batch)
+
+    @staticmethod
+    def repeat_audio_kv(
+        audio_kv: List[Tuple[Tensor, Tensor]], n_batch: int
+    ) -> List[Tuple[Tensor, Tensor]]:
+        """
+        Repeat the keys and values of each audio from `audio_kv()` for the consecutive sequences
+        that share it in a batch of `n_batch`
+        """
+        if n_batch == audio_kv[0][0].shape[0]:
+            return audio_kv
+        repeats = n_batch // audio_kv[0][0].shape[0]
+        return [
+            (k.repeat_interleave(repeats, dim=0), v.repeat_interleave(repeats, dim=0))
+            for k, v in audio_kv
+        ]
+
+    def empty_cache(
+        self, n_batch: int, dtype: torch.dtype, device: torch.device
+    ) -> List[Tuple[Tensor, Tensor]]:
+        """Returns zeroed self-attention key and value buffers of each layer for `decode_step()`"""
+        n_ctx, n_state = self.positional_embedding.shape
+        n_head = self.blocks[0].attn.n_head
+        shape = (n_batch, n_head, n_ctx, n_state // n_head)
+        return [
+            (
+                torch.zeros(shape, dtype=dtype, device=device),
+                torch.zeros(shape, dtype=dtype, device=device),
+            )
+            for _ in self.blocks
+        ]
 
-        x = self.ln(x)
-        logits = (
-            x @ torch.transpose(self.token_embedding.weight.to(x.dtype), 0, 1)
-        ).float()
+    def decode_step(
+        self,
+        tokens: Tensor,
+        cache: List[Tuple[Tensor, Tensor]],
+        audio_kv: List[Tuple[Tensor, Tensor]],
+        offset: Tensor,
+        logit_positions: Optional[Union[List[int], Tensor]] = None,
+        vocabulary: Optional[Union[List[int], Tensor, slice]] = None,
+    ) -> Tensor:
+        """
+        A functional forward pass over new tokens, for `torch.compile`: all state is passed in
+        explicitly, there are no hooks, and the shapes of all tensors but the logits stay the
+        same from step to step, as the self-attention attends to the whole context with a mask.
+
+        tokens : torch.LongTensor, shape = (batch_size, n_tokens)
+            the text tokens at the positions `offset`, `offset + 1`, ...
+        cache : List[Tuple[torch.Tensor, torch.Tensor]]
+            the self-attention key and value buffers of each layer from `empty_cache()`, which
+            the keys and values of the new tokens are written into
+        audio_kv : List[Tuple[torch.Tensor, torch.Tensor]]
+            the cross-attention keys and values of each layer from `audio_kv()`
+        offset : torch.LongTensor, shape = ()
+            the number of tokens decoded before
+        logit_positions : Optional[Union[List[int], torch.Tensor]]
+            the indices into `tokens` to return the logits at; all by default, as in `forward()`
+        vocabulary : Optional[Union[List[int], torch.Tensor, slice]]
+            the token ids to compute the logits of; all by default, as in `forward()`
+        """
+        n_ctx = self.positional_embedding.shape[0]
+        positions = offset + torch.arange(tokens.shape[-1], device=tokens.device)
+        mask = torch.arange(n_ctx, device=tokens.device) <= positions[:, None]
+
+        x = self.token_embedding(tokens) + self.positional_embedding[positions]
+        x = x.to(audio_kv[0][0].dtype)
+
+        for block, (key, value), (audio_key, audio_value) in zip(
+            self.blocks, cache, audio_kv
+        ):
+            x = x + block.attn.step(block.attn_ln(x), key, value, positions, mask)
+            x = x + block.cross_attn.step(
+                block.cross_attn_ln(x), audio_key, audio_value
+            )
+            x = x + block.mlp(block.mlp_ln(x))
 
-        return logits
+        if logit_positions is not None:
+            x = x[:, logit_positions]
+        return self.project_logits(self.ln(x), vocabulary)
 
 
 class Whisper(nn.Module):
@@ -268,13 +643,72 @@ class Whisper(nn.Module):
             self.dims.n_text_layer,
         )
         # use the last half among the decoder layers for time alignment by default;
-        # to use a specific set of heads, see `set_alignment_heads()` below.
+        # to use a specific set of heads, see `set_alignment_heads()` below. made on CPU even
+        # when the modules are created on the meta device, as in `from_state_dict()` below.
         all_heads = torch.zeros(
-            self.dims.n_text_layer, self.dims.n_text_head, dtype=torch.bool
+            self.dims.n_text_layer,
+            self.dims.n_text_head,
+            dtype=torch.bool,
+            device="cpu",
         )
         all_heads[self.dims.n_text_layer // 2 :] = True
         self.register_buffer("alignment_heads", all_heads.to_sparse(), persistent=False)
 
+    @classmethod
+    def from_state_dict(
+        cls,
+        dims: ModelDimensions,
+        state_dict: Dict[str, Tensor],
+        dtype: Optional[torch.dtype] = None,
+        strict: bool = True,
+    ) -> "Whisper":
+        """
+        Build a model around the tensors of a state dict, such as one memory-mapped by
+        `torch.load(..., mmap=True)`: the modules are created on the meta device, so that no
+        weights are allocated or randomly initialized, and the tensors are assigned to them
+        instead of copied, unless their dtype has to change.
+
+        Parameters
+        ----------
+        dims: ModelDimensions
+            The dimensions of the model that the state dict is of
+
+        state_dict: Dict[str, Tensor]
+            The weights of the model, on the device that the model is to be on
+
+        dtype: Optional[torch.dtype]
+            The dtype to keep the weights of the `Linear` and `Conv1d` layers in, e.g. that of a
+            later `prepare_for_inference()`; float32 by default. The other parameters and the
+            buffers, which are applied in float32, are converted to float32, as if loaded into a
+            new model.
+
+        strict: bool
+            Whether the state dict has to hold all the weights; those missing otherwise stay on
+            the meta device, for the caller to replace the modules that they belong to
+
+        Returns
+        -------
+        The model, with its buffers that are not saved in the state dict made anew
+        """
+        with torch.device("meta"):
+            model = cls(dims)
+        model.load_state_dict(state_dict, strict=strict, assign=True)
+
+        for module in model.modules():
+            layer_dtype = dtype if isinstance(module, (Linear, Conv1d)) else None
+            for param in module.parameters(recurse=False):
+                param.data = param.data.to(layer_dtype or torch.float32)
+            for buffer in module.buffers(recurse=False):
+                if buffer.is_floating_point():
+                    buffer.data = buffer.data.float()
+
+        device = model.device
+        n_ctx = dims.n_text_ctx
+        mask = torch.empty(n_ctx, n_ctx, device=device).fill_(-np.inf).triu_(1)
+        model.decoder.mask = mask
+        model.alignment_heads = model.alignment_heads.to(device)
+        return model
+
     def set_alignment_heads(self, dump: bytes):
         array = np.frombuffer(
             gzip.decompress(base64.b85decode(dump)), dtype=bool
@@ -284,8 +718,8 @@ class Whisper(nn.Module):
         )
         self.register_buffer("alignment_heads", mask.to_sparse(), persistent=False)
 
-    def embed_audio(self, mel: torch.Tensor):
-        return self.encoder(mel)
+    def embed_audio(self, mel: torch.Tensor, truncate: bool = False):
+        return self.encoder(mel, truncate)
 
     def logits(self, tokens: torch.Tensor, audio_features: torch.Tensor):
         return self.decoder(tokens, audio_features)
@@ -307,6 +741,102 @@ class Whisper(nn.Module):
     def num_languages(self):
         return self.dims.n_vocab - 51765 - int(self.is_multilingual)
 
+    def prepare_for_inference(
+        self,
+        dtype: torch.dtype = torch.float16,
+        device: Optional[Union[str, torch.device]] = None,
+        fuse_qkv: bool = False,
+    ) -> "Whisper":
+        """
+        Convert the weights to the dtype that inference runs in, once, so that the casts in
+        `Linear`, `Conv1d` and the logits projection become no-ops instead of copying every
+        weight on every forward pass. The token embedding is also stored transposed in that
+        dtype for the logits projection, while the embeddings and the layer norms, which are
+        applied in float32, stay as they are, so that the outputs do not change.
+
+        Parameters
+        ----------
+        dtype: torch.dtype
+            The dtype of the activations, i.e. float16 for `DecodingOptions(fp16=True)`, the
+            default, and float32 otherwise
+
+        device: Optional[Union[str, torch.device]]
+            The device to move the model to; by default, the model stays where it is
+
+        fuse_qkv: bool
+            Whether to pack the query, key and value projections of the self-attention layers
+            into one matrix multiplication; see `MultiHeadAttention.fuse_qkv()`. The results
+            may differ in the last bits, as the multiplication is blocked differently.
+
+        Returns
+        -------
+        The model itself, switched to evaluation mode without gradients
+        """
+        self.eval().requires_grad_(False)
+        self.to(device)
+        for module in self.modules():
+            if isinstance(module, (Linear, Conv1d)):
+                for param in module.parameters(recurse=False):
+                    param.data = param.data.to(dtype)
+        for block in [*self.encoder.blocks, *self.decoder.blocks]:
+            # casting the weights rebinds them, so a packed weight is rebuilt as well
+            if fuse_qkv or block.attn.qkv_weight is not None:
+                block.attn.fuse_qkv()
+
+        embedding = self.decoder.token_embedding.weight
+        self.decoder.output_projection = embedding.detach().t().to(dtype).contiguous()
+        return self
+
+    def quantize(self, dtype: str = "int8") -> "Whisper":
+        """
+        Quantize the `Linear` layers of the encoder and the decoder dynamically for inference on
+        CPU: their weights are stored in int8 with a scale per output channel, and their inputs
+        are quantized on the fly, so that the matrix multiplications run in int8. The
+        convolutions, the embeddings and the layer norms stay in float32, which is the dtype
+        that the model then has to run in, i.e. with `DecodingOptions(fp16=False)`.
+
+        Parameters
+        ----------
+        dtype: str
+            The dtype of the quantized weights; only "int8" is supported
+
+        Returns
+        -------
+        The model itself, on CPU, in evaluation mode without gradients
+        """
+        if dtype != "int8":
+            raise ValueError(f"Unsupported quantization dtype: {dtype}")
+
+        from torch.ao.quantization import per_channel_dynamic_qconfig, quantize_dynamic
+
+        self.eval().requires_grad_(False)
+        self.float().to("cpu")
+        for module in self.modules():
+            if isinstance(module, MultiHeadAttention):
+                # the projections are quantized separately
+                module.qkv_weight = module.qkv_bias = None
+
+        # the dynamic quantized modules are converted only from `nn.Linear` itself, and the
+        # weights are float32 already, so that the casts of our subclass are not needed
+        for module in self.modules():
+            for name, child in module.named_children():
+                if isinstance(child, Linear):
+                    linear = nn.Linear(
+                        child.in_features, child.out_features, child.bias is not None
+                    )
+                    linear.weight, linear.bias = child.weight, child.bias
+                    setattr(module, name, linear)
+
+        with warnings.catch_warnings():
+            # torch.ao.quantization is deprecated in favor of torchao, which is not a
+            # dependency; the dynamic quantized modules themselves still work
+            warnings.simplefilter("ignore", category=DeprecationWarning)
+            warnings.simplefilter("ignore", category=UserWarning)
+            quantize_dynamic(
+                self, {nn.Linear: per_channel_dynamic_qconfig}, inplace=True
+            )
+        return self
+
     def install_kv_cache_hooks(self, cache: Optional[dict] = None):
         """
         The `MultiHeadAttention` module optionally accepts `kv_cache` which stores the key and value
@@ -2,7 +2,7 @@ import itertools
 import subprocess
 import warnings
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, List
+from typing import TYPE_CHECKING, List, Optional
 
 import numba
 import numpy as np
@@ -10,6 +10,7 @@ import torch
 import torch.nn.functional as F
 
 from .audio import HOP_LENGTH, SAMPLE_RATE, TOKENS_PER_SECOND
+from .cache import EncoderCache
 from .tokenizer import Tokenizer
 
 if TYPE_CHECKING:
@@ -169,6 +170,8 @@ def find_alignment(
     *,
     medfilt_width: int = 7,
     qk_scale: float = 1.0,
+    encoder_cache: Optional[EncoderCache] = None,
+    truncate: bool = False,
 ) -> List[WordTiming]:
     if len(text_tokens) == 0:
         return []
@@ -182,29 +185,24 @@ def find_alignment(
         ]
     ).to(model.device)
 
-    # install hooks on the cross attention layers to retrieve the attention weights
-    QKs = [None] * model.dims.n_text_layer
-    hooks = [
-        block.cross_attn.register_forward_hook(
-            lambda _, ins, outs, index=i: QKs.__setitem__(index, outs[-1][0])
-        )
-        for i, block in enumerate(model.decoder.blocks)
-    ]
-
-    from .model import disable_sdpa
-
-    with torch.no_grad(), disable_sdpa():
-        logits = model(mel.unsqueeze(0), tokens.unsqueeze(0))[0]
+    # the cross-attention weights of each layer, collected by this call alone, so that other
+    # threads can use the model at the same time
+    QKs = []
+    with torch.no_grad():
+        if encoder_cache is not None:
+            audio_features = encoder_cache.embed_audio(model, mel[None], truncate)
+        else:
+            audio_features = model.embed_audio(mel[None], truncate)
+        logits = model.decoder(tokens.unsqueeze(0), audio_features, cross_qk=QKs)[0]
         sampled_logits = logits[len(tokenizer.sot_sequence) :, : tokenizer.eot]
         token_probs = sampled_logits.softmax(dim=-1)
         text_token_probs = token_probs[np.arange(len(text_tokens)), text_tokens]
         text_token_probs = text_token_probs.tolist()
 
-    for hook in hooks:
-        hook.remove()
-
     # heads * tokens * frames
-    weights = torch.stack([QKs[_l][_h] for _l, _h in model.alignment_heads.indices().T])
+    weights = torch.stack(
+        [QKs[_l][0, _h] for _l, _h in model.alignment_heads.indices().T]
+    )
     weights = weights[:, :, : num_frames // 2]
     weights = (weights * qk_scale).softmax(dim=-1)
     std, mean = torch.std_mean(weights, dim=-2, keepdim=True, unbiased=False)
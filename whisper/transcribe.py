@@ -1,8 +1,10 @@
 import argparse
+import math
 import os
+import sys
 import traceback
 import warnings
-from typing import TYPE_CHECKING, List, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Dict, Generator, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -14,10 +16,17 @@ from .audio import (
     N_FRAMES,
     N_SAMPLES,
     SAMPLE_RATE,
+    AudioSource,
+    ClipSource,
+    MelSource,
+    available_mel_frontends,
+    load_audio_channels,
     log_mel_spectrogram,
     pad_or_trim,
+    resample,
 )
-from .decoding import DecodingOptions, DecodingResult
+from .cache import EncoderCache, MelCache
+from .decoding import DTYPES, DecodingOptions, DecodingResult, bf16_supported
 from .timing import add_word_timestamps
 from .tokenizer import LANGUAGES, TO_LANGUAGE_CODE, get_tokenizer
 from .utils import (
@@ -30,6 +39,7 @@ from .utils import (
     optional_int,
     str2bool,
 )
+from .vad import VadOptions, detect_speech, restrict_clips
 
 if TYPE_CHECKING:
     from .model import Whisper
@@ -37,7 +47,7 @@ if TYPE_CHECKING:
 
 def transcribe(
     model: "Whisper",
-    audio: Union[str, np.ndarray, torch.Tensor],
+    audio: Union[str, np.ndarray, torch.Tensor, AudioSource],
     *,
     verbose: Optional[bool] = None,
     temperature: Union[float, Tuple[float, ...]] = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0),
@@ -52,6 +62,13 @@ def transcribe(
     append_punctuations: str = "\"'.。,，!！?？:：”)]}、",
     clip_timestamps: Union[str, List[float]] = "0",
     hallucination_silence_threshold: Optional[float] = None,
+    mel_cache: Optional[MelCache] = None,
+    mel_frontend: str = "torch",
+    vad_options: Optional[VadOptions] = None,
+    sample_rate: int = SAMPLE_RATE,
+    multichannel: bool = False,
+    truncate_audio: bool = False,
+    encoder_cache: Optional[EncoderCache] = None,
     **decode_options,
 ):
     """
@@ -62,8 +79,10 @@ def transcribe(
     model: Whisper
         The Whisper model instance
 
-    audio: Union[str, np.ndarray, torch.Tensor]
-        The path to the audio file to open, or the audio waveform
+    audio: Union[str, np.ndarray, torch.Tensor, AudioSource]
+        The path to the audio file to open, or the audio waveform. An `AudioSource`, such as a
+        `FileSource` or an `AudioStream` over `load_audio_stream()`, only computes the windows of
+        the log-Mel spectrogram that are decoded instead of the whole spectrogram at once.
 
     verbose: bool
         Whether to display the text being decoded to the console. If True, displays all the details,
@@ -113,32 +132,314 @@ def transcribe(
 
     clip_timestamps: Union[str, List[float]]
         Comma-separated list start,end,start,end,... timestamps (in seconds) of clips to process.
-        The last end timestamp defaults to the end of the file.
+        The last end timestamp defaults to the end of the file. When `audio` is a path, only the
+        clips are decoded, and the language is detected from the start of the first clip.
 
     hallucination_silence_threshold: Optional[float]
         When word_timestamps is True, skip silent periods longer than this threshold (in seconds)
         when a possible hallucination is detected
 
+    mel_cache: Optional[MelCache]
+        If given and `audio` is a path, the log-Mel spectrogram is read from this on-disk cache, or
+        computed and stored in it, so that repeated runs over the same file skip audio decoding
+
+    mel_frontend: str
+        The STFT implementation used to compute the log-Mel spectrogram; see `log_mel_spectrogram()`
+
+    vad_options: Optional[VadOptions]
+        If given, run a voice activity detection pass over the log-Mel frames first, and only
+        transcribe the speech regions it finds within the clips; see `whisper.vad.detect_speech()`
+
+    sample_rate: int
+        The sample rate of `audio` when it is a waveform, which is resampled in-process to 16 kHz
+
+    multichannel: bool
+        Whether to transcribe each channel of the audio separately instead of its downmix, e.g. for
+        recordings with one speaker per channel. A path is decoded with all of its channels in a
+        single pass, and a waveform is taken to have the shape (n_channels, n_samples). The windows
+        of all channels are encoded and decoded together as one batch.
+
+    truncate_audio: bool
+        Whether to encode a window shorter than 30 seconds, such as a short clip or the end of the
+        audio, only up to its length rounded up to a whole second instead of padding it to 30
+        seconds. The encoder and the cross-attention then cost in proportion to the audio, which
+        makes short utterances much faster, but the model was trained on full windows, so the
+        transcripts may be less accurate; see `benchmarks/truncate_audio.py`.
+
+    encoder_cache: Optional[EncoderCache]
+        The cache of audio features that language detection, each decoding attempt and the word
+        alignment of a window share, so that it goes through the encoder once. By default, a new one
+        for each call keeps only the window of language detection and the current window of each
+        channel; pass one to reuse features across calls or read its counters.
+
     Returns
     -------
     A dictionary containing the resulting text ("text") and segment-level details ("segments"), and
     the spoken language ("language"), which is detected when `decode_options["language"]` is None.
+    With `vad_options`, it also contains the number of seconds of audio that were skipped as
+    non-speech ("skipped_duration"). With `multichannel`, the segments of all channels are merged
+    in the order of their start times and tagged with their channel index ("channel"), and the
+    results of the individual channels are listed in "channels".
+    """
+    if multichannel:
+        if isinstance(audio, AudioSource):
+            raise ValueError("An audio source cannot be transcribed per channel")
+        channels = load_audio_channels(audio) if isinstance(audio, str) else audio
+        if channels.ndim != 2:
+            raise ValueError(
+                "A multichannel waveform should have the shape (n_channels, n_samples)"
+            )
+        mel_cache = None  # the cache stores the spectrograms of downmixed files
+    else:
+        channels = [audio]
+
+    if encoder_cache is None:
+        # the window of language detection, and the current window of each channel
+        encoder_cache = EncoderCache(max_entries=len(channels) + 1)
+
+    steps = [
+        _transcribe_steps(
+            model,
+            channel,
+            verbose=verbose,
+            temperature=temperature,
+            compression_ratio_threshold=compression_ratio_threshold,
+            logprob_threshold=logprob_threshold,
+            no_speech_threshold=no_speech_threshold,
+            condition_on_previous_text=condition_on_previous_text,
+            initial_prompt=initial_prompt,
+            carry_initial_prompt=carry_initial_prompt,
+            word_timestamps=word_timestamps,
+            prepend_punctuations=prepend_punctuations,
+            append_punctuations=append_punctuations,
+            clip_timestamps=clip_timestamps,
+            hallucination_silence_threshold=hallucination_silence_threshold,
+            mel_cache=mel_cache,
+            mel_frontend=mel_frontend,
+            vad_options=vad_options,
+            sample_rate=sample_rate,
+            truncate_audio=truncate_audio,
+            encoder_cache=encoder_cache,
+            **decode_options,
+        )
+        for channel in channels
+    ]
+    results = _run_batched(model, steps, encoder_cache, truncate_audio)
+    if not multichannel:
+        return results[0]
+
+    segments = sorted(
+        (
+            {**segment, "channel": channel}
+            for channel, result in enumerate(results)
+            for segment in result["segments"]
+        ),
+        key=lambda segment: (segment["start"], segment["channel"]),
+    )
+    for i, segment in enumerate(segments):
+        segment["id"] = i
+    languages = [result["language"] for result in results]
+    return dict(
+        text="".join(segment["text"] for segment in segments),
+        segments=segments,
+        language=max(languages, key=languages.count),
+        channels=results,
+    )
+
+
+def _run_batched(
+    model: "Whisper",
+    steps: List[Generator],
+    encoder_cache: EncoderCache,
+    truncate_audio: bool = False,
+) -> List[dict]:
+    """
+    Run the generators returned by `_transcribe_steps()` together, batching the decoding requests
+    they make at the same time: the mel segments of all of them that are not in `encoder_cache`
+    go through the encoder at once, and those with the same decoding options are decoded as one
+    batch. The audio features of the segment that each generator is at, and the cross-attention
+    keys and values of the decoder over them, are kept until it moves on, so that decoding the
+    segment again at a higher temperature reuses them. With `truncate_audio`, segments shorter
+    than a full window are encoded only up to their length.
     """
-    dtype = torch.float16 if decode_options.get("fp16", True) else torch.float32
+    results: List[Optional[dict]] = [None] * len(steps)
+    requests: Dict[int, Tuple[torch.Tensor, DecodingOptions]] = {}
+    # the segment that each generator is at, its padded length, features, and keys and values
+    windows: Dict[int, Tuple[torch.Tensor, int, torch.Tensor, List[tuple]]] = {}
+
+    def advance(i: int, decode_result: Optional[DecodingResult]):
+        try:
+            requests[i] = steps[i].send(decode_result)
+        except StopIteration as stop:
+            results[i] = stop.value
+            windows.pop(i, None)
+
+    for i in range(len(steps)):
+        advance(i, None)
+
+    while requests:
+        pending = list(requests.items())
+        requests.clear()
+
+        # truncated windows of different lengths are padded to the longest one
+        n_frames = max(segment.shape[-1] for _, (segment, _) in pending)
+        new = [
+            (i, segment)
+            for i, (segment, _) in pending
+            if i not in windows
+            or windows[i][0] is not segment
+            or windows[i][1] != n_frames
+        ]
+        if new:
+            mel = torch.stack([pad_or_trim(segment, n_frames) for _, segment in new])
+            audio_features = encoder_cache.embed_audio(model, mel, truncate_audio)
+            with torch.no_grad():
+                audio_kv = model.decoder.audio_kv(audio_features)
+            for k, (i, segment) in enumerate(new):
+                window_kv = [(key[k, None], value[k, None]) for key, value in audio_kv]
+                windows[i] = (segment, n_frames, audio_features[k], window_kv)
+
+        groups: List[Tuple[DecodingOptions, List[int]]] = []
+        for i, (_, options) in pending:
+            for group_options, members in groups:
+                if group_options == options:
+                    members.append(i)
+                    break
+            else:
+                groups.append((options, [i]))
+
+        for options, members in groups:
+            audio_features = torch.stack([windows[i][2] for i in members])
+            if len(members) == 1:
+                audio_kv = windows[members[0]][3]
+            else:
+                audio_kv = [
+                    (torch.cat(keys), torch.cat(values))
+                    for keys, values in (
+                        zip(*layer) for layer in zip(*(windows[i][3] for i in members))
+                    )
+                ]
+            decode_results = model.decode(audio_features, options, audio_kv)
+            for i, decode_result in zip(members, decode_results):
+                advance(i, decode_result)
+
+    return results
+
+
+def _transcribe_steps(
+    model: "Whisper",
+    audio: Union[str, np.ndarray, torch.Tensor, AudioSource],
+    *,
+    verbose: Optional[bool],
+    temperature: Union[float, Tuple[float, ...]],
+    compression_ratio_threshold: Optional[float],
+    logprob_threshold: Optional[float],
+    no_speech_threshold: Optional[float],
+    condition_on_previous_text: bool,
+    initial_prompt: Optional[str],
+    carry_initial_prompt: bool,
+    word_timestamps: bool,
+    prepend_punctuations: str,
+    append_punctuations: str,
+    clip_timestamps: Union[str, List[float]],
+    hallucination_silence_threshold: Optional[float],
+    mel_cache: Optional[MelCache],
+    mel_frontend: str,
+    vad_options: Optional[VadOptions],
+    sample_rate: int,
+    truncate_audio: bool,
+    encoder_cache: EncoderCache,
+    **decode_options,
+) -> Generator[Tuple[torch.Tensor, DecodingOptions], DecodingResult, dict]:
+    """
+    The body of `transcribe()` for a single channel, as a generator that yields each mel segment
+    to decode with its options and expects the `DecodingResult` to be sent back
+    """
+    dtype = decode_options.get("dtype")
+    if dtype is None:
+        dtype = "fp16" if decode_options.get("fp16", True) else "fp32"
+    elif dtype not in DTYPES:
+        raise ValueError(f"dtype should be one of {list(DTYPES)}")
     if model.device == torch.device("cpu"):
         if torch.cuda.is_available():
             warnings.warn("Performing inference on CPU when CUDA is available")
-        if dtype == torch.float16:
+        if dtype == "fp16":
             warnings.warn("FP16 is not supported on CPU; using FP32 instead")
-            dtype = torch.float32
+            dtype = "fp32"
+        elif dtype == "bf16" and not bf16_supported(model.device):
+            warnings.warn("BF16 is not supported by this CPU; using FP32 instead")
+            dtype = "fp32"
 
-    if dtype == torch.float32:
+    if dtype == "fp32":
         decode_options["fp16"] = False
+    decode_options["dtype"] = dtype
+    dtype = DTYPES[dtype]
 
-    # Pad 30-seconds of silence to the input audio, for slicing
-    mel = log_mel_spectrogram(audio, model.dims.n_mels, padding=N_SAMPLES)
-    content_frames = mel.shape[-1] - N_FRAMES
-    content_duration = float(content_frames * HOP_LENGTH / SAMPLE_RATE)
+    def window_frames(segment_size: int) -> int:
+        """The number of frames that a window of `segment_size` frames is padded to"""
+        if not truncate_audio:
+            return N_FRAMES
+        seconds = max(math.ceil(segment_size / FRAMES_PER_SECOND), 1)
+        return min(seconds * FRAMES_PER_SECOND, N_FRAMES)
+
+    if isinstance(clip_timestamps, str):
+        clip_timestamps = [
+            float(ts) for ts in (clip_timestamps.split(",") if clip_timestamps else [])
+        ]
+
+    if sample_rate != SAMPLE_RATE:
+        if isinstance(audio, (str, AudioSource)):
+            raise ValueError("sample_rate only applies to waveforms")
+        audio = resample(audio, sample_rate)
+
+    if isinstance(audio, AudioSource):
+        if audio.n_mels != model.dims.n_mels:
+            raise ValueError(
+                f"The audio source has {audio.n_mels} mel bins, but the model expects {model.dims.n_mels}"
+            )
+        source = audio
+    elif isinstance(audio, str) and any(ts > 0 for ts in clip_timestamps):
+        # decode only the clips, which is much faster when they are short parts of a long file
+        clip_ends = clip_timestamps[1::2] + [None] * (len(clip_timestamps) % 2)
+        clips = list(zip(clip_timestamps[::2], clip_ends))
+        source = ClipSource(audio, clips, model.dims.n_mels)
+    else:
+        # Pad 30-seconds of silence to the input audio, for slicing
+        if mel_cache is not None and isinstance(audio, str):
+            mel = mel_cache.log_mel_spectrogram(
+                audio, model.dims.n_mels, N_SAMPLES, frontend=mel_frontend
+            )
+        else:
+            mel = log_mel_spectrogram(
+                audio, model.dims.n_mels, padding=N_SAMPLES, frontend=mel_frontend
+            )
+        source = MelSource(mel, mel.shape[-1] - N_FRAMES)
+
+    # the number of frames of a stream is only known once it has been read to the end
+    content_frames: Optional[int] = source.num_frames
+
+    seek_points: List[int] = [round(ts * FRAMES_PER_SECOND) for ts in clip_timestamps]
+    if len(seek_points) == 0:
+        seek_points.append(0)
+    if len(seek_points) % 2 == 1:
+        # the last clip runs until the end of the audio, which a stream finds out later
+        seek_points.append(
+            content_frames if content_frames is not None else np.iinfo(np.int64).max
+        )
+    seek_clips: List[Tuple[int, int]] = list(zip(seek_points[::2], seek_points[1::2]))
+
+    if vad_options is not None:
+        # only the clips are scanned, e.g. the parts of a ClipSource that are decoded
+        speech_regions = detect_speech(source, vad_options, seek_clips)
+        clip_frames = sum(
+            max(min(end, source.num_frames) - start, 0) for start, end in seek_clips
+        )
+        seek_clips = restrict_clips(seek_clips, speech_regions)
+        skipped_duration = (
+            clip_frames - sum(end - start for start, end in seek_clips)
+        ) / FRAMES_PER_SECOND
+        if verbose:
+            print(f"Skipping {format_timestamp(skipped_duration)} of non-speech audio")
 
     if decode_options.get("language", None) is None:
         if not model.is_multilingual:
@@ -148,8 +449,16 @@ def transcribe(
                 print(
                     "Detecting language using up to the first 30 seconds. Use `--language` to specify the language"
                 )
-            mel_segment = pad_or_trim(mel, N_FRAMES).to(model.device).to(dtype)
-            _, probs = model.detect_language(mel_segment)
+            # the first speech region with VAD, so that skipped audio is never encoded
+            first_frame = seek_clips[0][0] if seek_clips else seek_points[0]
+            n_frames = window_frames(source.window(first_frame, N_FRAMES).shape[-1])
+            # continued into the padding of silence, rather than padded with zeros
+            mel_segment = source.padded_window(first_frame, n_frames)
+            mel_segment = mel_segment.to(model.device).to(dtype)
+            audio_features = encoder_cache.embed_audio(
+                model, mel_segment, truncate_audio
+            )
+            _, probs = model.detect_language(audio_features, truncate=truncate_audio)
             decode_options["language"] = max(probs, key=probs.get)
             if verbose is not None:
                 print(
@@ -165,23 +474,12 @@ def transcribe(
         task=task,
     )
 
-    if isinstance(clip_timestamps, str):
-        clip_timestamps = [
-            float(ts) for ts in (clip_timestamps.split(",") if clip_timestamps else [])
-        ]
-    seek_points: List[int] = [round(ts * FRAMES_PER_SECOND) for ts in clip_timestamps]
-    if len(seek_points) == 0:
-        seek_points.append(0)
-    if len(seek_points) % 2 == 1:
-        seek_points.append(content_frames)
-    seek_clips: List[Tuple[int, int]] = list(zip(seek_points[::2], seek_points[1::2]))
-
     punctuation = "\"'“¿([{-\"'.。,，!！?？:：”)]}、"
 
     if word_timestamps and task == "translate":
         warnings.warn("Word-level timestamps on translations may not be reliable.")
 
-    def decode_with_fallback(segment: torch.Tensor) -> DecodingResult:
+    def decode_with_fallback(segment: torch.Tensor) -> Generator:
         temperatures = (
             [temperature] if isinstance(temperature, (int, float)) else temperature
         )
@@ -198,7 +496,7 @@ def transcribe(
                 kwargs.pop("best_of", None)
 
             options = DecodingOptions(**kwargs, temperature=t)
-            decode_result = model.decode(segment, options)
+            decode_result = yield segment, options
 
             needs_fallback = False
             if (
@@ -224,7 +522,7 @@ def transcribe(
         return decode_result
 
     clip_idx = 0
-    seek = seek_clips[clip_idx][0]
+    seek = seek_clips[clip_idx][0] if seek_clips else 0
     input_stride = exact_div(
         N_FRAMES, model.dims.n_audio_ctx
     )  # mel frames per output token: 2
@@ -280,10 +578,13 @@ def transcribe(
                 continue
             time_offset = float(seek * HOP_LENGTH / SAMPLE_RATE)
             window_end_time = float((seek + N_FRAMES) * HOP_LENGTH / SAMPLE_RATE)
-            segment_size = min(N_FRAMES, content_frames - seek, seek_clip_end - seek)
-            mel_segment = mel[:, seek:seek + segment_size]
+            mel_segment = source.window(seek, min(N_FRAMES, seek_clip_end - seek))
+            segment_size = mel_segment.shape[-1]
+            if segment_size == 0:  # reached the end of the audio
+                break
             segment_duration = segment_size * HOP_LENGTH / SAMPLE_RATE
-            mel_segment = pad_or_trim(mel_segment, N_FRAMES).to(model.device).to(dtype)
+            n_frames = window_frames(segment_size)
+            mel_segment = pad_or_trim(mel_segment, n_frames).to(model.device).to(dtype)
 
             if carry_initial_prompt:
                 nignored = max(len(initial_prompt_tokens), prompt_reset_since)
@@ -292,7 +593,7 @@ def transcribe(
             else:
                 decode_options["prompt"] = all_tokens[prompt_reset_since:]
 
-            result: DecodingResult = decode_with_fallback(mel_segment)
+            result: DecodingResult = yield from decode_with_fallback(mel_segment)
             tokens = torch.tensor(result.tokens)
 
             if no_speech_threshold is not None:
@@ -405,6 +706,8 @@ def transcribe(
                     tokenizer=tokenizer,
                     mel=mel_segment,
                     num_frames=segment_size,
+                    encoder_cache=encoder_cache,
+                    truncate=truncate_audio,
                     prepend_punctuations=prepend_punctuations,
                     append_punctuations=append_punctuations,
                     last_speech_timestamp=last_speech_timestamp,
@@ -465,8 +768,10 @@ def transcribe(
                                     max(time_offset + 1, segment["start"])
                                     * FRAMES_PER_SECOND
                                 )
-                                if content_duration - segment["end"] < threshold:
-                                    seek = content_frames
+                                content_end = segment["end"] + threshold
+                                content_end = math.ceil(content_end * FRAMES_PER_SECOND)
+                                if source.available(content_end) < content_end:
+                                    seek = source.num_frames
                                 current_segments[si:] = []
                                 break
                         hal_last_end = segment["end"]
@@ -505,18 +810,26 @@ def transcribe(
                 prompt_reset_since = len(all_tokens)
 
             # update progress bar
-            pbar.update(min(content_frames, seek) - previous_seek)
+            pbar.update(min(content_frames or seek, seek) - previous_seek)
 
-    return dict(
+    result = dict(
         text=tokenizer.decode(all_tokens[len(initial_prompt_tokens):]),
         segments=all_segments,
         language=language,
     )
+    if vad_options is not None:
+        result["skipped_duration"] = skipped_duration
+    return result
 
 
 def cli():
     from . import available_models
 
+    if sys.argv[1:2] == ["convert"]:
+        from .convert import cli as convert_cli
+
+        return convert_cli(sys.argv[2:])
+
     def valid_model_name(name):
         if name in available_models() or os.path.exists(name):
             return name
@@ -530,6 +843,7 @@ def cli():
     parser.add_argument("--model", default="turbo", type=valid_model_name, help="name of the Whisper model to use")
     parser.add_argument("--model_dir", type=str, default=None, help="the path to save model files; uses ~/.cache/whisper by default")
     parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", help="device to use for PyTorch inference")
+    parser.add_argument("--quantize", type=str, default=None, choices=["int8"], help="quantize the linear layers dynamically, for inference on CPU in float32")
     parser.add_argument("--output_dir", "-o", type=str, default=".", help="directory to save the outputs")
     parser.add_argument("--output_format", "-f", type=str, default="all", choices=["txt", "vtt", "srt", "tsv", "json", "all"], help="format of the output file; if not specified, all available formats will be produced")
     parser.add_argument("--verbose", type=str2bool, default=True, help="whether to print out the progress and debug messages")
@@ -549,6 +863,7 @@ def cli():
 
     parser.add_argument("--condition_on_previous_text", type=str2bool, default=True, help="if True, provide the previous output of the model as a prompt for the next window; disabling may make the text inconsistent across windows, but the model becomes less prone to getting stuck in a failure loop")
     parser.add_argument("--fp16", type=str2bool, default=True, help="whether to perform inference in fp16; True by default")
+    parser.add_argument("--dtype", type=str, default=None, choices=list(DTYPES), help="the dtype to perform inference in, instead of --fp16; bf16 needs a CPU with AVX512-BF16 or AMX, or a recent GPU")
 
     parser.add_argument("--temperature_increment_on_fallback", type=optional_float, default=0.2, help="temperature to increase when falling back when the decoding fails to meet either of the thresholds below")
     parser.add_argument("--compression_ratio_threshold", type=optional_float, default=2.4, help="if the gzip compression ratio is higher than this value, treat the decoding as failed")
@@ -564,6 +879,16 @@ def cli():
     parser.add_argument("--threads", type=optional_int, default=0, help="number of threads used by torch for CPU inference; supercedes MKL_NUM_THREADS/OMP_NUM_THREADS")
     parser.add_argument("--clip_timestamps", type=str, default="0", help="comma-separated list start,end,start,end,... timestamps (in seconds) of clips to process, where the last end timestamp defaults to the end of the file")
     parser.add_argument("--hallucination_silence_threshold", type=optional_float, help="(requires --word_timestamps True) skip silent periods longer than this threshold (in seconds) when a possible hallucination is detected")
+    parser.add_argument("--mel_frontend", type=str, default="torch", choices=available_mel_frontends() + ["auto"], help="the STFT implementation used for the log-Mel spectrogram; 'auto' benchmarks them and uses the fastest")
+    parser.add_argument("--mel_cache_dir", type=str, default=None, help="directory to cache the log-Mel spectrograms of the audio files in, so that repeated runs skip decoding them")
+    parser.add_argument("--mel_cache_size", type=optional_float, default=None, help="(requires --mel_cache_dir) the maximum size of the cache in gigabytes, evicting the least recently used spectrograms; unlimited by default")
+    parser.add_argument("--truncate_audio", type=str2bool, default=False, help="whether to encode windows shorter than 30 seconds only up to their length, which is faster for short audio but may be less accurate")
+    parser.add_argument("--multichannel", type=str2bool, default=False, help="whether to transcribe each channel of the audio separately, e.g. one speaker per channel, instead of their downmix")
+    parser.add_argument("--vad", type=str2bool, default=False, help="whether to detect the speech regions with a voice activity detection pass first, and skip the rest of the audio")
+    parser.add_argument("--vad_threshold", type=float, default=1.0, help="(requires --vad True) how far the energy has to rise above the noise floor to count as speech, in log10 units of power")
+    parser.add_argument("--vad_min_speech_duration", type=float, default=0.25, help="(requires --vad True) the minimum length of a speech region in seconds")
+    parser.add_argument("--vad_min_silence_duration", type=float, default=2.0, help="(requires --vad True) the minimum length of a silence between speech regions in seconds; shorter ones are transcribed")
+    parser.add_argument("--vad_speech_pad", type=float, default=0.5, help="(requires --vad True) the padding added on both sides of each speech region in seconds")
     # fmt: on
 
     args = parser.parse_args().__dict__
@@ -572,8 +897,26 @@ def cli():
     output_dir: str = args.pop("output_dir")
     output_format: str = args.pop("output_format")
     device: str = args.pop("device")
+    quantize: Optional[str] = args.pop("quantize")
     os.makedirs(output_dir, exist_ok=True)
 
+    mel_cache_dir: Optional[str] = args.pop("mel_cache_dir")
+    mel_cache_size: Optional[float] = args.pop("mel_cache_size")
+    if mel_cache_dir is not None:
+        max_size = None if mel_cache_size is None else int(mel_cache_size * 1024**3)
+        args["mel_cache"] = MelCache(mel_cache_dir, max_size)
+    elif mel_cache_size is not None:
+        parser.error("--mel_cache_size requires --mel_cache_dir")
+
+    vad_options = VadOptions(
+        threshold=args.pop("vad_threshold"),
+        min_speech_duration=args.pop("vad_min_speech_duration"),
+        min_silence_duration=args.pop("vad_min_silence_duration"),
+        speech_pad=args.pop("vad_speech_pad"),
+    )
+    if args.pop("vad"):
+        args["vad_options"] = vad_options
+
     if model_name.endswith(".en") and args["language"] not in {"en", "English"}:
         if args["language"] is not None:
             warnings.warn(
@@ -592,7 +935,15 @@ def cli():
 
     from . import load_model
 
-    model = load_model(model_name, device=device, download_root=model_dir)
+    if quantize is not None:
+        device = "cpu"
+    model = load_model(
+        model_name,
+        device=device,
+        download_root=model_dir,
+        quantize=quantize,
+        dtype=args["dtype"],
+    )
 
     writer = get_writer(output_format, output_dir)
     word_options = [
@@ -0,0 +1,203 @@
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+
+from .audio import (
+    FRAMES_PER_SECOND,
+    N_FFT,
+    N_FRAMES,
+    SAMPLE_RATE,
+    AudioSource,
+    AudioStream,
+    mel_filters,
+)
+
+
+@dataclass(frozen=True)
+class VadOptions:
+    # how far the energy in the speech band has to rise above the noise floor, in log10 units
+    # of power (1.0 = 10 dB)
+    threshold: float = 1.0
+
+    # the minimum spread of the log-Mel bins within the speech band, in log10 units; stationary
+    # noise has a flat spectrum, while voiced speech has formants and harmonics
+    min_spectral_contrast: float = 0.5
+
+    # the minimum standard deviation of the band energy over a second around each frame, in log10
+    # units; speech is modulated by syllables, while hums and tones are steady
+    min_energy_variation: float = 0.1
+
+    # the percentile of the per-frame band energy taken as the noise floor
+    noise_percentile: float = 10.0
+
+    # the frequency range used to measure the energy and contrast of speech, in Hz
+    band: Tuple[float, float] = (300.0, 4000.0)
+
+    # drop speech regions shorter than this, in seconds
+    min_speech_duration: float = 0.25
+
+    # merge speech regions separated by shorter silences, in seconds
+    min_silence_duration: float = 2.0
+
+    # extend each speech region on both sides by this much, in seconds
+    speech_pad: float = 0.5
+
+
+def speech_band(n_mels: int, band: Tuple[float, float]) -> torch.Tensor:
+    """Returns the indices of the Mel bins whose center frequency lies within `band`"""
+    filters = mel_filters("cpu", n_mels)
+    centers = filters.argmax(dim=-1) * SAMPLE_RATE / N_FFT
+    return torch.nonzero((centers >= band[0]) & (centers <= band[1]))[:, 0]
+
+
+def frame_features(
+    mel: torch.Tensor, options: VadOptions = VadOptions()
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Compute the band energy and the spectral contrast of each frame of a normalized log-Mel
+    spectrogram, both in log10 units of power
+
+    Returns
+    -------
+    energy, contrast : torch.Tensor, shape = (n_frames,)
+    """
+    bins = speech_band(mel.shape[-2], options.band).to(mel.device)
+    # undo the (x + 4) / 4 scaling of log_mel_spectrogram(); the clamping to the maximum - 8
+    # only raises the quietest frames, which never count as speech anyway
+    log_spec = mel.float()[bins] * 4 - 4
+    energy = torch.logsumexp(log_spec * np.log(10), dim=0) / np.log(10)
+    energy = energy - np.log10(len(bins))
+    contrast = log_spec.std(dim=0)
+    return energy, contrast
+
+
+def _moving_std(x: np.ndarray, width: int) -> np.ndarray:
+    """Returns the standard deviation of `x` over a window of `width` centered on each element"""
+    kernel = np.ones(width) / width
+    padded = np.pad(x.astype(np.float64), width // 2, mode="edge")
+    mean = np.convolve(padded, kernel, mode="same")
+    mean_sq = np.convolve(padded**2, kernel, mode="same")
+    std = np.sqrt(np.maximum(mean_sq - mean**2, 0))
+    return std[width // 2 : width // 2 + len(x)]
+
+
+def _regions(active: np.ndarray) -> List[Tuple[int, int]]:
+    """Returns the [start, end) ranges of consecutive True values"""
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], active.astype(np.int8), [0]])))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def detect_speech(
+    audio: Union[torch.Tensor, AudioSource],
+    options: VadOptions = VadOptions(),
+    clips: Optional[List[Tuple[int, int]]] = None,
+) -> List[Tuple[int, int]]:
+    """
+    Find the regions of an audio that likely contain speech, using the energy, the spectral
+    contrast and the modulation of its log-Mel frames, so that the rest can be skipped without
+    running the model. This is a cheap heuristic that errs on the side of keeping audio: music
+    and noisy speech-like sounds are kept, and it is up to the model to transcribe them or not.
+
+    Parameters
+    ----------
+    audio: Union[torch.Tensor, AudioSource]
+        The normalized log-Mel spectrogram, or an `AudioSource` to read it from window by window
+
+    options: VadOptions
+        The thresholds of the detection
+
+    clips: Optional[List[Tuple[int, int]]]
+        The [start, end) frame ranges to search, in increasing order; the whole audio by default.
+        Only the frames of these ranges are read, and the noise floor is measured over them.
+
+    Returns
+    -------
+    The [start, end) frame ranges of the speech regions, in increasing order
+    """
+    if isinstance(audio, AudioStream):
+        raise ValueError(
+            "Voice activity detection needs more than one pass over the audio"
+        )
+
+    num_frames = audio.num_frames if isinstance(audio, AudioSource) else audio.shape[-1]
+    if clips is None:
+        clips = [(0, num_frames)]
+    clips = [(start, min(end, num_frames)) for start, end in clips]
+    clips = [(start, end) for start, end in clips if start < end]
+
+    features = []
+    for start, end in clips:
+        if isinstance(audio, AudioSource):
+            windows = []
+            for offset in range(start, end, N_FRAMES):
+                window = audio.window(offset, min(N_FRAMES, end - offset))
+                windows.append(frame_features(window, options))
+            energy = torch.cat([energy for energy, _ in windows])
+            contrast = torch.cat([contrast for _, contrast in windows])
+        else:
+            energy, contrast = frame_features(audio[:, start:end], options)
+        features.append((energy.cpu().numpy(), contrast.cpu().numpy()))
+
+    if not features:
+        return []
+
+    noise_floor = np.percentile(
+        np.concatenate([energy for energy, _ in features]), options.noise_percentile
+    )
+    return [
+        (start + region_start, start + region_end)
+        for (start, _), (energy, contrast) in zip(clips, features)
+        for region_start, region_end in _speech_regions(
+            energy, contrast, noise_floor, options
+        )
+    ]
+
+
+def _speech_regions(
+    energy: np.ndarray,
+    contrast: np.ndarray,
+    noise_floor: float,
+    options: VadOptions,
+) -> List[Tuple[int, int]]:
+    """Returns the [start, end) ranges of the speech regions within contiguous frames"""
+    active = (energy > noise_floor + options.threshold) & (
+        contrast > options.min_spectral_contrast
+    )
+    active &= _moving_std(energy, FRAMES_PER_SECOND) > options.min_energy_variation
+
+    min_silence = round(options.min_silence_duration * FRAMES_PER_SECOND)
+    min_speech = round(options.min_speech_duration * FRAMES_PER_SECOND)
+    pad = round(options.speech_pad * FRAMES_PER_SECOND)
+
+    regions: List[Tuple[int, int]] = []
+    for start, end in _regions(active):
+        if regions and start - regions[-1][1] < min_silence:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+
+    padded: List[Tuple[int, int]] = []
+    for start, end in regions:
+        if end - start < min_speech:
+            continue
+        start, end = max(start - pad, 0), min(end + pad, len(energy))
+        if padded and start <= padded[-1][1]:
+            padded[-1] = (padded[-1][0], end)
+        else:
+            padded.append((start, end))
+
+    return padded
+
+
+def restrict_clips(
+    clips: List[Tuple[int, int]], regions: List[Tuple[int, int]]
+) -> List[Tuple[int, int]]:
+    """Returns the parts of the [start, end) frame ranges in `clips` that overlap `regions`"""
+    return [
+        (max(clip_start, start), min(clip_end, end))
+        for clip_start, clip_end in clips
+        for start, end in regions
+        if max(clip_start, start) < min(clip_end, end)
+    ]